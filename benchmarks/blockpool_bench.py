@@ -0,0 +1,69 @@
+"""
+Cost of picking blocks in TagBlockPool as the device grows.
+
+Usage: python -m benchmarks.blockpool_bench [n_cycles]
+
+The pool starts with half of its blocks used. Each cycle erases a random
+used block and picks the least erased free block for data, the way GC
+and new current blocks use the pool. Every 10 cycles it also picks the
+most erased free block, as wear leveling does. The cost of a pick should
+not grow with the number of blocks.
+"""
+import random
+import sys
+import time
+
+from wiscsim.tagblockpool import (TagBlockPool, TFREE, LEAST_ERASED,
+        MOST_ERASED)
+
+
+N_BLOCKS = (2**10, 2**13, 2**15, 2**17)
+TDATA = 'TDATA'
+
+
+def fill(pool, n):
+    return [pool.pick_and_move(src=TFREE, dst=TDATA) for i in range(n)]
+
+
+def run_cycles(pool, used, n_cycles, rand):
+    """
+    used is the list of data blocks, kept by the caller as GC would
+    """
+    pick_time = 0
+    start = time.time()
+    for i in range(n_cycles):
+        victim_index = rand.randrange(len(used))
+        victim = used[victim_index]
+        pool.change_tag(victim, src=TDATA, dst=TFREE)
+
+        if i % 10 == 0:
+            t = time.time()
+            pool.pick(TFREE, choice=MOST_ERASED)
+            pick_time += time.time() - t
+
+        t = time.time()
+        block = pool.pick(TFREE, choice=LEAST_ERASED)
+        pick_time += time.time() - t
+        pool.change_tag(block, src=TFREE, dst=TDATA)
+        used[victim_index] = block
+
+    return time.time() - start, pick_time
+
+
+def main():
+    n_cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    print '{:>10} {:>16} {:>16}'.format('n_blocks', 'pick (us)',
+        'cycle (us)')
+    for n_blocks in N_BLOCKS:
+        pool = TagBlockPool(n_blocks, [TDATA])
+        used = fill(pool, n_blocks / 2)
+        total, pick_time = run_cycles(pool, used, n_cycles,
+                random.Random(1))
+        n_picks = n_cycles + (n_cycles + 9) / 10
+        print '{:>10} {:>16.1f} {:>16.1f}'.format(n_blocks,
+            pick_time / n_picks * 10**6, total / n_cycles * 10**6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Per-update cost of dftldes.MappingCache as the cache grows.
+
+Usage: python -m benchmarks.lpntable_bench [n_updates]
+
+Each size does n_updates updates to new LPNs (inserting to free rows)
+and n_updates overwrites of cached LPNs. Costs should not grow with
+n_cache_entries.
+"""
+import sys
+import time
+
+import simpy
+
+import wiscsim
+from utilities import utils
+
+
+CACHE_SIZES = (2**10, 2**12, 2**14, 2**16, 2**18)
+
+
+def create_config(n_cache_entries):
+    conf = wiscsim.dftldes.Config()
+    utils.set_exp_metadata(conf, save_data = False,
+            expname = 'benchmark', subexpname = 'lpntable')
+    conf['ftl_type'] = 'dftldes'
+    conf.n_cache_entries = n_cache_entries
+    conf.set_flash_num_blocks_by_bytes(
+            int(n_cache_entries * conf.page_size * 1.28))
+    utils.runtime_update(conf)
+    return conf
+
+
+def create_mapping_cache(conf):
+    rec = wiscsim.recorder.Recorder(output_target = conf['output_target'],
+        output_directory = conf['result_dir'],
+        verbose_level = conf['verbose_level'],
+        print_when_finished = conf['print_when_finished'])
+    rec.disable()
+    env = simpy.Environment()
+    oob = wiscsim.dftldes.OutOfBandAreas(conf)
+    block_pool = wiscsim.dftldes.BlockPool(conf)
+    mapping_cache = wiscsim.dftldes.MappingCache(
+            confobj = conf,
+            block_pool = block_pool,
+            flashobj = wiscsim.controller.Controller3(env, conf, rec),
+            oobobj = oob,
+            recorderobj = rec,
+            envobj = env,
+            directory = wiscsim.dftldes.GlobalTranslationDirectory(
+                conf, oob, block_pool),
+            mapping_on_flash = wiscsim.dftldes.MappingOnFlash(conf),
+            trans_page_locks = wiscsim.dftldes.LockPool(env))
+    return env, mapping_cache
+
+
+def time_updates(env, mapping_cache, lpns):
+    def proc():
+        for lpn in lpns:
+            yield env.process(mapping_cache.update(lpn, lpn + 1))
+
+    start = time.time()
+    env.run(until = env.process(proc()))
+    return (time.time() - start) / len(lpns)
+
+
+def main():
+    n_updates = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    print '{:>16} {:>16} {:>16}'.format('n_cache_entries',
+        'insert (us)', 'overwrite (us)')
+    for n_cache_entries in CACHE_SIZES:
+        conf = create_config(n_cache_entries)
+        env, mapping_cache = create_mapping_cache(conf)
+        lpns = range(min(n_updates, n_cache_entries))
+
+        insert_cost = time_updates(env, mapping_cache, lpns)
+        overwrite_cost = time_updates(env, mapping_cache, lpns)
+        print '{:>16} {:>16.1f} {:>16.1f}'.format(n_cache_entries,
+            insert_cost * 10**6, overwrite_cost * 10**6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Hit ratio and simulation speed of the dftldes mapping cache policies.
+
+Usage: python -m benchmarks.policy_bench [n_cache_tps [trace_dir ...]]
+
+Each trace directory is simulated once per policy with a mapping cache
+of n_cache_tps translation pages (default 8). Without trace_dir
+arguments it runs every trace bundled under TRACE_GLOB, a trace with
+empty event files is listed but not simulated. The mkfs events of a
+directory, if any, run before its ftlsim events.
+
+Picking blocks is slow on large devices, so the requests are folded
+into a LBA_BYTES device: offsets wrap around and requests crossing the
+end are cut.
+"""
+import glob
+import itertools
+import os
+import sys
+import time
+
+import wiscsim
+from commons import *
+from utilities import utils
+from wiscsim import hostevent
+
+
+POLICIES = ('LruCache', 'ArrayLruCache', 'ClockCache', 'SegmentedLruCache',
+        'TwoQueueCache', 'GroupLruCache')
+
+TRACE_GLOB = 'tests/testdata/*/subexp-*'
+
+LBA_BYTES = 128 * MB
+
+EVENT_FILES = ('blkparse-events-for-ftlsim-mkfs.txt',
+        'blkparse-events-for-ftlsim.txt')
+
+
+def bundled_trace_dirs():
+    return sorted(os.path.dirname(path) for path in
+            glob.glob(os.path.join(TRACE_GLOB, EVENT_FILES[1])))
+
+
+def has_events(trace_dir):
+    return any(os.path.getsize(os.path.join(trace_dir, name)) > 0
+            for name in EVENT_FILES
+            if os.path.exists(os.path.join(trace_dir, name)))
+
+
+def create_config(policy, n_cache_tps):
+    conf = wiscsim.dftldes.Config()
+    conf['flash_config']['n_pages_per_block'] = 64
+    utils.set_exp_metadata(conf, save_data = False,
+            expname = 'benchmark', subexpname = 'policy')
+    conf['ftl_type'] = 'dftldes'
+    conf['simulator_class'] = 'SimulatorDESNew'
+    conf['mapping_cache_policy'] = policy
+    conf.n_cache_entries = n_cache_tps * conf.n_mapping_entries_per_page
+    conf.set_flash_num_blocks_by_bytes(int(LBA_BYTES * 1.28))
+    utils.runtime_update(conf)
+    return conf
+
+
+def fold_events(event_iter, lba_bytes):
+    for event in event_iter:
+        if isinstance(event, hostevent.Event) and event.action == 'D' and \
+                event.offset >= 0:
+            event.offset = event.offset % lba_bytes
+            event.size = min(event.size, lba_bytes - event.offset)
+            event.lpn_extent = None
+        yield event
+
+
+def trace_events(conf, trace_dir):
+    iters = [[hostevent.ControlEvent(operation = OP_ENABLE_RECORDER)]]
+    for name in EVENT_FILES:
+        path = os.path.join(trace_dir, name)
+        if os.path.exists(path):
+            iters.append(hostevent.event_iter_from_file(conf, path))
+    return fold_events(itertools.chain(*iters), LBA_BYTES)
+
+
+class CountingIterator(object):
+    def __init__(self, event_iter):
+        self.event_iter = event_iter
+        self.n_events = 0
+
+    def __iter__(self):
+        for event in self.event_iter:
+            self.n_events += 1
+            yield event
+
+
+def run(policy, n_cache_tps, trace_dir):
+    conf = create_config(policy, n_cache_tps)
+    events = CountingIterator(trace_events(conf, trace_dir))
+    sim = wiscsim.simulator.SimulatorDESNew(conf, events)
+
+    start = time.time()
+    sim.run()
+    duration = time.time() - start
+
+    counter = sim.recorder.general_accumulator.get('Mapping_Cache', {})
+    hits, misses = counter.get('hit', 0), counter.get('miss', 0)
+    return {
+        'hit_ratio': float(hits) / max(hits + misses, 1),
+        'events_per_sec': events.n_events / duration,
+        'wall_sec': duration,
+        'sim_sec': float(sim.env.now) / SEC,
+        }
+
+
+def main():
+    n_cache_tps = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    trace_dirs = sys.argv[2:] if len(sys.argv) > 2 else \
+            bundled_trace_dirs()
+
+    results = []
+    for trace_dir in trace_dirs:
+        if has_events(trace_dir):
+            policy_results = [(policy, run(policy, n_cache_tps, trace_dir))
+                    for policy in POLICIES]
+        else:
+            policy_results = None
+        results.append((os.path.basename(trace_dir.rstrip('/')),
+            policy_results))
+
+    for trace, policy_results in results:
+        print
+        print trace
+        if policy_results is None:
+            print 'no events, not simulated'
+            continue
+        print '{:>20} {:>10} {:>12} {:>10} {:>10}'.format('policy',
+                'hit ratio', 'events/sec', 'wall (s)', 'sim (s)')
+        for policy, r in policy_results:
+            print '{:>20} {:>10.4f} {:>12.1f} {:>10.2f} {:>10.4f}'.format(
+                    policy, r['hit_ratio'], r['events_per_sec'],
+                    r['wall_sec'], r['sim_sec'])
+
+
+if __name__ == '__main__':
+    main()
@@ -204,6 +204,13 @@ class Config(dict):
             "ftl_type"              : "nkftl2",
             "sector_size"           : 512,
             "sort_block_trace"      : True,
+            # if not None, sort block traces in external memory with
+            # at most this many rows in memory, spilling runs to
+            # blkparse_sort_tmp_dir (None: system default)
+            "blkparse_sort_run_rows": None,
+            "blkparse_sort_tmp_dir" : None,
+            # processes converting unsorted block traces, None: all cpus
+            "blkparse_n_workers"    : 1,
             "trace_issue_and_complete": False,
 
             ############## For wiscsim ######
@@ -256,6 +263,35 @@ class Config(dict):
 
             "event_file_column_names"    : ['pid', 'action', 'operation', 'offset', 'size',
                     'timestamp', 'pre_wait_time', 'sync'],
+            # 'text' or 'binary'. With 'binary', text event files are
+            # converted once to binary traces (.bin) and read by mmap.
+            "event_file_format"     : 'text',
+            # directory of the parsed trace cache shared by experiments,
+            # None to disable it.
+            "trace_cache_dir"       : None,
+            # if > 0, non-DES simulators recycle up to this many events
+            "event_pool_size"       : 0,
+            # if not None, the DES host merges contiguous requests of the
+            # same operation and pid up to this many bytes, if they are
+            # at most coalesce_max_gap seconds apart (None: any gap)
+            "coalesce_max_bytes"    : None,
+            "coalesce_max_gap"      : 0.001,
+            # profile trace files before simulation and save the result
+            # to trace_profile
+            "profile_trace"         : False,
+            "trace_profile"         : None,
+            # size the dftldes lpn table and mappings on flash by
+            # trace_profile. Fewer lpn table rows can change hit ratios,
+            # so it is off by default and recorded in the results when on.
+            # OOB tables are per ppn and always cover the whole device.
+            "size_by_trace_profile" : False,
+            # DES simulation of a window of the trace: the first
+            # warm_up_events data events, or warm_up_bytes bytes, only
+            # warm up FTL state (no timing, no recording), then the next
+            # measure_events events are simulated. None: not limited.
+            "warm_up_events"        : None,
+            "warm_up_bytes"         : None,
+            "measure_events"        : None,
 
             "fs_mount_point"        : "/mnt/fsonloop",
             "mnt_opts" : {
@@ -597,12 +633,10 @@ class ConfigNotForceAlign(ConfigNewFlash):
         The sector extent has to be aligned with page
         return page_start, page_count
         """
-        page = sector / self.n_secs_per_page
-        page_end = (sector + count) / self.n_secs_per_page
-        page_count = page_end - page
-        if (sector + count) % self.n_secs_per_page != 0:
-            page_count += 1
-        return page, page_count
+        n_secs_per_page = self.n_secs_per_page
+        page = sector / n_secs_per_page
+        page_end = (sector + count + n_secs_per_page - 1) / n_secs_per_page
+        return page, page_end - page
 
 
 class ConfigNCQFTL(ConfigNewFlash):
@@ -614,6 +648,9 @@ class ConfigNCQFTL(ConfigNewFlash):
                                 }
         self['process_queue_depth'] = 32
         self['simulator_enable_interval'] = False
+        # how OOB keeps page states: 'bitarray' (2 bits per page) or
+        # 'numpy' (one byte per page, vectorized block queries)
+        self['page_state_backend'] = 'bitarray'
 
     def ssd_ncq_depth(self):
         return self['SSDFramework']['ncq_depth']
@@ -288,6 +288,7 @@ def get_shared_para_dict(expname, lbabytes):
             'rm_blkparse_events': [False],
             'sort_block_trace': [True],
             'n_gc_procs': [16],
+            'trace_cache_dir': [None],
             }
     return para_dict
 
@@ -376,6 +377,8 @@ class ExistingTraceExperiment(Experiment):
         self.conf['lba_workload_configs']['ftlsim_event_path'] = \
                 self.para.ftlsim_path
 
+        self.conf['trace_cache_dir'] = self.para.trace_cache_dir
+
 
 def run_on_real_dev(para):
     Parameters = collections.namedtuple("Parameters", ','.join(para.keys()))
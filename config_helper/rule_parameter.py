@@ -8,10 +8,16 @@ from config import WLRUNNER, LBAGENERATOR, LBAMULTIPROC
 
 
 class ParaDict(object):
-    def __init__(self, expname, trace_expnames, rule):
+    """
+    If trace_cache_dir is set, e.g. to '/tmp/trace-cache', parsed traces
+    are cached there and shared by all sub-experiments of the sweep.
+    """
+    def __init__(self, expname, trace_expnames, rule,
+            trace_cache_dir=None):
         self.expname = expname
         self.trace_expnames = trace_expnames
         self.rule = rule
+        self.trace_cache_dir = trace_cache_dir
 
     def __iter__(self):
         expname = self.expname
@@ -28,7 +34,7 @@ class ParaDict(object):
                 'mkfs_path': event_set['mkfs_path'],
                 'ftlsim_path': event_set['ftlsim_path'],
                 'expname': expname,
-
+                'trace_cache_dir': self.trace_cache_dir,
                 })
 
             para_iter = self.get_para_iter(para_dict)
@@ -0,0 +1,135 @@
+import bz2
+import gzip
+import Queue
+import subprocess
+import threading
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.xz')
+
+# a sentinel telling the consumer that the producer has finished
+_END = object()
+
+
+def is_compressed(path):
+    return path.endswith(COMPRESSED_SUFFIXES)
+
+
+def open_decompressed(path):
+    """
+    Return a file-like object of the decompressed content of path.
+    Without the lzma module, .xz files are decompressed by `xz -dc`.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    elif path.endswith('.bz2'):
+        return bz2.BZ2File(path, 'rb')
+    elif path.endswith('.xz'):
+        if lzma is not None:
+            return lzma.open(path, 'rb')
+        else:
+            return XzPipe(path)
+    else:
+        raise ValueError("{} is not a compressed file".format(path))
+
+
+class XzPipe(object):
+    def __init__(self, path):
+        self.proc = subprocess.Popen(['xz', '-dc', path],
+                stdout=subprocess.PIPE)
+
+    def __iter__(self):
+        return iter(self.proc.stdout)
+
+    def close(self):
+        self.proc.stdout.close()
+        ret = self.proc.wait()
+        # a negative return code means we closed the pipe early
+        if ret > 0:
+            raise RuntimeError("xz -dc returned {}".format(ret))
+
+
+class BackgroundLineReader(object):
+    """
+    Iterate lines of a compressed file. A background thread decompresses
+    the file and puts batches of lines to a bounded queue, so
+    decompression overlaps with the work on the lines. At most
+    max_batches * batch_lines lines are buffered.
+    """
+    def __init__(self, path, batch_lines=1024, max_batches=64):
+        self.path = path
+        self.batch_lines = batch_lines
+        self.max_batches = max_batches
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        pass
+
+    def __iter__(self):
+        queue = Queue.Queue(maxsize=self.max_batches)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(queue, stop))
+        thread.daemon = True
+        thread.start()
+
+        try:
+            while True:
+                batch = queue.get()
+                if batch is _END:
+                    break
+                elif isinstance(batch, Exception):
+                    raise batch
+                for line in batch:
+                    yield line
+        finally:
+            stop.set()
+            thread.join()
+
+    def _produce(self, queue, stop):
+        try:
+            f = open_decompressed(self.path)
+            try:
+                batch = []
+                for line in f:
+                    batch.append(line)
+                    if len(batch) == self.batch_lines:
+                        if not self._put(queue, stop, batch):
+                            return
+                        batch = []
+                if len(batch) > 0:
+                    self._put(queue, stop, batch)
+            finally:
+                f.close()
+        except Exception as e:
+            self._put(queue, stop, e)
+        else:
+            self._put(queue, stop, _END)
+
+    def _put(self, queue, stop, item):
+        """
+        Return False if the consumer has stopped iterating
+        """
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+
+def open_lines(path):
+    """
+    Return an iterable of the lines of path, which may be compressed
+    """
+    if is_compressed(path):
+        return BackgroundLineReader(path)
+    else:
+        return open(path, 'r')
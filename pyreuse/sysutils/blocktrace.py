@@ -1,23 +1,53 @@
+import heapq
+import multiprocessing
 import os
 import re
+import shutil
 import subprocess
+import tempfile
 import time
 
 from pyreuse.helpers import *
+from pyreuse.general.compressedfile import is_compressed, open_lines
 from pyreuse.macros import *
 
+def _convert_blkparse_chunk(args):
+    """
+    Worker of BlktraceResult.create_event_file(). It is a module-level
+    function so multiprocessing can pickle it.
+    """
+    init_kwargs, start, end, chunk_path = args
+    BlktraceResult(**init_kwargs).convert_byte_range(start, end, chunk_path)
+    return chunk_path
+
+
 class BlktraceResult(object):
     """
     Parse blkparse output
+
+    With n_workers > 1, files of at least PARALLEL_MIN_BYTES bytes are
+    split into byte ranges on line boundaries and converted by a process
+    pool. The chunks are concatenated in order, so the event file is the
+    same as the serial one.
+
+    .gz, .bz2 and .xz files are decompressed in a background thread and
+    converted serially.
     """
+    PARALLEL_MIN_BYTES = 64 * MB
+    # chunks per worker, more chunks balance the load better
+    CHUNKS_PER_WORKER = 4
+
     def __init__(self, sector_size, event_file_column_names,
             raw_blkparse_file_path, parsed_output_path,
-            padding_bytes=0, do_sort=True):
+            padding_bytes=0, do_sort=True, n_workers=1):
         self.raw_blkparse_file_path = raw_blkparse_file_path
         self.parsed_output_path = parsed_output_path
         self.sector_size = sector_size
         self.event_file_column_names = event_file_column_names
         self.do_sort = do_sort
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        self.n_workers = n_workers
 
         # event offset + padding_bytes = blktrace addr
         #
@@ -31,10 +61,46 @@ class BlktraceResult(object):
     def create_event_file(self):
         prepare_dir_for_path(self.parsed_output_path)
 
-        out_file = open(self.parsed_output_path, 'w')
+        file_size = os.path.getsize(self.raw_blkparse_file_path)
+        if is_compressed(self.raw_blkparse_file_path):
+            with open(self.parsed_output_path, 'w') as out_file:
+                self.__convert_lines(
+                        open_lines(self.raw_blkparse_file_path), out_file)
+                out_file.flush()
+                os.fsync(out_file)
+        elif self.n_workers > 1 and file_size >= self.PARALLEL_MIN_BYTES:
+            self.__create_event_file_parallel(file_size)
+        else:
+            self.convert_byte_range(0, file_size, self.parsed_output_path)
+
+    def convert_byte_range(self, start, end, out_path):
+        """
+        Convert the lines starting in [start, end) of the raw file
+        """
+        out_file = open(out_path, 'w')
         in_file = open(self.raw_blkparse_file_path, 'r')
 
-        for line in in_file:
+        # the line with byte start - 1 belongs to the previous range
+        if start > 0:
+            in_file.seek(start - 1)
+            in_file.readline()
+
+        self.__convert_lines(self.__lines_before(in_file, end), out_file)
+
+        in_file.close()
+        out_file.flush()
+        os.fsync(out_file)
+        out_file.close()
+
+    def __lines_before(self, in_file, end):
+        while in_file.tell() < end:
+            line = in_file.readline()
+            if line == '':
+                break
+            yield line
+
+    def __convert_lines(self, lines, out_file):
+        for line in lines:
             line = line.strip()
             if not is_data_line(line):
                 continue
@@ -46,9 +112,41 @@ class BlktraceResult(object):
             line = self.__create_event_line(row_dict)
             out_file.write( line + '\n' )
 
-        out_file.flush()
-        os.fsync(out_file)
-        out_file.close()
+    def __create_event_file_parallel(self, file_size):
+        init_kwargs = {
+            'sector_size': self.sector_size,
+            'event_file_column_names': self.event_file_column_names,
+            'raw_blkparse_file_path': self.raw_blkparse_file_path,
+            'parsed_output_path': None,
+            'padding_bytes': self.padding_bytes,
+            'do_sort': self.do_sort,
+            }
+
+        n_chunks = self.n_workers * self.CHUNKS_PER_WORKER
+        bounds = [file_size * i / n_chunks for i in range(n_chunks + 1)]
+
+        chunk_dir = tempfile.mkdtemp(prefix='blkparse-chunks-',
+                dir=os.path.dirname(os.path.abspath(self.parsed_output_path)))
+        try:
+            jobs = [(init_kwargs, bounds[i], bounds[i + 1],
+                    os.path.join(chunk_dir, 'chunk-{}'.format(i)))
+                    for i in range(n_chunks)]
+
+            pool = multiprocessing.Pool(self.n_workers)
+            try:
+                chunk_paths = pool.map(_convert_blkparse_chunk, jobs)
+            finally:
+                pool.terminate()
+                pool.join()
+
+            with open(self.parsed_output_path, 'w') as out_file:
+                for chunk_path in chunk_paths:
+                    with open(chunk_path, 'r') as chunk_file:
+                        shutil.copyfileobj(chunk_file, out_file)
+                out_file.flush()
+                os.fsync(out_file)
+        finally:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
 
 
     def __line_to_dic(self, line):
@@ -104,15 +202,27 @@ class BlktraceResult(object):
 class BlktraceResultInMem(object):
     """
     Parse blkparse output
+
+    If sort_run_rows is None, the whole trace is parsed into memory and
+    sorted there. Otherwise the trace is sorted in external memory: at
+    most sort_run_rows rows are held in memory at a time, each sorted run
+    is spilled to a file under tmp_dir, and the runs are k-way merged to
+    one event file while pre_wait_time is calculated.
     """
+    # max number of runs merged at the same time
+    MERGE_FANIN = 128
+
     def __init__(self, sector_size, event_file_column_names,
             raw_blkparse_file_path, parsed_output_path,
-            padding_bytes=0, do_sort=True):
+            padding_bytes=0, do_sort=True, sort_run_rows=None, tmp_dir=None):
         self.raw_blkparse_file_path = raw_blkparse_file_path
         self.parsed_output_path = parsed_output_path
         self.sector_size = sector_size
         self.event_file_column_names = event_file_column_names
         self.do_sort = do_sort
+        self.sort_run_rows = sort_run_rows
+        self.tmp_dir = tmp_dir
+        self.__sort_dir = None
 
         # event offset + padding_bytes = blktrace addr
         #
@@ -123,7 +233,21 @@ class BlktraceResultInMem(object):
         # blktrace address - 8MB = event address
         self.padding_bytes = padding_bytes
 
-        self.__parse_rawfile()
+        if self.sort_run_rows is None:
+            self.__parse_rawfile()
+        else:
+            self.__parse_rawfile_external()
+
+    def __del__(self):
+        self.cleanup()
+
+    def cleanup(self):
+        """
+        Remove temporary files of external sort
+        """
+        if self.__sort_dir is not None:
+            shutil.rmtree(self.__sort_dir, ignore_errors=True)
+            self.__sort_dir = None
 
     def __line_to_dic(self, line):
         """
@@ -184,7 +308,7 @@ class BlktraceResultInMem(object):
         return event_table
 
     def __parse_rawfile(self):
-        with open(self.raw_blkparse_file_path, 'r') as line_iter:
+        with open_lines(self.raw_blkparse_file_path) as line_iter:
             table = []
             for line in line_iter:
                 line = line.strip()
@@ -202,6 +326,124 @@ class BlktraceResultInMem(object):
 
         self.__parsed_table = table
 
+    def __parse_rawfile_external(self):
+        """
+        Spill sorted runs of at most sort_run_rows rows, then merge them.
+        A run line is '<timestamp> <seqid> <event line>', seqid keeps rows
+        of the same timestamp in file order, as the in-memory sort does.
+        """
+        self.__sort_dir = tempfile.mkdtemp(prefix='blkparse-sort-',
+                dir=self.tmp_dir)
+        self.__sectors = {}
+        self.__first_timestamp = None
+        self.__last_timestamp = None
+
+        run_paths = []
+        run = []
+        with open_lines(self.raw_blkparse_file_path) as line_iter:
+            for line in line_iter:
+                line = line.strip()
+                if not is_data_line(line):
+                    continue
+
+                row = self.__line_to_dic(line)
+                row['type'] = 'blkparse'
+                row['pre_wait_time'] = 'NA'
+                self.__add_to_stats(row)
+
+                run.append((float(row['timestamp']), len(run_paths), len(run),
+                    row['timestamp'], self.__create_event_line(row)))
+                if len(run) == self.sort_run_rows:
+                    run_paths.append(self.__spill_run(run, len(run_paths)))
+                    run = []
+
+        if len(run) > 0 or len(run_paths) == 0:
+            run_paths.append(self.__spill_run(run, len(run_paths)))
+
+        # merge in passes so no more than MERGE_FANIN files are open
+        while len(run_paths) > self.MERGE_FANIN:
+            merged_paths = []
+            for i in range(0, len(run_paths), self.MERGE_FANIN):
+                group = run_paths[i:i + self.MERGE_FANIN]
+                path = os.path.join(self.__sort_dir,
+                        'pass-{}-{}'.format(len(run_paths), i))
+                with open(path, 'w') as out:
+                    for _, seqid, timestamp, event_line in \
+                            self.__merge_runs(group):
+                        out.write('{} {} {}\n'.format(timestamp, seqid,
+                            event_line))
+                for run_path in group:
+                    os.remove(run_path)
+                merged_paths.append(path)
+            run_paths = merged_paths
+
+        self.__sorted_path = os.path.join(self.__sort_dir, 'sorted')
+        with open(self.__sorted_path, 'w') as out:
+            self.__write_events(self.__merge_runs(run_paths), out)
+        for run_path in run_paths:
+            os.remove(run_path)
+
+    def __add_to_stats(self, row):
+        op = row['operation']
+        self.__sectors[op] = self.__sectors.get(op, 0) + \
+                int(row['sector_count'])
+
+        timestamp = float(row['timestamp'])
+        if self.__first_timestamp is None:
+            self.__first_timestamp = timestamp
+            self.__last_timestamp = timestamp
+        elif self.do_sort is True:
+            self.__first_timestamp = min(self.__first_timestamp, timestamp)
+            self.__last_timestamp = max(self.__last_timestamp, timestamp)
+        else:
+            self.__last_timestamp = timestamp
+
+    def __spill_run(self, run, run_id):
+        if self.do_sort is True:
+            run.sort()
+        path = os.path.join(self.__sort_dir, 'run-{}'.format(run_id))
+        with open(path, 'w') as out:
+            for _, _, row_id, timestamp, event_line in run:
+                out.write('{} {}.{} {}\n'.format(timestamp, run_id, row_id,
+                    event_line))
+        return path
+
+    def __read_run(self, path):
+        with open(path, 'r') as f:
+            for line in f:
+                timestamp, seqid, event_line = line.rstrip('\n').split(' ', 2)
+                run_id, row_id = seqid.split('.')
+                if self.do_sort is True:
+                    key = (float(timestamp), int(run_id), int(row_id))
+                else:
+                    key = (int(run_id), int(row_id))
+                yield key, seqid, timestamp, event_line
+
+    def __merge_runs(self, run_paths):
+        return heapq.merge(*[self.__read_run(path) for path in run_paths])
+
+    def __write_events(self, sorted_rows, out):
+        pre_wait_index = self.event_file_column_names.index('pre_wait_time') \
+                if 'pre_wait_time' in self.event_file_column_names else None
+
+        prev_timestamp = None
+        for _, _, timestamp, event_line in sorted_rows:
+            timestamp = float(timestamp)
+            if prev_timestamp is None:
+                pre_wait_time = 0
+            else:
+                pre_wait_time = timestamp - prev_timestamp
+                if self.do_sort is True:
+                    assert pre_wait_time >= 0, \
+                        "data is {}".format(pre_wait_time)
+            prev_timestamp = timestamp
+
+            if pre_wait_index is not None:
+                columns = event_line.split(' ')
+                columns[pre_wait_index] = str(pre_wait_time)
+                event_line = ' '.join(columns)
+            out.write(event_line + '\n')
+
     def __create_event_line(self, line_dict):
         columns = [str(line_dict[colname])
                 for colname in self.event_file_column_names]
@@ -210,6 +452,10 @@ class BlktraceResultInMem(object):
 
     def create_event_file(self):
         prepare_dir_for_path(self.parsed_output_path)
+        if self.sort_run_rows is not None:
+            shutil.copyfile(self.__sorted_path, self.parsed_output_path)
+            return
+
         out = open(self.parsed_output_path, 'w')
         for row_dict in self.__parsed_table:
             if row_dict['type'] == 'blkparse':
@@ -224,10 +470,16 @@ class BlktraceResultInMem(object):
         out.close()
 
     def get_duration(self):
+        if self.sort_run_rows is not None:
+            return self.__last_timestamp - self.__first_timestamp
+
         return float(self.__parsed_table[-1]['timestamp']) - \
                 float(self.__parsed_table[0]['timestamp'])
 
     def count_sectors(self, operation):
+        if self.sort_run_rows is not None:
+            return self.__sectors.get(operation, 0)
+
         sectors_cnt = 0
         for row in self.__parsed_table:
             if row['operation'] == operation:
@@ -247,7 +499,8 @@ class BlockTraceManager(object):
     "This class provides interfaces to interact with blktrace"
     def __init__(self, dev, event_file_column_names,
             resultpath, to_ftlsim_path, sector_size, padding_bytes=0,
-            do_sort=True):
+            do_sort=True, sort_run_rows=None, sort_tmp_dir=None,
+            n_workers=1):
         self.dev = dev
         self.sector_size = sector_size
         self.event_file_column_names = event_file_column_names
@@ -256,6 +509,9 @@ class BlockTraceManager(object):
         self.sector_size = sector_size
         self.padding_bytes = padding_bytes
         self.do_sort = do_sort
+        self.sort_run_rows = sort_run_rows
+        self.sort_tmp_dir = sort_tmp_dir
+        self.n_workers = n_workers
 
     def start_tracing_and_collecting(self, trace_filter=None):
         self.proc = start_blktrace_on_bg(self.dev, self.resultpath, trace_filter)
@@ -269,16 +525,20 @@ class BlockTraceManager(object):
                     self.event_file_column_names,
                     self.resultpath, self.to_ftlsim_path,
                     padding_bytes=self.padding_bytes,
-                    do_sort=self.do_sort
+                    do_sort=self.do_sort,
+                    sort_run_rows=self.sort_run_rows,
+                    tmp_dir=self.sort_tmp_dir
                     )
             rawparser.create_event_file()
+            rawparser.cleanup()
 
         else:
             rawparser = BlktraceResult(self.sector_size,
                     self.event_file_column_names,
                     self.resultpath, self.to_ftlsim_path,
                     padding_bytes=self.padding_bytes,
-                    do_sort=self.do_sort
+                    do_sort=self.do_sort,
+                    n_workers=self.n_workers
                     )
             rawparser.create_event_file()
 
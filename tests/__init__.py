@@ -6,3 +6,4 @@ import recorder_test
 import simulator_test
 import test_dftldes
 import test_bitmap
+import test_oobareas
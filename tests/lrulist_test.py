@@ -1,7 +1,8 @@
 import unittest
 
 import wiscsim
-from wiscsim.lrulist import LinkedList, Node, LruDict, LruCache
+from wiscsim.lrulist import LinkedList, Node, LruDict, LruCache, ArrayLruCache, \
+        SegmentedLruCache, ClockCache, TwoQueueCache, GroupLruCache
 import profile
 
 
@@ -118,6 +119,17 @@ class Test_LruCache(unittest.TestCase):
         self.assertEqual(d.victim_key(), 10)
         self.assertEqual(d.most_recently_used_key(), 9)
 
+    def test_add_to_least_used_when_empty(self):
+        d = self.get_lrucache()
+        for i in range(10):
+            del d[i]
+
+        d.add_as_least_used(1, 11)
+        d[2] = 22
+        self.assertEqual(d.victim_key(), 1)
+        self.assertEqual(d.most_recently_used_key(), 2)
+        self.assertListEqual(list(d), [2, 1])
+
     def _test_performance(self):
         d = LruDict()
         for i in range(2048):
@@ -129,6 +141,150 @@ class Test_LruCache(unittest.TestCase):
             v = 1
 
 
+class Test_ArrayLruCache(Test_LruCache):
+    """
+    ArrayLruCache has to pass all the tests of LruCache
+    """
+    def get_lrucache(self):
+        d = ArrayLruCache(16)
+        for i in range(10):
+            d[i] = i*10
+        return d
+
+    def test_init(self):
+        d = ArrayLruCache(4)
+        self.assertEqual(len(d), 0)
+        self.assertListEqual(list(d), [])
+
+    def test_slot_reuse(self):
+        d = ArrayLruCache(2)
+        d[1] = 11
+        d[2] = 22
+        del d[1]
+        d[3] = 33
+        self.assertListEqual(list(d.least_to_most_items()), [(2, 22), (3, 33)])
+
+    def test_slot_of(self):
+        d = ArrayLruCache(4, slot_of = lambda v: v % 4)
+        d[1] = 5
+        d[2] = 2
+        self.assertEqual(d.table[1], 1)
+        self.assertEqual(d.table[2], 2)
+        d.add_as_least_used(3, 7)
+        self.assertEqual(d.victim_key(), 3)
+
+    def test_delete_while_iterating(self):
+        d = self.get_lrucache()
+        for k, v in d.least_to_most_items():
+            del d[k]
+        self.assertEqual(len(d), 0)
+
+
+
+
+class Test_SegmentedLruCache(unittest.TestCase):
+    def test_victim_order(self):
+        d = SegmentedLruCache(4, 0.5)
+        for i in range(4):
+            d[i] = i
+        d[1]
+        d.add_as_least_used(9, 9)
+        self.assertEqual(d.victim_key(), 9)
+        self.assertListEqual([k for k, _ in d.least_to_most_items()],
+                [9, 0, 2, 3, 1])
+
+
+class Test_ClockCache(unittest.TestCase):
+    def test_second_chance(self):
+        d = ClockCache()
+        for i in range(4):
+            d[i] = i * 10
+        d[0]
+        d[2]
+        self.assertEqual(d.peek(0), 0)
+        self.assertEqual(d.victim_key(), 1)
+        self.assertListEqual([k for k, _ in d.least_to_most_items()],
+                [1, 3, 0, 2])
+
+        # the hand passes 0 to evict 1, 0 gets its second chance and
+        # the hand stops at 2 next time
+        del d[1]
+        self.assertListEqual([k for k, _ in d.least_to_most_items()],
+                [3, 0, 2])
+
+    def test_add_as_least_used(self):
+        d = ClockCache()
+        d[1] = 1
+        d.add_as_least_used(2, 2)
+        self.assertEqual(d.victim_key(), 2)
+
+    def test_delete_while_iterating(self):
+        d = ClockCache()
+        for i in range(8):
+            d[i] = i
+            if i % 2 == 0:
+                d[i]
+        keys = []
+        for k, v in d.least_to_most_items():
+            keys.append(k)
+            del d[k]
+        self.assertEqual(len(d), 0)
+        self.assertListEqual(sorted(keys), range(8))
+
+
+class Test_TwoQueueCache(unittest.TestCase):
+    def test_a1in_is_fifo(self):
+        d = TwoQueueCache(8)
+        for i in range(4):
+            d[i] = i
+        d[0]
+        # a1in is larger than its share, victims come from it
+        self.assertEqual(d.victim_key(), 0)
+
+    def test_ghost_goes_to_am(self):
+        d = TwoQueueCache(8)
+        for i in range(4):
+            d[i] = i
+        del d[0]
+        d[0] = 0
+        self.assertIs(d.table[0].owner_list, d.am)
+        self.assertIs(d.table[1].owner_list, d.a1in)
+        self.assertListEqual([k for k, _ in d.least_to_most_items()],
+                [1, 2, 3, 0])
+
+    def test_prefetched(self):
+        d = TwoQueueCache(8)
+        d[1] = 1
+        d.add_as_least_used(2, 2)
+        self.assertEqual(d.victim_key(), 2)
+        d[2]
+        self.assertEqual(d.victim_key(), 1)
+        # evicting a prefetched entry that was never hit leaves no ghost
+        d.add_as_least_used(3, 3)
+        del d[3]
+        self.assertNotIn(3, d.a1out)
+
+
+class Test_GroupLruCache(unittest.TestCase):
+    def test_groups(self):
+        d = GroupLruCache(group_of = lambda k: k / 10)
+        d[1] = 1
+        d[11] = 11
+        d[2] = 2
+        self.assertEqual(d.victim_key(), 11)
+
+        d.add_as_least_used(21, 21)
+        self.assertEqual(d.victim_key(), 21)
+
+        d[12] = 12
+        self.assertListEqual(sorted(k for k, _ in d.least_to_most_items())[:2],
+                [1, 2])
+        self.assertListEqual([k for k, _ in d.least_to_most_items()][:1],
+                [21])
+
+        del d[21]
+        self.assertEqual(len(d.groups), 2)
+        self.assertEqual(d.victim_key() / 10, 0)
 
 
 class Test_LruDict(unittest.TestCase):
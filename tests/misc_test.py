@@ -1,8 +1,10 @@
+import os
 import socket
 import unittest
 import time
 import copy
 import pprint
+import shutil
 
 import workrunner
 import wiscsim
@@ -14,6 +16,10 @@ from wiscsim.simulator import GcLog
 from wiscsim.ftlsim_commons import Extent, random_channel_id
 from wiscsim.ftlcounter import LpnClassification, get_file_range_table, EventNCQParser
 from wiscsim import hostevent
+from wiscsim.tracecache import TraceCache
+from wiscsim import traceprofile
+from wiscsim import dftldes
+from pyreuse.sysutils import blocktrace
 from config_helper.rule_parameter import EventFileSets
 from commons import *
 
@@ -200,6 +206,473 @@ class TestNCQParser(unittest.TestCase):
         self.assertEqual(table[1]['post_depth'], 0)
 
 
+class TestBlktraceParallel(unittest.TestCase):
+    def convert(self, out_path, n_workers):
+        conf = ConfigNCQFTL()
+        result = blocktrace.BlktraceResult(
+                sector_size=conf['sector_size'],
+                event_file_column_names=conf['event_file_column_names'],
+                raw_blkparse_file_path='tests/testdata/blkparse-output.txt',
+                parsed_output_path=out_path,
+                n_workers=n_workers)
+        result.create_event_file()
+        with open(out_path, 'r') as f:
+            return f.readlines()
+
+    def test_same_as_serial(self):
+        serial_lines = self.convert('/tmp/test_blktrace_parallel/serial.txt',
+                n_workers=1)
+
+        min_bytes = blocktrace.BlktraceResult.PARALLEL_MIN_BYTES
+        blocktrace.BlktraceResult.PARALLEL_MIN_BYTES = 0
+        try:
+            parallel_lines = self.convert(
+                    '/tmp/test_blktrace_parallel/parallel.txt', n_workers=3)
+        finally:
+            blocktrace.BlktraceResult.PARALLEL_MIN_BYTES = min_bytes
+
+        self.assertTrue(len(serial_lines) > 0)
+        self.assertListEqual(serial_lines, parallel_lines)
+        self.assertEqual(sorted(os.listdir('/tmp/test_blktrace_parallel')),
+                ['parallel.txt', 'serial.txt'])
+
+
+class TestCompressedInput(unittest.TestCase):
+    def compress(self, path, suffix):
+        out_path = os.path.join('/tmp/test_compressed_input',
+                os.path.basename(path) + suffix)
+        utils.prepare_dir_for_path(out_path)
+        cmd = {'.gz': 'gzip', '.bz2': 'bzip2', '.xz': 'xz'}[suffix]
+        utils.shcmd("{} -c {} > {}".format(cmd, path, out_path))
+        return out_path
+
+    def test_file_line_iterator(self):
+        path = "tests/testdata/sqlitewal-update/subexp-7928737328932659543-"\
+            "ext4-10-07-23-50-10--2726320246496492803/blkparse-events-for-ftlsim.txt"
+        lines = list(hostevent.FileLineIterator(path))
+        for suffix in ('.gz', '.bz2', '.xz'):
+            compressed_path = self.compress(path, suffix)
+            self.assertListEqual(lines,
+                    list(hostevent.FileLineIterator(compressed_path)))
+
+            # stopping early must not leave the reader thread blocked
+            for i, line in enumerate(hostevent.FileLineIterator(
+                    compressed_path)):
+                if i == 10:
+                    break
+
+    def test_blktrace_result(self):
+        conf = ConfigNCQFTL()
+        path = 'tests/testdata/blkparse-output.txt'
+        compressed_path = self.compress(path, '.gz')
+
+        lines = []
+        for raw_path in (path, compressed_path):
+            out_path = '/tmp/test_compressed_input/events.txt'
+            blocktrace.BlktraceResult(
+                    sector_size=conf['sector_size'],
+                    event_file_column_names=conf['event_file_column_names'],
+                    raw_blkparse_file_path=raw_path,
+                    parsed_output_path=out_path).create_event_file()
+            with open(out_path, 'r') as f:
+                lines.append(f.readlines())
+
+        self.assertTrue(len(lines[0]) > 0)
+        self.assertListEqual(lines[0], lines[1])
+
+
+class TestBlktraceExternalSort(unittest.TestCase):
+    def parse(self, out_path, **kwargs):
+        conf = ConfigNCQFTL()
+        result = blocktrace.BlktraceResultInMem(
+                sector_size=conf['sector_size'],
+                event_file_column_names=conf['event_file_column_names'],
+                raw_blkparse_file_path='tests/testdata/blkparse-output.txt',
+                parsed_output_path=out_path,
+                **kwargs)
+        result.create_event_file()
+        with open(out_path, 'r') as f:
+            lines = f.readlines()
+        return result, lines
+
+    def test_same_as_in_mem(self):
+        for do_sort in (True, False):
+            mem_result, mem_lines = self.parse(
+                    '/tmp/test_blktrace_sort/in-mem.txt', do_sort=do_sort)
+            ext_result, ext_lines = self.parse(
+                    '/tmp/test_blktrace_sort/external.txt', do_sort=do_sort,
+                    sort_run_rows=50)
+            ext_result.cleanup()
+
+            self.assertTrue(len(mem_lines) > 50)
+            self.assertListEqual(mem_lines, ext_lines)
+            self.assertEqual(mem_result.get_duration(),
+                    ext_result.get_duration())
+            self.assertEqual(mem_result.count_sectors('read'),
+                    ext_result.count_sectors('read'))
+
+    def test_merge_passes(self):
+        _, mem_lines = self.parse('/tmp/test_blktrace_sort/in-mem.txt')
+
+        fanin = blocktrace.BlktraceResultInMem.MERGE_FANIN
+        blocktrace.BlktraceResultInMem.MERGE_FANIN = 3
+        try:
+            _, ext_lines = self.parse('/tmp/test_blktrace_sort/external.txt',
+                    sort_run_rows=7)
+        finally:
+            blocktrace.BlktraceResultInMem.MERGE_FANIN = fanin
+
+        self.assertListEqual(mem_lines, ext_lines)
+
+
+class TestBinaryTrace(unittest.TestCase):
+    def test_same_events_as_text(self):
+        conf = ConfigNCQFTL()
+        text_path = "tests/testdata/sqlitewal-update/subexp-7928737328932659543-"\
+            "ext4-10-07-23-50-10--2726320246496492803/blkparse-events-for-ftlsim.txt"
+        bin_path = "/tmp/test_binary_trace/blkparse-events-for-ftlsim.bin"
+
+        hostevent.convert_event_file_to_binary(conf, text_path, bin_path)
+        self.assertTrue(hostevent.is_binary_trace(bin_path))
+        self.assertFalse(hostevent.is_binary_trace(text_path))
+
+        text_events = list(hostevent.EventIterator(conf,
+            hostevent.FileLineIterator(text_path)))
+        bin_events = list(hostevent.event_iter_from_file(conf, bin_path))
+
+        self.assertEqual(len(text_events), len(bin_events))
+        for text_event, bin_event in zip(text_events, bin_events):
+            self.assertEqual(text_event.pid, bin_event.pid)
+            self.assertEqual(text_event.action, bin_event.action)
+            self.assertEqual(text_event.operation, bin_event.operation)
+            self.assertEqual(text_event.offset, bin_event.offset)
+            self.assertEqual(text_event.size, bin_event.size)
+            self.assertEqual(float(text_event.timestamp),
+                    float(bin_event.timestamp))
+            self.assertEqual(text_event.pre_wait_time, bin_event.pre_wait_time)
+            self.assertEqual(text_event.sync, bin_event.sync)
+
+    def test_column(self):
+        conf = ConfigNCQFTL()
+        bin_path = "/tmp/test_binary_trace/small.bin"
+        with hostevent.BinaryTraceWriter(bin_path) as writer:
+            for i in range(10):
+                writer.write(pid=i, action='D', operation='write',
+                        offset=i * 4096, size=4096)
+
+        trace = hostevent.BinaryTrace(bin_path)
+        self.assertEqual(len(trace), 10)
+        self.assertEqual(trace.column('offset', 2, 3), (8192, 12288, 16384))
+        self.assertEqual(trace.operations(0, 1), [OP_WRITE])
+        trace.close()
+
+        events = list(hostevent.BinaryEventIterator(conf, bin_path,
+            chunk_events=3))
+        self.assertEqual([e.pid for e in events], range(10))
+        self.assertEqual(events[0].pre_wait_time, 'NA')
+        self.assertEqual(events[0].timestamp, 'NA')
+        self.assertEqual(events[0].sync, 'True')
+
+    def test_format_option(self):
+        conf = ConfigNCQFTL()
+        conf['event_file_format'] = 'binary'
+        text_path = "/tmp/test_binary_trace/events.txt"
+        utils.prepare_dir_for_path(text_path)
+        with open(text_path, 'w') as f:
+            f.write("29162 D read 299008 4096 0.000000000 0 False\n")
+
+        events = list(hostevent.event_iter_from_file(conf, text_path))
+        self.assertTrue(os.path.exists(hostevent.binary_trace_path(text_path)))
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].operation, OP_READ)
+        self.assertEqual(events[0].offset, 299008)
+
+    def test_interrupted_conversion(self):
+        conf = ConfigNCQFTL()
+        text_path = "/tmp/test_binary_trace/bad/events.txt"
+        bin_path = hostevent.binary_trace_path(text_path)
+        shutil.rmtree(os.path.dirname(text_path), ignore_errors=True)
+        utils.prepare_dir_for_path(text_path)
+        with open(text_path, 'w') as f:
+            for i in range(21):
+                if i == 10:
+                    f.write("bad line\n")
+                else:
+                    f.write("29162 D read {} 4096 0.0 0 False\n".format(
+                        i * 4096))
+
+        for i in range(2):
+            with self.assertRaises(RuntimeError):
+                hostevent.ensure_binary_trace(conf, text_path)
+            self.assertFalse(os.path.exists(bin_path))
+            self.assertFalse(os.path.exists(bin_path + '.tmp'))
+
+    def test_truncated_file(self):
+        bin_path = "/tmp/test_binary_trace/truncated.bin"
+        with hostevent.BinaryTraceWriter(bin_path) as writer:
+            for i in range(10):
+                writer.write(pid=i, action='D', operation='write',
+                        offset=i * 4096, size=4096)
+        with open(bin_path, 'rb') as f:
+            data = f.read()
+        with open(bin_path, 'wb') as f:
+            f.write(data[:len(data) / 2])
+
+        with self.assertRaises(RuntimeError):
+            hostevent.BinaryTrace(bin_path)
+
+
+class TestEventObjects(unittest.TestCase):
+    def test_slots(self):
+        event = hostevent.Event(512, 0, OP_WRITE, 4096, 8192)
+        self.assertFalse(hasattr(event, '__dict__'))
+        self.assertEqual(event.sector, 8)
+        self.assertEqual(event.sector_count, 16)
+
+        event.token = 'token'
+        event.token_req = 'req'
+        self.assertEqual(event.token_req, 'req')
+
+        control_event = hostevent.ControlEvent(OP_SHUT_SSD)
+        self.assertFalse(hasattr(control_event, '__dict__'))
+        control_event.token = 'token'
+        control_event.release()
+
+    def test_pool(self):
+        conf = ConfigNCQFTL()
+        pool = hostevent.EventPool(max_free=2)
+        lines = ["1 D write {} 4096 0 0 True".format(i * 4096)
+                for i in range(5)]
+
+        event_ids = []
+        for event in hostevent.EventIterator(conf, lines, chunk_events=1,
+                event_pool=pool):
+            event_ids.append(id(event))
+            self.assertEqual(event.offset, (len(event_ids) - 1) * 4096)
+            self.assertEqual(event.get_lpn_extent(conf).lpn_start,
+                    event.offset / conf.page_size)
+            event.release()
+
+        self.assertEqual(len(set(event_ids)), 1)
+        self.assertEqual(len(pool._free), 1)
+
+
+class TestTraceProfile(unittest.TestCase):
+    def test_profile(self):
+        conf = dftldes.Config()
+        page_size = conf.page_size
+        lines = [
+            "1 D write 0 {} 0 0 True".format(page_size * 2),
+            "1 C write 0 {} 0 0 True".format(page_size * 2),
+            "1 D read {} 512 0 0 True".format(page_size),
+            "1 D discard {} {} 0 0 True".format(page_size * 10, page_size),
+            ]
+        profile = traceprofile.profile_event_iter(conf,
+                hostevent.EventIterator(conf, lines))
+        d = profile.to_dict(n_entries_per_page=4)
+
+        self.assertEqual(d['n_events'], 3)
+        self.assertEqual(d['max_lpn'], 10)
+        self.assertEqual(d['n_unique_lpns'], 3)
+        self.assertEqual(d['footprint_bytes'], 3 * page_size)
+        self.assertEqual(d['n_write'], 1)
+        self.assertEqual(d['write_bytes'], page_size * 2)
+        self.assertEqual(d['read_bytes'], 512)
+        self.assertEqual(d['n_discard'], 1)
+        self.assertEqual(d['n_unique_m_vpns'], 2)
+
+    def test_binary_same_as_text(self):
+        conf = ConfigNCQFTL()
+        text_path = "tests/testdata/sqlitewal-update/subexp-7928737328932659543-"\
+            "ext4-10-07-23-50-10--2726320246496492803/blkparse-events-for-ftlsim.txt"
+        bin_path = hostevent.convert_event_file_to_binary(conf, text_path,
+                "/tmp/test_trace_profile/events.bin")
+
+        text_profile = traceprofile.profile_event_files(conf, [text_path])
+        bin_profile = traceprofile.profile_event_files(conf, [bin_path])
+        self.assertTrue(text_profile.n_unique_lpns > 0)
+        self.assertDictEqual(text_profile.to_dict(),
+                bin_profile.to_dict())
+
+    def test_lpn_table_rows(self):
+        conf = dftldes.Config()
+        conf.n_cache_entries = conf.n_mapping_entries_per_page * 8
+        self.assertEqual(conf.n_lpn_table_rows, conf.n_cache_entries)
+
+        conf['trace_profile'] = {'n_unique_m_vpns': 2}
+        self.assertEqual(conf.n_lpn_table_rows, conf.n_cache_entries)
+
+        conf['size_by_trace_profile'] = True
+        self.assertEqual(conf.n_lpn_table_rows,
+                conf.n_mapping_entries_per_page * 2)
+
+
+class TestEventCoalescer(unittest.TestCase):
+    def events(self, lines):
+        conf = ConfigNCQFTL()
+        conf['event_file_column_names'] = ['pid', 'operation', 'offset',
+                'size', 'timestamp', 'pre_wait_time', 'sync']
+        return hostevent.EventIterator(conf, lines)
+
+    def test_merge(self):
+        events = self.events([
+            "1 write 0 4096 0.0 0 True",
+            "1 write 4096 4096 0.0001 0 True",
+            "1 write 8192 4096 0.0002 0 True",
+            "2 write 12288 4096 0.0003 0 True", # other pid
+            "2 write 16384 4096 0.0004 0 True",
+            "2 read 20480 4096 0.0005 0 True", # other operation
+            "2 read 24576 4096 0.1 0 True", # large gap
+            "2 read 28672 12288 0.1001 0 True", # too large
+            ])
+        coalescer = hostevent.EventCoalescer(events, max_bytes=12288,
+                max_gap=0.001)
+        merged = [(e.pid, e.operation, e.offset, e.size) for e in coalescer]
+
+        self.assertListEqual(merged, [
+            (1, OP_WRITE, 0, 12288),
+            (2, OP_WRITE, 12288, 8192),
+            (2, OP_READ, 20480, 4096),
+            (2, OP_READ, 24576, 4096),
+            (2, OP_READ, 28672, 12288),
+            ])
+        self.assertEqual(coalescer.n_removed, 3)
+
+    def test_control_event(self):
+        events = list(self.events([
+            "1 write 0 4096 0.0 0 True",
+            "1 write 4096 4096 0.0 0 True"]))
+        events.insert(1, hostevent.ControlEvent(OP_BARRIER))
+
+        coalescer = hostevent.EventCoalescer(events, max_bytes=2**20)
+        merged = list(coalescer)
+        self.assertEqual(len(merged), 3)
+        self.assertEqual(merged[1].operation, OP_BARRIER)
+        self.assertEqual(coalescer.n_removed, 0)
+
+    def test_completion_event(self):
+        conf = ConfigNCQFTL()
+        events = hostevent.EventIterator(conf, [
+            "1 D write 0 4096 0.0 0 True",
+            "1 C write 0 4096 0.0 0 True",
+            "1 D write 4096 4096 0.0 0 True"])
+        merged = [(e.action, e.size) for e in
+                hostevent.EventCoalescer(events, max_bytes=2**20)]
+        self.assertListEqual(merged, [('C', 4096), ('D', 8192)])
+
+    def test_lpn_extent(self):
+        conf = ConfigNCQFTL()
+        events = self.events([
+            "1 write 0 4096 0.0 0 True",
+            "1 write 4096 4096 0.0 0 True"])
+        merged = list(hostevent.EventCoalescer(events, max_bytes=2**20))
+        self.assertEqual(merged[0].get_lpn_extent(conf).lpn_count,
+                8192 / conf.page_size)
+
+
+class TestLpnExtents(unittest.TestCase):
+    def check_events(self, conf, events):
+        for event in events:
+            lpn_start, lpn_count = conf.off_size_to_page_range(
+                    event.offset, event.size, force_alignment=False)
+            self.assertEqual(event.lpn_extent.lpn_start, lpn_start)
+            self.assertEqual(event.lpn_extent.lpn_count, lpn_count)
+            self.assertIs(event.get_lpn_extent(conf), event.lpn_extent)
+
+    def test_text_and_binary(self):
+        conf = ConfigNCQFTL()
+        text_path = "/tmp/test_lpn_extents/events.txt"
+        utils.prepare_dir_for_path(text_path)
+        with open(text_path, 'w') as f:
+            f.write("1 D write 0 4096 0 0 True\n")
+            f.write("1 D write 4096 512 0 0 True\n")
+            f.write("1 D read 1024 8192 0 0 True\n")
+            f.write("1 D discard 40960 10240 0 0 True\n")
+
+        text_events = list(hostevent.EventIterator(conf,
+            hostevent.FileLineIterator(text_path), chunk_events=3))
+        self.assertEqual(len(text_events), 4)
+        self.check_events(conf, text_events)
+
+        bin_path = hostevent.convert_event_file_to_binary(conf, text_path)
+        bin_events = list(hostevent.BinaryEventIterator(conf, bin_path,
+            chunk_events=3))
+        self.check_events(conf, bin_events)
+
+    def test_empty_request(self):
+        conf = ConfigNCQFTL()
+        events = list(hostevent.EventIterator(conf,
+            ["1 D write 0 0 0 0 True"]))
+        self.assertEqual(events[0].lpn_extent, None)
+
+
+class TestTraceCache(unittest.TestCase):
+    def write_trace(self, path):
+        utils.prepare_dir_for_path(path)
+        with open(path, 'w') as f:
+            f.write("29162 D read 299008 4096 0.000000000 0 False\n")
+            f.write("29162 C read 299008 4096 0.000223461 0.000223461 False\n")
+
+    def test_shared_entry(self):
+        conf = ConfigNCQFTL()
+        cache_dir = '/tmp/test_trace_cache/cache'
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        cache = TraceCache(cache_dir)
+
+        self.write_trace('/tmp/test_trace_cache/a/events.txt')
+        self.write_trace('/tmp/test_trace_cache/b/events.txt')
+
+        path_a = cache.binary_trace(conf, '/tmp/test_trace_cache/a/events.txt')
+        mtime = os.path.getmtime(path_a)
+        path_b = cache.binary_trace(conf, '/tmp/test_trace_cache/b/events.txt')
+        self.assertEqual(path_a, path_b)
+        self.assertEqual(mtime, os.path.getmtime(path_b))
+
+        conf['sector_size'] = 4096
+        path_c = cache.binary_trace(conf, '/tmp/test_trace_cache/a/events.txt')
+        self.assertNotEqual(path_a, path_c)
+
+    def test_event_iter(self):
+        conf = ConfigNCQFTL()
+        conf['trace_cache_dir'] = '/tmp/test_trace_cache/cache2'
+        self.write_trace('/tmp/test_trace_cache/c/events.txt')
+
+        events = list(hostevent.event_iter_from_file(conf,
+            '/tmp/test_trace_cache/c/events.txt'))
+        self.assertEqual([e.action for e in events], ['D', 'C'])
+        self.assertEqual(events[1].pre_wait_time, 0.000223461)
+
+    def test_lpn_extents(self):
+        conf = ConfigNCQFTL()
+        cache_dir = '/tmp/test_trace_cache/cache3'
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        cache = TraceCache(cache_dir)
+        text_path = '/tmp/test_trace_cache/d/events.txt'
+        self.write_trace(text_path)
+
+        bin_path, ext_path = cache.binary_trace_and_lpn_extents(conf,
+                text_path)
+        self.assertEqual(bin_path, cache.binary_trace(conf, text_path))
+        extents = hostevent.LpnExtents(ext_path)
+        self.assertEqual(extents.page_size, conf.page_size)
+        self.assertEqual(extents.columns(), ((299008 / conf.page_size,) * 2,
+            (4096 / conf.page_size,) * 2))
+        extents.close()
+
+        # the same trace, another page size
+        conf['flash_config']['page_size'] = 2 * conf.page_size
+        bin_path_2, ext_path_2 = cache.binary_trace_and_lpn_extents(conf,
+                text_path)
+        self.assertEqual(bin_path, bin_path_2)
+        self.assertNotEqual(ext_path, ext_path_2)
+
+        conf['trace_cache_dir'] = cache_dir
+        events = list(hostevent.event_iter_from_file(conf, text_path))
+        extent = events[0].get_lpn_extent(conf)
+        self.assertEqual((extent.lpn_start, extent.lpn_count),
+                (299008 / conf.page_size, 1))
+
+
 class TestEventFileSets(unittest.TestCase):
     def test(self):
         filesets = EventFileSets('tests/testdata/64mbfile')
@@ -1,8 +1,9 @@
+import random
 import unittest
 
 import wiscsim
 from utilities import utils
-from wiscsim.bitmap import FlashBitmap2
+from wiscsim.bitmap import FlashBitmap2, NumpyFlashBitmap, create_page_states
 
 def create_config():
     conf = wiscsim.dftldes.Config()
@@ -33,13 +34,19 @@ def create_bitmap(conf):
 
 
 class TestBitmap(unittest.TestCase):
+    backend = 'bitarray'
+
+    def create_bitmap(self, conf):
+        conf['page_state_backend'] = self.backend
+        return create_page_states(conf)
+
     def test_create(self):
         conf = create_config()
-        bitmap = create_bitmap(conf)
+        bitmap = self.create_bitmap(conf)
 
     def test_init_states(self):
         conf = create_config()
-        bitmap = create_bitmap(conf)
+        bitmap = self.create_bitmap(conf)
 
         for ppn in range(conf.total_num_pages()):
             self.assertEqual(bitmap.is_page_valid(ppn), False)
@@ -48,7 +55,7 @@ class TestBitmap(unittest.TestCase):
 
     def test_validating(self):
         conf = create_config()
-        bitmap = create_bitmap(conf)
+        bitmap = self.create_bitmap(conf)
 
         self.assertEqual(bitmap.block_valid_ratio(0), 0)
         self.assertEqual(bitmap.block_invalid_ratio(0), 1)
@@ -58,7 +65,7 @@ class TestBitmap(unittest.TestCase):
 
     def test_invalidating(self):
         conf = create_config()
-        bitmap = create_bitmap(conf)
+        bitmap = self.create_bitmap(conf)
 
         bitmap.validate_block(0)
         bitmap.invalidate_page(0)
@@ -67,6 +74,111 @@ class TestBitmap(unittest.TestCase):
         self.assertEqual(bitmap.block_valid_ratio(0),
                 1 - 1.0/conf.n_pages_per_block)
 
+    def test_counts(self):
+        conf = create_config()
+        bitmap = self.create_bitmap(conf)
+        n = conf.n_pages_per_block
+
+        rand = random.Random(1)
+        for i in range(5000):
+            ppn = rand.randrange(4 * n)
+            op = rand.choice(['valid', 'invalid', 'erase'])
+            if op == 'valid':
+                bitmap.validate_page(ppn)
+            elif op == 'invalid':
+                bitmap.invalidate_page(ppn)
+            elif rand.random() < 0.05:
+                bitmap.erase_block(ppn / n)
+
+        for block in range(4):
+            start, end = conf.block_to_page_range(block)
+            n_valid = sum(bitmap.is_page_valid(ppn)
+                    for ppn in range(start, end))
+            n_invalid = sum(bitmap.is_page_invalid(ppn)
+                    for ppn in range(start, end))
+            self.assertEqual(bitmap.block_valid_count(block), n_valid)
+            self.assertEqual(bitmap.block_invalid_count(block), n_invalid)
+            self.assertEqual(bitmap.block_valid_ratio(block),
+                    n_valid / float(n))
+            self.assertEqual(bitmap.block_erased_ratio(block),
+                    (n - n_valid - n_invalid) / float(n))
+
+        bitmap.initialize()
+        self.assertEqual(bitmap.block_erased_ratio(0), 1)
+
+    def test_valid_pages_of_block(self):
+        conf = create_config()
+        bitmap = self.create_bitmap(conf)
+        n = conf.n_pages_per_block
+
+        self.assertEqual(bitmap.valid_pages_of_block(1), [])
+        bitmap.validate_pages([n, n + 3, n + 5, 2 * n])
+        bitmap.invalidate_pages([n + 3, n + 4])
+        self.assertEqual(bitmap.valid_pages_of_block(1), [n, n + 5])
+        self.assertEqual(bitmap.block_valid_count(1), 2)
+        self.assertEqual(bitmap.block_invalid_count(1), 2)
+        self.assertEqual(bitmap.valid_pages_of_block(2), [2 * n])
+
+    def test_histogram(self):
+        conf = create_config()
+        bitmap = self.create_bitmap(conf)
+        n = conf.n_pages_per_block
+        n_blocks = conf.total_num_pages() / n
+
+        bitmap.validate_block(0)
+        bitmap.validate_pages(range(n, n + n / 2))
+        hist = bitmap.valid_ratio_histogram(n_bins=4)
+        self.assertEqual(hist, [n_blocks - 2, 0, 1, 1])
+
+
+class TestNumpyBitmap(TestBitmap):
+    backend = 'numpy'
+
+    def test_type(self):
+        conf = create_config()
+        self.assertIsInstance(self.create_bitmap(conf), NumpyFlashBitmap)
+
+    def test_same_as_bitarray(self):
+        conf = create_config()
+        bitmaps = [FlashBitmap2(conf), NumpyFlashBitmap(conf)]
+        n = conf.n_pages_per_block
+
+        rand = random.Random(2)
+        for i in range(300):
+            ppns = [rand.randrange(8 * n) for _ in range(rand.randrange(20))]
+            op = rand.choice(['valid', 'invalid', 'erase'])
+            for bitmap in bitmaps:
+                if op == 'valid':
+                    bitmap.validate_pages(ppns)
+                elif op == 'invalid':
+                    bitmap.invalidate_pages(ppns)
+                elif len(ppns) > 0:
+                    bitmap.erase_block(ppns[0] / n)
+
+        a, b = bitmaps
+        for ppn in range(8 * n):
+            self.assertEqual(a.page_state_human(ppn), b.page_state_human(ppn))
+        for block in range(8):
+            self.assertEqual(a.valid_pages_of_block(block),
+                    b.valid_pages_of_block(block))
+            self.assertEqual(a.block_valid_count(block),
+                    b.block_valid_count(block))
+            self.assertEqual(a.block_invalid_count(block),
+                    b.block_invalid_count(block))
+        self.assertEqual(a.valid_ratio_histogram(), b.valid_ratio_histogram())
+
+
+class TestPageStateBackend(unittest.TestCase):
+    def test_default(self):
+        conf = create_config()
+        self.assertIsInstance(create_page_states(conf), FlashBitmap2)
+
+    def test_unknown(self):
+        conf = create_config()
+        conf['page_state_backend'] = 'nosuchbackend'
+        with self.assertRaises(ValueError):
+            create_page_states(conf)
+
 
 def main():
     unittest.main()
@@ -8,6 +8,7 @@ from utilities import utils
 import wiscsim
 from wiscsim.ftlsim_commons import Extent
 from wiscsim.dftldes import LpnTable, LpnTableMvpn, UNINITIATED, \
+        FREE, FREE_AND_LOCKED, USED, USED_AND_LOCKED, USED_AND_HOLD, \
         split_ext_by_segment
 from config import WLRUNNER, LBAGENERATOR, LBAMULTIPROC
 from commons import *
@@ -147,6 +148,74 @@ def create_datablockcleaner(objs):
     return datablockcleaner
 
 
+class TestMappingOnFlash(unittest.TestCase):
+    def test_uninitiated(self):
+        conf = create_config()
+        gmt = create_mapping_on_flash(conf)
+
+        self.assertEqual(gmt.lpn_to_ppn(0), UNINITIATED)
+        gmt.update(0, 8)
+        gmt.update(1, 0)
+        self.assertEqual(gmt.lpn_to_ppn(0), 8)
+        self.assertEqual(gmt.lpn_to_ppn(1), 0)
+
+        gmt.update(0, UNINITIATED)
+        self.assertEqual(gmt.lpn_to_ppn(0), UNINITIATED)
+
+    def test_profiled_size(self):
+        conf = create_config()
+        n = conf.n_mapping_entries_per_page
+        conf['trace_profile'] = {'max_lpn': n + 1}
+        self.assertEqual(len(create_mapping_on_flash(conf).entries),
+                conf.n_lpns_on_flash)
+        self.assertTrue(conf.n_lpns_on_flash > 4 * n)
+
+        conf['size_by_trace_profile'] = True
+        gmt = create_mapping_on_flash(conf)
+        self.assertEqual(len(gmt.entries), 2 * n)
+
+        # lpns beyond the profile are still fine
+        self.assertEqual(gmt.lpn_to_ppn(3 * n), UNINITIATED)
+        gmt.update(3 * n, 88)
+        self.assertEqual(gmt.lpn_to_ppn(3 * n), 88)
+        self.assertEqual(len(gmt.entries), 4 * n)
+
+    def test_profiled_size_recorded(self):
+        conf = create_config()
+        n = conf.n_mapping_entries_per_page
+        conf['trace_profile'] = {'max_lpn': n + 1, 'n_unique_m_vpns': 1}
+        conf['size_by_trace_profile'] = True
+        objs = create_obj_set(conf)
+        wiscsim.dftldes.Ftl(objs['conf'], objs['rec'],
+                objs['flash_controller'], objs['env'])
+
+        self.assertEqual(
+                objs['rec'].get_result_by_one_key('size_by_trace_profile'),
+                {'n_lpn_table_rows': min(n, conf.n_cache_entries),
+                 'n_lpns_on_flash': 2 * n})
+
+
+class TestGlobalTranslationDirectory(unittest.TestCase):
+    def test_init(self):
+        conf = create_config()
+        oob = create_oob(conf)
+        directory = create_translation_directory(conf, oob,
+                create_blockpool(conf))
+
+        n = conf.total_translation_pages()
+        m_ppns = [directory.m_vpn_to_m_ppn(m_vpn) for m_vpn in range(n)]
+        self.assertEqual(len(set(m_ppns)), n)
+        for m_vpn, m_ppn in enumerate(m_ppns):
+            self.assertEqual(oob.ppn_to_lpn_or_mvpn(m_ppn), m_vpn)
+            self.assertTrue(oob.states.is_page_valid(m_ppn))
+
+        directory.remove_mapping(0)
+        with self.assertRaises(KeyError):
+            directory.m_vpn_to_m_ppn(0)
+        directory.add_mapping(0, 8)
+        self.assertEqual(directory.m_vpn_to_m_ppn(0), 8)
+
+
 class TestMappingCache(unittest.TestCase):
     def update_m_vpn(self, objs, mapping_cache, m_vpn):
         conf = objs['conf']
@@ -312,6 +381,158 @@ class TestMappingCacheEviction(unittest.TestCase):
         env.run()
 
 
+class TestReplacementPolicies(unittest.TestCase):
+    def run_writes(self, policy):
+        conf = create_config()
+        conf.n_cache_entries = conf.n_mapping_entries_per_page * 2
+        conf['mapping_cache_policy'] = policy
+        objs = create_obj_set(conf)
+        env = objs['env']
+        rec = objs['rec']
+        rec.enable()
+
+        dftl = wiscsim.dftldes.Ftl(objs['conf'], rec,
+                objs['flash_controller'], env)
+        n_lpns = 4 * conf.n_mapping_entries_per_page
+        result = {}
+
+        def proc():
+            rand = random.Random(1)
+            for i in range(100):
+                lpn = rand.randint(0, n_lpns - 1)
+                yield env.process(dftl.write_ext(Extent(lpn, 1)))
+            yield env.process(dftl.read_ext(Extent(0, 64)))
+
+            result['ppns'] = yield env.process(
+                    dftl._mappings.lpns_to_ppns(range(n_lpns)))
+
+        env.run(until=env.process(proc()))
+
+        mapped_lpns = []
+        for lpn, ppn in enumerate(result['ppns']):
+            if ppn != UNINITIATED:
+                self.assertTrue(dftl.oob.states.is_page_valid(ppn))
+                self.assertEqual(dftl.oob.ppn_to_lpn_or_mvpn(ppn), lpn)
+                mapped_lpns.append(lpn)
+
+        counters = [dict(rec.general_accumulator.get(name, {}))
+                for name in ('Mapping_Cache', 'translation')]
+        return env.now, counters, mapped_lpns
+
+    def test_array_lru_same_as_lrucache(self):
+        self.assertEqual(self.run_writes('LruCache'),
+                self.run_writes('ArrayLruCache'))
+
+    def test_policies(self):
+        """
+        policies only change what is cached, not the mappings
+        """
+        _, _, lru_lpns = self.run_writes('LruCache')
+        for policy in ('ClockCache', 'SegmentedLruCache', 'TwoQueueCache',
+                'GroupLruCache'):
+            _, counters, lpns = self.run_writes(policy)
+            self.assertListEqual(lpns, lru_lpns)
+            self.assertGreater(counters[0]['hit'], 0)
+
+    def test_invalid_policy(self):
+        conf = create_config()
+        conf['mapping_cache_policy'] = 'NoSuchCache'
+        with self.assertRaises(ValueError):
+            LpnTableMvpn(conf)
+
+
+class TestPrefetch(unittest.TestCase):
+    def run_scan(self, depth, n_cache_tps=16):
+        """
+        read one page of each translation page, one after another
+        """
+        conf = create_config()
+        conf.n_cache_entries = conf.n_mapping_entries_per_page * n_cache_tps
+        conf['mapping_cache_prefetch_depth'] = depth
+        objs = create_obj_set(conf)
+        env = objs['env']
+        rec = objs['rec']
+        rec.enable()
+
+        dftl = wiscsim.dftldes.Ftl(objs['conf'], rec,
+                objs['flash_controller'], env)
+        n = conf.n_mapping_entries_per_page
+
+        def proc():
+            for m_vpn in range(8):
+                yield env.process(dftl.read_ext(Extent(m_vpn * n, 1)))
+                # time to process the page read
+                yield env.timeout(
+                        objs['flash_controller'].channels[0].read_time)
+            yield env.process(dftl.flush_trans_cache())
+
+        env.run(until=env.process(proc()))
+
+        return env.now, rec.general_accumulator
+
+    def test_no_prefetch(self):
+        _, counters = self.run_scan(0)
+        self.assertEqual(counters['Mapping_Cache']['miss'], 8)
+        self.assertNotIn('Mapping_Cache_Prefetch', counters)
+
+    def test_prefetch(self):
+        no_prefetch_time, _ = self.run_scan(0)
+        prefetch_time, counters = self.run_scan(2)
+
+        prefetch = counters['Mapping_Cache_Prefetch']
+        # the first two reads are not known to be sequential
+        self.assertEqual(counters['Mapping_Cache']['miss'], 2)
+        self.assertEqual(prefetch['hit'], 6)
+        # the last two prefetched pages are never read
+        self.assertEqual(prefetch['load'], 8)
+        self.assertEqual(prefetch['waste'], 0)
+        self.assertLess(prefetch_time, no_prefetch_time)
+
+    def test_prefetch_does_not_evict(self):
+        _, counters = self.run_scan(0, n_cache_tps=4)
+        _, prefetch_counters = self.run_scan(2, n_cache_tps=4)
+
+        # once the cache is full, prefetch is skipped instead of evicting
+        self.assertGreater(prefetch_counters['Mapping_Cache_Prefetch']['skip'],
+                0)
+        self.assertEqual(
+            prefetch_counters['translation']['delete-lpn-in-table-for-load'],
+            counters['translation']['delete-lpn-in-table-for-load'])
+
+
+class TestMappingCacheBatch(unittest.TestCase):
+    def proc_batch(self, env, mapping_cache, n):
+        recorder = mapping_cache.recorder
+        recorder.enable()
+
+        lpns = [1, 2, n + 1, 3]
+        ppns = yield env.process(mapping_cache.lpns_to_ppns(lpns))
+        self.assertListEqual(ppns, [UNINITIATED] * 4)
+        # one load for each m_vpn
+        self.assertEqual(recorder.get_count_me('Mapping_Cache', 'miss'), 2)
+        self.assertEqual(recorder.get_count_me('Mapping_Cache', 'hit'), 2)
+        self.assertEqual(
+            recorder.get_count_me('translation', 'read-trans-for-load'), 2)
+
+        yield env.process(mapping_cache.update_batch(
+            collections.OrderedDict([(3, 33), (n + 1, 44), (1, 11)])))
+        ppns = yield env.process(mapping_cache.lpns_to_ppns(lpns))
+        self.assertListEqual(ppns, [11, UNINITIATED, 44, 33])
+        self.assertEqual(
+            recorder.get_count_me('translation', 'read-trans-for-load'), 2)
+
+    def test_batch(self):
+        conf = create_config()
+        conf.n_cache_entries = conf.n_mapping_entries_per_page * 4
+        objs = create_obj_set(conf)
+        mapping_cache = create_mapping_cache(objs)
+        env = objs['env']
+
+        env.process(self.proc_batch(env, mapping_cache,
+            conf.n_mapping_entries_per_page))
+        env.run()
+
+
 class TestMappingCacheWriteBack(unittest.TestCase):
     def load(self, conf, env, mapping_cache):
         lpntable = mapping_cache._lpn_table
@@ -496,6 +717,88 @@ class TestMappingCacheFlushWithEviction(unittest.TestCase):
         env.run()
 
 
+class TestMappingCacheFlushParallel(unittest.TestCase):
+    def flush(self, n_channels):
+        """
+        Dirty 8 translation pages and return how long flushing them takes
+        """
+        conf = create_config()
+        conf['flash_config']['n_channels_per_dev'] = n_channels
+        conf.set_flash_num_blocks_by_bytes(int(64 * MB * 1.28))
+        conf.n_cache_entries = conf.n_mapping_entries_per_page * 8
+        objs = create_obj_set(conf)
+        mapping_cache = create_mapping_cache(objs)
+        env = objs['env']
+        lpntable = mapping_cache._lpn_table
+        recorder = mapping_cache.recorder
+        recorder.enable()
+
+        lpns = [m_vpn * conf.n_mapping_entries_per_page for m_vpn in range(8)]
+        times = {}
+
+        def proc():
+            for lpn in lpns:
+                yield env.process(mapping_cache.update(lpn=lpn, ppn=lpn+1))
+            self.assertEqual(lpntable.dirty_m_vpns(), range(8))
+
+            start = env.now
+            yield env.process(mapping_cache.flush())
+            times['flush'] = env.now - start
+
+            self.assertEqual(lpntable.dirty_m_vpns(), [])
+            self.assertEqual(recorder.get_count_me(
+                'translation', 'write-back-dirty-for-flush'), 8)
+            for lpn in lpns:
+                self.assertEqual(
+                    mapping_cache.mapping_on_flash.lpn_to_ppn(lpn), lpn+1)
+
+        env.run(until=env.process(proc()))
+        return times['flush']
+
+    def test_channels_overlap(self):
+        self.assertLess(self.flush(n_channels=4), self.flush(n_channels=1))
+
+    def test_skip_written_back(self):
+        """
+        an m_vpn written back while flush waits for its lock is skipped
+        """
+        conf = create_config()
+        conf['flash_config']['n_channels_per_dev'] = 1
+        conf.set_flash_num_blocks_by_bytes(int(64 * MB * 1.28))
+        conf.n_cache_entries = conf.n_mapping_entries_per_page * 8
+        objs = create_obj_set(conf)
+        mapping_cache = create_mapping_cache(objs)
+        env = objs['env']
+        locks = objs['trans_page_locks']
+        recorder = mapping_cache.recorder
+        recorder.enable()
+
+        def write_back(m_vpn):
+            req = locks.get_request(m_vpn)
+            yield req
+            mapping_cache.trans_page_locked(m_vpn)
+            # let flush find m_vpn dirty and wait for the lock
+            yield env.timeout(1)
+            yield env.process(mapping_cache._write_back(m_vpn))
+            locks.release_request(m_vpn, req)
+            mapping_cache.trans_page_unlocked(m_vpn)
+
+        def proc():
+            for m_vpn in range(2):
+                lpn = m_vpn * conf.n_mapping_entries_per_page
+                yield env.process(mapping_cache.update(lpn=lpn, ppn=lpn+1))
+
+            p = env.process(write_back(0))
+            yield env.process(mapping_cache.flush())
+            yield p
+
+            self.assertEqual(mapping_cache._lpn_table.dirty_m_vpns(), [])
+            self.assertEqual(recorder.get_count_me(
+                'translation', 'write-back-dirty-for-flush'), 1)
+
+        env.run(until=env.process(proc()))
+
+
 class TestMappingCacheFlushAndLoad(unittest.TestCase):
     def load(self, conf, env, mapping_cache):
         lpntable = mapping_cache._lpn_table
@@ -1016,6 +1319,97 @@ class TestDiscard(unittest.TestCase):
         yield env.process(dftl.discard_ext(ext))
         self.assertEqual(env.now, 2 * time_read_page + time_program_page)
 
+        # the discarded entry is UNINITIATED, reading it takes no time
+        ppns = yield env.process(dftl._mappings.lpns_to_ppns(ext.lpn_iter()))
+        self.assertListEqual(ppns, [UNINITIATED])
+        yield env.process(dftl.read_ext(ext))
+        self.assertEqual(env.now, 2 * time_read_page + time_program_page)
+
+
+class TestTraceWindow(unittest.TestCase):
+    def test_warm_up(self):
+        conf = create_config()
+        conf['simulator_class'] = 'SimulatorDESNew'
+        conf['warm_up_events'] = 2
+        conf['measure_events'] = 1
+        page_size = conf.page_size
+
+        events = [wiscsim.hostevent.ControlEvent(OP_ENABLE_RECORDER)]
+        for i in range(4):
+            events.append(wiscsim.hostevent.Event(512, 0, OP_WRITE,
+                offset = i * page_size, size = page_size))
+
+        sim = wiscsim.simulator.SimulatorDESNew(conf, events)
+        sim.run()
+
+        ftl = sim.ssd.ftl
+        mapping_on_flash = ftl._mappings.mapping_on_flash
+        # warmed up lpns go straight to mappings on flash
+        self.assertNotEqual(mapping_on_flash.lpn_to_ppn(0), UNINITIATED)
+        self.assertNotEqual(mapping_on_flash.lpn_to_ppn(1), UNINITIATED)
+        # the measured lpn is in the mapping cache
+        self.assertEqual(mapping_on_flash.lpn_to_ppn(2), UNINITIATED)
+        lpn_table = ftl._mappings._lpn_table
+        self.assertNotEqual(lpn_table.lpn_to_ppn(2), UNINITIATED)
+        # the event after the window is not simulated
+        self.assertEqual(lpn_table.lpn_to_ppn(3), UNINITIATED)
+
+        self.assertEqual(sim.recorder.get_result_by_one_key('warm_up_events'), 2)
+        self.assertEqual(sim.recorder.get_general_accumulater_cnt(
+            'traffic', 'write'), page_size)
+
+    def test_warm_up_with_cleaning(self):
+        conf = create_config()
+        conf['simulator_class'] = 'SimulatorDESNew'
+        conf['measure_events'] = 1
+        page_size = conf.page_size
+        n_pages = conf.n_pages_per_block
+
+        # rewrite 16 blocks of data until warm-up has to clean
+        events = [wiscsim.hostevent.ControlEvent(OP_ENABLE_RECORDER)]
+        n_blocks = conf.n_blocks_per_dev
+        for i in range(2 * n_blocks):
+            events.append(wiscsim.hostevent.Event(512, 0, OP_WRITE,
+                offset = (i % 16) * n_pages * page_size,
+                size = n_pages * page_size))
+        conf['warm_up_events'] = len(events) - 1
+        events.append(wiscsim.hostevent.Event(512, 0, OP_WRITE,
+            offset = 0, size = page_size))
+
+        sim = wiscsim.simulator.SimulatorDESNew(conf, events)
+        sim.run()
+
+        # cleaning in warm-up took time, the measurement starts after it
+        self.assertGreater(sim.window.end_time, 0)
+        self.assertEqual(
+            sim.recorder.get_result_by_one_key('warm_up_duration'),
+            sim.window.end_time)
+        self.assertEqual(
+            sim.recorder.get_result_by_one_key('simulation_duration'),
+            sim.env.now - sim.window.end_time)
+        self.assertLess(
+            sim.recorder.get_result_by_one_key('simulation_duration'),
+            sim.window.end_time)
+
+    def test_control_events_after_window(self):
+        conf = create_config()
+        conf['simulator_class'] = 'SimulatorDESNew'
+        conf['warm_up_events'] = 0
+        conf['measure_events'] = 1
+        page_size = conf.page_size
+
+        events = [wiscsim.hostevent.ControlEvent(OP_ENABLE_RECORDER)]
+        for i in range(3):
+            events.append(wiscsim.hostevent.Event(512, 0, OP_WRITE,
+                offset = i * page_size, size = page_size))
+        events.append(wiscsim.hostevent.ControlEvent(OP_REC_TIMESTAMP,
+            arg1 = 'after_window'))
+
+        window = wiscsim.tracewindow.TraceWindow(conf, events)
+        operations = [event.operation for event in window]
+        self.assertEqual(operations,
+            [OP_ENABLE_RECORDER, OP_WRITE, OP_REC_TIMESTAMP])
+
 
 class TestLpnTable(unittest.TestCase):
     def test_init(self):
@@ -1100,6 +1494,129 @@ class TestLpnTable(unittest.TestCase):
         self.assertEqual(table.n_used_rows(), 2)
         self.assertEqual(table.n_locked_used_rows(), 1)
 
+    def test_state_counts(self):
+        """
+        counters have to agree with the states of the rows
+        """
+        table = LpnTable(8)
+
+        def check():
+            counter = collections.Counter(row.state for row in table.rows())
+            for state in (FREE, FREE_AND_LOCKED, USED, USED_AND_LOCKED,
+                    USED_AND_HOLD):
+                self.assertEqual(table.stats()[state], counter[state])
+
+        rowids = table.lock_free_rows(5)
+        table.add_lpns(rowids[:3], {1:11, 2:22, 3:33}, False)
+        table.unlock_free_rows(rowids[3:])
+        check()
+
+        table.lock_lpn(1)
+        table.hold_used_row(rowids[1])
+        check()
+
+        table.unlock_lpn(1)
+        table.delete_lpn_and_lock(1)
+        check()
+        self.assertEqual(table.n_free_rows(), 5)
+        self.assertEqual(table.n_locked_free_rows(), 1)
+
+    def test_free_rows_reused(self):
+        table = LpnTable(4)
+
+        rowids = table.lock_free_rows(4)
+        self.assertEqual(table.lock_free_rows(1), [])
+
+        table.unlock_free_row(rowids[2])
+        self.assertEqual(table.n_free_rows(), 1)
+        self.assertEqual(table.lock_free_rows(3), [rowids[2]])
+        self.assertEqual(table.lock_free_row(), None)
+
+    def test_evictable_rows(self):
+        """
+        locked and held rows are cached but not evictable
+        """
+        table = LpnTable(8)
+
+        rowids = table.lock_free_rows(4)
+        table.add_lpns(rowids, collections.OrderedDict(
+            [(1, 11), (2, 22), (3, 33), (4, 44)]), False)
+
+        table.hold_used_row(rowids[0])
+        table.lock_lpn(2)
+        self.assertListEqual(
+            [lpn for lpn, _ in table.evictable_lpn_items()], [3, 4])
+        self.assertEqual(table.has_lpn(1), True)
+        self.assertEqual(table.lpn_to_ppn(2), 22)
+        self.assertEqual(table.n_used_rows(), 2)
+
+        # a held row goes back as the first to evict, a locked one as
+        # the last
+        table.unhold_used_row(rowids[0])
+        table.unlock_lpn(2)
+        self.assertListEqual(
+            [lpn for lpn, _ in table.evictable_lpn_items()], [1, 3, 4, 2])
+
+        table.delete_lpn_and_lock(1)
+        self.assertEqual(table.has_lpn(1), False)
+
+    def test_pinned_groups(self):
+        """
+        rows of a pinned group are skipped once and go back in order
+        """
+        table = LpnTable(8, lpn_to_group = lambda lpn: lpn / 10)
+
+        rowids = table.lock_free_rows(5)
+        table.add_lpns(rowids, collections.OrderedDict(
+            [(1, 11), (2, 22), (21, 211), (3, 33), (22, 222)]), False)
+
+        table.pin_group(0)
+        self.assertEqual(table.first_evictable_row().lpn, 21)
+        # rows of group 0 before the victim are out of the order now
+        self.assertListEqual(
+            [lpn for lpn, _ in table.evictable_lpn_items()], [21, 3, 22])
+        self.assertEqual(table.lpn_to_ppn(2), 22)
+
+        table.pin_group(2)
+        self.assertEqual(table.first_evictable_row(), None)
+        self.assertListEqual(
+            sorted(lpn for lpn, _ in table.pinned_used_lpn_items()),
+            [1, 2, 3, 21, 22])
+
+        # 2 was hit while pinned, it goes back as the last to evict
+        table.unpin_group(0)
+        self.assertListEqual(
+            [lpn for lpn, _ in table.evictable_lpn_items()], [1, 3, 2])
+        table.unpin_group(2)
+        self.assertListEqual(
+            [lpn for lpn, _ in table.evictable_lpn_items()],
+            [21, 22, 1, 3, 2])
+
+
+class TestLpnTableMvpn(unittest.TestCase):
+    def test_m_vpn_index(self):
+        conf = create_config()
+        conf.n_cache_entries = 8
+        n = conf.n_mapping_entries_per_page
+        table = LpnTableMvpn(conf)
+
+        rowids = table.lock_free_rows(3)
+        table.add_lpns(rowids, {n + 2: 1, n + 1: 2, 2 * n: 3}, dirty = True)
+
+        self.assertDictEqual(table.get_m_vpn_mappings(1), {n + 1: 2, n + 2: 1})
+        self.assertEqual(table.needed_space_for_m_vpn(1), n - 2)
+        self.assertEqual(table.needed_space_for_m_vpn(0), n)
+        self.assertEqual(len(table.get_un_cached_lpn_of_m_vpn(1)), n - 2)
+        self.assertEqual(len(table.row_ids_of_m_vpn(2)), 1)
+
+        table.delete_lpn_and_lock(n + 1)
+        self.assertDictEqual(table.get_m_vpn_mappings(1), {n + 2: 1})
+        self.assertIn(n + 1, table.get_un_cached_lpn_of_m_vpn(1))
+
+        table.delete_lpn_and_lock(n + 2)
+        self.assertDictEqual(table.get_m_vpn_mappings(1), {})
+        self.assertEqual(table.needed_space_for_m_vpn(1), n)
+
 
 class TestLockPool(unittest.TestCase):
     def access_vpn(self, env, respool, vpn):
@@ -1127,6 +1644,29 @@ class TestLockPool(unittest.TestCase):
         env.process(self.init_proc(env, respool))
         env.run()
 
+        # locks are gone when nobody holds them
+        self.assertEqual(len(respool.locks), 0)
+
+    def access_vpn_in_order(self, env, respool, vpn, i, order):
+        req = respool.get_request(vpn)
+        yield req
+        order.append(i)
+        yield env.timeout(1)
+        respool.release_request(vpn, req)
+
+    def test_order(self):
+        env = simpy.Environment()
+        respool = wiscsim.dftldes.LockPool(env)
+
+        order = []
+        for i in range(4):
+            env.process(self.access_vpn_in_order(env, respool, 88, i, order))
+        env.run()
+
+        self.assertListEqual(order, [0, 1, 2, 3])
+        self.assertEqual(env.now, 4)
+        self.assertEqual(len(respool.locks), 0)
+
 
 class TestParallelDFTL(unittest.TestCase):
     def setup_config(self):
@@ -1728,6 +2268,83 @@ class TestDataBlockCleaner(unittest.TestCase):
         self.assertNotEqual(block, victim_block)
 
 
+class TestDataBlockCleanerOverwrite(unittest.TestCase):
+    def test(self):
+        conf = create_config()
+        conf['flash_config']['n_channels_per_dev'] = 1
+        conf['stripe_size'] = 'infinity'
+        conf.set_flash_num_blocks_by_bytes(128*MB)
+        objs = create_obj_set(conf)
+        env = objs['env']
+
+        dftl = FtlTest(objs['conf'], objs['rec'],
+                objs['flash_controller'], objs['env'])
+
+        env.process(self.proc_test_write(objs, dftl))
+        env.run()
+
+    def proc_overwrite(self, objs, dftl, lpn, delay):
+        env = objs['env']
+        yield env.timeout(delay)
+        yield env.process(dftl.write_ext(Extent(lpn, 1)))
+
+    def proc_test_write(self, objs, dftl):
+        conf = objs['conf']
+        env = objs['env']
+        objs['rec'].enable()
+
+        time_read_page = objs['flash_controller'].channels[0].read_time
+        time_program_page = objs['flash_controller'].channels[0].program_time
+
+        block_pool = dftl.block_pool
+        oob = dftl.oob
+        mappings = dftl.get_mappings()
+
+        victims = wiscsim.dftldes.VictimBlocks(objs['conf'], block_pool, oob)
+        datablockcleaner = wiscsim.dftldes.DataBlockCleaner(
+            conf = objs['conf'],
+            flash = objs['flash_controller'],
+            oob = oob,
+            block_pool = block_pool,
+            mappings = mappings,
+            rec = objs['rec'],
+            env = objs['env'])
+
+        n = conf.n_pages_per_block
+        yield env.process(dftl.write_ext(Extent(0, n)))
+        yield env.process(dftl.write_ext(Extent(0, 1)))
+
+        victim_blocks = list(victims.iterator_verbose())
+        _, _, victim_block = victim_blocks[0]
+
+        gc_ppns = []
+        next_gc_page = block_pool.next_gc_data_page_to_program
+        def record_gc_page(*args, **kwargs):
+            ppn = next_gc_page(*args, **kwargs)
+            gc_ppns.append(ppn)
+            return ppn
+        block_pool.next_gc_data_page_to_program = record_gc_page
+
+        # lpn 1 is overwritten after it is moved, but before the mappings
+        # of the moved pages are updated
+        overwrite = env.process(self.proc_overwrite(objs, dftl, lpn=1,
+            delay=time_read_page + time_program_page + 1))
+        yield env.process(datablockcleaner.clean(victim_block))
+        yield overwrite
+
+        ppn_1 = yield env.process(mappings.lpn_to_ppn(1))
+        self.assertEqual(oob.states.is_page_valid(ppn_1), True)
+        self.assertEqual(oob.ppn_to_lpn_or_mvpn(ppn_1), 1)
+
+        # lpns 1 to n-1 are moved in order, the copy of lpn 1 is stale and
+        # must be invalid instead of erased
+        self.assertEqual(len(gc_ppns), n - 1)
+        self.assertNotEqual(gc_ppns[0], ppn_1)
+        self.assertEqual(oob.states.is_page_invalid(gc_ppns[0]), True)
+        for ppn in gc_ppns[1:]:
+            self.assertEqual(oob.states.is_page_valid(ppn), True)
+
+
 class TestTransBlockCleaner(unittest.TestCase):
     def test(self):
         conf = create_config()
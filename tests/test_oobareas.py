@@ -0,0 +1,144 @@
+import datetime
+import unittest
+
+import simpy
+
+import wiscsim
+from utilities import utils
+from wiscsim.oobareas import PageArray
+
+
+def create_config():
+    conf = wiscsim.dftldes.Config()
+    conf['SSDFramework']['ncq_depth'] = 1
+
+    conf['flash_config']['n_pages_per_block'] = 64
+    conf['flash_config']['n_blocks_per_plane'] = 2
+    conf['flash_config']['n_planes_per_chip'] = 1
+    conf['flash_config']['n_chips_per_package'] = 1
+    conf['flash_config']['n_packages_per_channel'] = 1
+    conf['flash_config']['n_channels_per_dev'] = 4
+
+    utils.set_exp_metadata(conf, save_data = False,
+            expname = 'test_expname',
+            subexpname = 'test_subexpname')
+
+    logicsize_mb = 64
+    conf.n_cache_entries = conf.n_mapping_entries_per_page
+    conf.set_flash_num_blocks_by_bytes(int(logicsize_mb * 2**20 * 1.28))
+
+    utils.runtime_update(conf)
+
+    return conf
+
+
+class TestPageArray(unittest.TestCase):
+    def test_dict_ops(self):
+        pages = PageArray(16)
+        self.assertEqual(len(pages), 0)
+        self.assertNotIn(3, pages)
+        self.assertEqual(pages.get(3), None)
+        with self.assertRaises(KeyError):
+            pages[3]
+
+        pages[3] = 0
+        pages[3] = 30
+        pages[4] = 40
+        self.assertEqual(len(pages), 2)
+        self.assertIn(3, pages)
+        self.assertEqual(pages[3], 30)
+        self.assertEqual(pages.get(4, 'NA'), 40)
+
+        del pages[3]
+        self.assertEqual(len(pages), 1)
+        with self.assertRaises(KeyError):
+            del pages[3]
+
+    def test_range(self):
+        pages = PageArray(16)
+        for ppn in [1, 2, 5, 9]:
+            pages[ppn] = ppn * 10
+
+        self.assertEqual(pages.values_of_range(0, 4, 'NA'),
+                ['NA', 10, 20, 'NA'])
+        pages.clear_range(0, 8)
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(pages.values_of_range(0, 10),
+                [None] * 9 + [90])
+
+
+class TestOutOfBandAreas(unittest.TestCase):
+    def test_erase_block(self):
+        conf = create_config()
+        oob = wiscsim.dftldes.OutOfBandAreas(conf)
+        n = conf.n_pages_per_block
+
+        oob.relocate_data_page(lpn=7, old_ppn=wiscsim.dftldes.UNINITIATED,
+                new_ppn=n)
+        oob.relocate_data_page(lpn=7, old_ppn=n, new_ppn=n + 1)
+        oob.relocate_trans_page(m_vpn=2,
+                old_ppn=wiscsim.dftldes.UNINITIATED, new_ppn=2 * n)
+        self.assertEqual(oob.lpns_of_block(1)[:3], [7, 7, 'NA'])
+        self.assertEqual(oob.ppn_to_lpn_or_mvpn(2 * n), 2)
+
+        oob.erase_block(1)
+        self.assertEqual(oob.lpns_of_block(1), ['NA'] * n)
+        self.assertNotIn(n + 1, oob.timestamp_table)
+        self.assertEqual(len(oob.ppn_to_lpn_mvpn), 1)
+        self.assertEqual(oob.states.block_erased_ratio(1), 1)
+
+
+class TestBlockInvalidationClock(unittest.TestCase):
+    def write_twice(self, oob, lpn, ppn1, ppn2):
+        oob.relocate_data_page(lpn=lpn,
+                old_ppn=wiscsim.dftldes.UNINITIATED, new_ppn=ppn1)
+        oob.relocate_data_page(lpn=lpn, old_ppn=ppn1, new_ppn=ppn2)
+
+    def test_logical(self):
+        conf = create_config()
+        self.assertEqual(conf['block_invalidation_clock'], 'logical')
+        oob = wiscsim.dftldes.OutOfBandAreas(conf)
+        n = conf.n_pages_per_block
+
+        self.write_twice(oob, 3, 0, 1)
+        self.write_twice(oob, 4, n, n + 1)
+        self.assertEqual(oob.last_inv_time_of_block, {0: 2, 1: 4})
+
+    def test_simulated(self):
+        conf = create_config()
+        conf['block_invalidation_clock'] = 'simulated'
+        env = simpy.Environment()
+        oob = wiscsim.dftldes.OutOfBandAreas(conf, env)
+
+        def proc():
+            yield env.timeout(10)
+            self.write_twice(oob, 3, 0, 1)
+
+        env.run(until=env.process(proc()))
+        self.assertEqual(oob.last_inv_time_of_block, {0: 10})
+
+    def test_wallclock(self):
+        conf = create_config()
+        conf['block_invalidation_clock'] = 'wallclock'
+        oob = wiscsim.dftldes.OutOfBandAreas(conf)
+
+        self.write_twice(oob, 3, 0, 1)
+        self.assertIsInstance(oob.last_inv_time_of_block[0],
+                datetime.datetime)
+
+    def test_invalid(self):
+        conf = create_config()
+        conf['block_invalidation_clock'] = 'simulated'
+        with self.assertRaises(ValueError):
+            wiscsim.dftldes.OutOfBandAreas(conf)
+
+        conf['block_invalidation_clock'] = 'nosuchclock'
+        with self.assertRaises(ValueError):
+            wiscsim.dftldes.OutOfBandAreas(conf)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
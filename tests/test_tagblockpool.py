@@ -1,3 +1,4 @@
+import random
 import unittest
 from wiscsim.tagblockpool import *
 
@@ -157,6 +158,38 @@ class TestTagBlockPool(unittest.TestCase):
         self.assertEqual(dist[3], 2)
         print dist
 
+    def test_picking_order(self):
+        n = 50
+        pool = TagBlockPool(n, [TDATA, TTRANS])
+        tags = [TFREE, TDATA, TTRANS]
+        tag_of = dict((block, TFREE) for block in range(n))
+
+        rand = random.Random(1)
+        for i in range(2000):
+            block = rand.randrange(n)
+            dst = rand.choice(tags)
+            if dst != tag_of[block]:
+                pool.change_tag(block, tag_of[block], dst)
+                tag_of[block] = dst
+
+            for tag in tags:
+                blocks = [b for b in range(n) if tag_of[b] == tag]
+                self.assertEqual(sorted(pool.get_blocks_of_tag(tag)), blocks)
+                self.assertEqual(pool.count_blocks(tag), len(blocks))
+
+                cnt = pool.get_erasure_count()
+                least = sorted(blocks, key=lambda b: (cnt[b], -b))
+                most = sorted(blocks, key=lambda b: (-cnt[b], b))
+                self.assertEqual(pool.get_least_or_most_erased_blocks(
+                    tag, LEAST_ERASED, nblocks=3), least[:3])
+                self.assertEqual(pool.get_least_or_most_erased_block(
+                    tag, MOST_ERASED), most[0] if most else None)
+
+    def test_changing_from_wrong_tag(self):
+        pool = TagBlockPool(10, [TDATA])
+        with self.assertRaises(ValueError):
+            pool.change_tag(0, TDATA, TFREE)
+
 
 class TestBlockPoolWithCurBlocks(unittest.TestCase):
     def test_init(self):
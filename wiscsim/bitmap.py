@@ -1,4 +1,12 @@
+import array
+import itertools
+
 import bitarray
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import config
 
 class FlashBitmap2(object):
@@ -18,6 +26,16 @@ class FlashBitmap2(object):
         self.bitmap = bitarray.bitarray(2 * conf.total_num_pages())
         self.bitmap.setall(0)
 
+        # Number of valid and invalid pages of each block, kept up to date
+        # by page state changes so that block ratios are O(1)
+        self.n_pages_per_block = conf.n_pages_per_block
+        self.n_blocks = conf.total_num_pages() / self.n_pages_per_block
+        self._reset_counts()
+
+    def _reset_counts(self):
+        self._n_valid = array.array('l', [0]) * self.n_blocks
+        self._n_invalid = array.array('l', [0]) * self.n_blocks
+
     def pagenum_to_slice_range(self, pagenum):
         "2 is the number of bits representing the state of a page"
         return 2 * pagenum, 2 * (pagenum + 1)
@@ -33,12 +51,32 @@ class FlashBitmap2(object):
         return s, e
 
     def validate_page(self, pagenum):
-        s, e = self.pagenum_to_slice_range(pagenum)
-        self.bitmap[s:e] = self.VALID
+        # the bits of a page are 2 * pagenum and 2 * pagenum + 1, see
+        # pagenum_to_slice_range()
+        s = 2 * pagenum
+        bitmap = self.bitmap
+        if bitmap[s + 1]:
+            # already valid
+            return
+        blocknum = pagenum / self.n_pages_per_block
+        if bitmap[s]:
+            self._n_invalid[blocknum] -= 1
+            bitmap[s] = False
+        bitmap[s + 1] = True
+        self._n_valid[blocknum] += 1
 
     def invalidate_page(self, pagenum):
-        s, e = self.pagenum_to_slice_range(pagenum)
-        self.bitmap[s:e] = self.INVALID
+        s = 2 * pagenum
+        bitmap = self.bitmap
+        if bitmap[s]:
+            # already invalid
+            return
+        blocknum = pagenum / self.n_pages_per_block
+        if bitmap[s + 1]:
+            self._n_valid[blocknum] -= 1
+            bitmap[s + 1] = False
+        bitmap[s] = True
+        self._n_invalid[blocknum] += 1
 
     def validate_block(self, blocknum):
         start, end = self.conf.block_to_page_range(blocknum)
@@ -53,47 +91,67 @@ class FlashBitmap2(object):
     def erase_block(self, blocknum):
         s, e = self.blocknum_to_slice_range(blocknum)
         self.bitmap[s:e] = 0
+        self._n_valid[blocknum] = 0
+        self._n_invalid[blocknum] = 0
 
-    def block_invalid_ratio(self, blocknum):
-        start, end = self.conf.block_to_page_range(blocknum)
-        cnt = 0
-        for pg in range(start, end):
-            if not self.is_page_valid(pg):
-                cnt += 1
+    def block_valid_count(self, blocknum):
+        return self._n_valid[blocknum]
 
-        return cnt / float(self.conf.n_pages_per_block)
+    def block_invalid_count(self, blocknum):
+        return self._n_invalid[blocknum]
 
-    def block_valid_ratio(self, blocknum):
-        start, end = self.conf.block_to_page_range(blocknum)
-        cnt = 0
-        for pg in range(start, end):
-            if self.is_page_valid(pg):
-                cnt += 1
+    def block_invalid_ratio(self, blocknum):
+        "Note that erased pages are counted as not valid"
+        cnt = self.n_pages_per_block - self._n_valid[blocknum]
+        return cnt / float(self.n_pages_per_block)
 
-        ret = cnt / float(self.conf.n_pages_per_block)
-        return ret
+    def block_valid_ratio(self, blocknum):
+        return self._n_valid[blocknum] / float(self.n_pages_per_block)
 
     def block_erased_ratio(self, blocknum):
+        cnt = self.n_pages_per_block - self._n_valid[blocknum] \
+                - self._n_invalid[blocknum]
+        return cnt / float(self.n_pages_per_block)
+
+    def valid_pages_of_block(self, blocknum):
+        "ppns of the valid pages of blocknum, in order"
+        if self._n_valid[blocknum] == 0:
+            return []
         start, end = self.conf.block_to_page_range(blocknum)
-        cnt = 0
-        for pg in range(start, end):
-            if self.is_page_erased(pg):
-                cnt += 1
+        # the second bit of a page is set only if the page is valid
+        return list(itertools.compress(xrange(start, end),
+            self.bitmap[2 * start + 1:2 * end:2]))
+
+    def validate_pages(self, ppns):
+        for ppn in ppns:
+            self.validate_page(ppn)
 
-        ret = cnt / float(self.conf.n_pages_per_block)
-        return ret
+    def invalidate_pages(self, ppns):
+        for ppn in ppns:
+            self.invalidate_page(ppn)
 
+    def valid_ratio_histogram(self, n_bins=10):
+        """
+        Number of blocks in each of n_bins equal bins of valid ratio. Bin i
+        is [i/n_bins, (i+1)/n_bins), the last bin also has ratio 1.
+        """
+        hist = [0] * n_bins
+        for n_valid in self._n_valid:
+            hist[min(n_valid * n_bins / self.n_pages_per_block,
+                n_bins - 1)] += 1
+        return hist
+
+    # a page is VALID ('01') or INVALID ('10') if one of its bits is set,
+    # testing the bit is much cheaper than comparing a slice
     def is_page_valid(self, pagenum):
-        s, e = self.pagenum_to_slice_range(pagenum)
-        return self.bitmap[s:e] == self.VALID
+        return self.bitmap[2 * pagenum + 1]
 
     def is_page_invalid(self, pagenum):
-        s, e = self.pagenum_to_slice_range(pagenum)
-        return self.bitmap[s:e] == self.INVALID
+        return self.bitmap[2 * pagenum]
 
     def is_page_erased(self, pagenum):
-        s, e = self.pagenum_to_slice_range(pagenum)
-        return self.bitmap[s:e] == self.ERASED
+        s = 2 * pagenum
+        return not (self.bitmap[s] or self.bitmap[s + 1])
 
     def page_bits(self, pagenum):
         s, e = self.pagenum_to_slice_range(pagenum)
@@ -128,5 +186,172 @@ class FlashBitmap2(object):
         """ this method should be called in FTL """
         # set the state of all pages to ERASED
         self.bitmap.setall(0)
+        self._reset_counts()
+
+
+class NumpyFlashBitmap(object):
+    """
+    Page states kept as one uint8 per page, with the same interface as
+    FlashBitmap2. Single page operations go through a bytearray and block
+    or device wide queries through a NumPy view of the same memory.
+    """
+    ERASED, VALID, INVALID = 0, 1, 2
+
+    def __init__(self, conf):
+        if not isinstance(conf, config.Config):
+            raise TypeError("conf is not conf.Config. it is {}".
+               format(type(conf).__name__))
+        if numpy is None:
+            raise ImportError("NumpyFlashBitmap needs numpy")
+
+        self.conf = conf
+        self.n_pages_per_block = conf.n_pages_per_block
+        self.n_blocks = conf.total_num_pages() / self.n_pages_per_block
+
+        self._states = bytearray(conf.total_num_pages())
+        self.states = numpy.frombuffer(self._states, dtype=numpy.uint8)
+
+        self._n_valid = array.array('l', [0]) * self.n_blocks
+        self._n_invalid = array.array('l', [0]) * self.n_blocks
+        self._n_valid_np = numpy.frombuffer(self._n_valid, dtype=numpy.int_)
+        self._n_invalid_np = numpy.frombuffer(self._n_invalid,
+                dtype=numpy.int_)
+
+    def validate_page(self, pagenum):
+        old = self._states[pagenum]
+        if old == self.VALID:
+            return
+        blocknum = pagenum / self.n_pages_per_block
+        if old == self.INVALID:
+            self._n_invalid[blocknum] -= 1
+        self._states[pagenum] = self.VALID
+        self._n_valid[blocknum] += 1
+
+    def invalidate_page(self, pagenum):
+        old = self._states[pagenum]
+        if old == self.INVALID:
+            return
+        blocknum = pagenum / self.n_pages_per_block
+        if old == self.VALID:
+            self._n_valid[blocknum] -= 1
+        self._states[pagenum] = self.INVALID
+        self._n_invalid[blocknum] += 1
+
+    def _set_pages(self, ppns, state):
+        ppns = numpy.unique(numpy.asarray(ppns, dtype=numpy.int_))
+        if len(ppns) == 0:
+            return
+        old = self.states[ppns]
+        blocks = ppns // self.n_pages_per_block
+        numpy.subtract.at(self._n_valid_np, blocks[old == self.VALID], 1)
+        numpy.subtract.at(self._n_invalid_np, blocks[old == self.INVALID], 1)
+        self.states[ppns] = state
+        if state == self.VALID:
+            numpy.add.at(self._n_valid_np, blocks, 1)
+        else:
+            numpy.add.at(self._n_invalid_np, blocks, 1)
+
+    def validate_pages(self, ppns):
+        self._set_pages(ppns, self.VALID)
+
+    def invalidate_pages(self, ppns):
+        self._set_pages(ppns, self.INVALID)
+
+    def validate_block(self, blocknum):
+        start, end = self.conf.block_to_page_range(blocknum)
+        self.validate_pages(numpy.arange(start, end))
+
+    def invalidate_block(self, blocknum):
+        start, end = self.conf.block_to_page_range(blocknum)
+        self.invalidate_pages(numpy.arange(start, end))
+
+    def erase_block(self, blocknum):
+        start, end = self.conf.block_to_page_range(blocknum)
+        self.states[start:end] = self.ERASED
+        self._n_valid[blocknum] = 0
+        self._n_invalid[blocknum] = 0
+
+    def block_valid_count(self, blocknum):
+        return self._n_valid[blocknum]
+
+    def block_invalid_count(self, blocknum):
+        return self._n_invalid[blocknum]
+
+    def block_invalid_ratio(self, blocknum):
+        "Note that erased pages are counted as not valid"
+        cnt = self.n_pages_per_block - self._n_valid[blocknum]
+        return cnt / float(self.n_pages_per_block)
+
+    def block_valid_ratio(self, blocknum):
+        return self._n_valid[blocknum] / float(self.n_pages_per_block)
+
+    def block_erased_ratio(self, blocknum):
+        cnt = self.n_pages_per_block - self._n_valid[blocknum] \
+                - self._n_invalid[blocknum]
+        return cnt / float(self.n_pages_per_block)
+
+    def valid_pages_of_block(self, blocknum):
+        "ppns of the valid pages of blocknum, in order"
+        if self._n_valid[blocknum] == 0:
+            return []
+        start, end = self.conf.block_to_page_range(blocknum)
+        offsets = numpy.flatnonzero(self.states[start:end] == self.VALID)
+        return (offsets + start).tolist()
+
+    def valid_ratio_histogram(self, n_bins=10):
+        """
+        Number of blocks in each of n_bins equal bins of valid ratio. Bin i
+        is [i/n_bins, (i+1)/n_bins), the last bin also has ratio 1.
+        """
+        bins = numpy.minimum(self._n_valid_np * n_bins // self.n_pages_per_block,
+                n_bins - 1)
+        return numpy.bincount(bins, minlength=n_bins).tolist()
+
+    def is_page_valid(self, pagenum):
+        return self._states[pagenum] == self.VALID
+
+    def is_page_invalid(self, pagenum):
+        return self._states[pagenum] == self.INVALID
+
+    def is_page_erased(self, pagenum):
+        return self._states[pagenum] == self.ERASED
+
+    def page_state(self, pagenum):
+        return self._states[pagenum]
+
+    def page_state_human(self, pagenum):
+        state = self.page_state(pagenum)
+        if state == self.VALID:
+            return "VALID"
+        elif state == self.INVALID:
+            return "INVALID"
+        elif state == self.ERASED:
+            return "ERASED"
+        else:
+            raise RuntimeError("page {} state is not recognized: {}".format(
+                pagenum, state))
+
+    def initialize(self):
+        """ this method should be called in FTL """
+        self.states[:] = self.ERASED
+        self._n_valid_np[:] = 0
+        self._n_invalid_np[:] = 0
+
+
+PAGE_STATE_BACKENDS = {
+    'bitarray': FlashBitmap2,
+    'numpy': NumpyFlashBitmap,
+    }
 
 
+def create_page_states(conf):
+    """
+    Page state bitmap of the backend in conf['page_state_backend']
+    """
+    backend = conf.get('page_state_backend', 'bitarray')
+    try:
+        cls = PAGE_STATE_BACKENDS[backend]
+    except KeyError:
+        raise ValueError("{} is not a valid page state backend".format(
+            backend))
+    return cls(conf)
@@ -104,6 +104,17 @@ class BlockPool(object):
                 stripe_size=1)
         return ppns[0]
 
+    def next_n_translation_pages_to_program(self, n):
+        """
+        Same pages as calling next_translation_page_to_program() n times
+        """
+        try:
+            ppns = self.pool.next_ppns(n=n, tag=TTRANS, block_index=0,
+                    stripe_size=1)
+        except TagOutOfSpaceError:
+            raise OutOfSpaceError
+        return ppns
+
     def next_gc_data_page_to_program(self, choice=LEAST_ERASED):
         ppns = self.pool.next_ppns(n=1, tag=TDATA, block_index=0,
                 stripe_size=1, choice=choice)
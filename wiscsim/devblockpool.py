@@ -110,7 +110,7 @@ class MultiChannelBlockPoolBase(object):
         else:
             raise NotImplementedError
 
-        tag_blocks = self.get_blocks_of_tag(tag)
+        tag_blocks = set(self.get_blocks_of_tag(tag))
 
         # iterate from least used to most used
         blocks = []
@@ -1,7 +1,7 @@
+import array
 import bitarray
-from collections import deque, Counter
+from collections import deque, Counter, OrderedDict
 import csv
-import datetime
 import heapq
 import itertools
 import random
@@ -15,17 +15,21 @@ import bidict
 import config
 import flash
 import ftlbuilder
-from lrulist import LruDict, SegmentedLruCache, LruCache
+from lrulist import LruDict, SegmentedLruCache, LruCache, ArrayLruCache, \
+        ClockCache, TwoQueueCache, GroupLruCache
 import recorder
 from utilities import utils
 from commons import *
 from ftlsim_commons import *
 from .blkpool import BlockPool, MOST_ERASED, LEAST_ERASED
-from .bitmap import FlashBitmap2
+from .oobareas import (OutOfBandAreasBase, PageArray,
+        block_invalidation_clock)
 
 
 
 UNINITIATED, MISS = ('UNINIT', 'MISS')
+# UNINITIATED in arrays of page numbers
+UNINITIATED_PN = -1
 DATA_BLOCK, TRANS_BLOCK = ('data_block', 'trans_block')
 random.seed(0)
 LOGICAL_READ, LOGICAL_WRITE, LOGICAL_DISCARD = ('LOGICAL_READ', \
@@ -85,7 +89,7 @@ class Ftl(object):
         self.env = env
 
         self.block_pool = BlockPool(confobj)
-        self.oob = OutOfBandAreas(confobj)
+        self.oob = OutOfBandAreas(confobj, env)
 
         self._directory = GlobalTranslationDirectory(self.conf,
                 self.oob, self.block_pool)
@@ -104,6 +108,13 @@ class Ftl(object):
             trans_page_locks = self._trans_page_locks
             )
 
+        if self.conf.sizing_profile() is not None:
+            # sizes differ from runs without the profile, keep them with
+            # the results
+            self.recorder.set_result_by_one_key('size_by_trace_profile', {
+                'n_lpn_table_rows': self.conf.n_lpn_table_rows,
+                'n_lpns_on_flash': self.conf.n_lpns_on_flash})
+
         self.n_sec_per_page = self.conf.page_size \
                 / self.conf['sector_size']
 
@@ -218,21 +229,8 @@ class Ftl(object):
 
     def _update_metadata_for_relocating_lpns(self, lpns, new_ppns, tag=None):
         """
-        This may be parallelized.
-        """
-        old_ppns = yield self.env.process(
-                self._mappings.lpns_to_ppns(lpns, tag))
-
-        for lpn, old_ppn, new_ppn in zip(lpns, old_ppns, new_ppns):
-            yield self.env.process(
-                self._update_metadata_for_relocating_lpn(
-                    lpn, old_ppn, new_ppn, tag))
-
-    def _update_metadata_for_relocating_lpn(self, lpn, old_ppn, new_ppn,
-            tag=None):
-        """
-        contents of lpn used to be in old_ppn, but now it is in new_ppn.
-        This function adjust all metadata to reflect the change.
+        contents of lpns used to be in old ppns, but now they are in
+        new_ppns. This function adjust all metadata to reflect the change.
 
         ----- template for metadata change --------
         # mappings in cache
@@ -253,9 +251,13 @@ class Ftl(object):
         # blockpool
         raise NotImplementedError()
         """
+        old_ppns = yield self.env.process(
+                self._mappings.lpns_to_ppns(lpns, tag))
+
         # mappings in cache
         yield self.env.process(
-                self._mappings.update(lpn=lpn, ppn=new_ppn, tag=tag))
+                self._mappings.update_batch(OrderedDict(zip(lpns, new_ppns)),
+                    tag=tag))
 
         # mappings on flash
         #   handled by _mappings
@@ -265,8 +267,9 @@ class Ftl(object):
 
         # oob state
         # oob ppn->lpn/vpn
-        self.oob.relocate_data_page(lpn=lpn, old_ppn=old_ppn, new_ppn=new_ppn,
-                update_time=True)
+        for lpn, old_ppn, new_ppn in zip(lpns, old_ppns, new_ppns):
+            self.oob.relocate_data_page(lpn=lpn, old_ppn=old_ppn,
+                    new_ppn=new_ppn, update_time=True)
 
         # blockpool
         #   should be handled when we got new_ppn
@@ -304,7 +307,7 @@ class Ftl(object):
 
         ppns_to_read = yield self.env.process(
                 self._mappings.lpns_to_ppns(ext_single_m_vpn.lpn_iter(),
-                    tag=tag))
+                    tag=tag, prefetch=True))
         ppns_to_read = remove_invalid_ppns(ppns_to_read)
 
 
@@ -338,18 +341,39 @@ class Ftl(object):
         yield simpy.events.AllOf(self.env, procs)
 
     def _discard_single_mvpngroup(self, ext_single_m_vpn):
-        m_vpn = self.conf.lpn_to_m_vpn(ext_single_m_vpn.lpn_start)
+        lpns = ext_single_m_vpn.lpn_iter()
+        ppns = yield self.env.process(self._mappings.lpns_to_ppns(lpns))
 
-        ppns_to_invalidate = yield self.env.process(
-                self._mappings.lpns_to_ppns(ext_single_m_vpn.lpn_iter()))
+        # mark the discarded entries UNINITIATED in mem
+        mapping_dict = OrderedDict((lpn, UNINITIATED)
+                for lpn, ppn in zip(lpns, ppns) if ppn != UNINITIATED)
+        yield self.env.process(self._mappings.update_batch(mapping_dict))
 
-        ppns_to_invalidate = remove_invalid_ppns(ppns_to_invalidate)
+        self.oob.invalidate_ppns(remove_invalid_ppns(ppns))
+
+    def warm_up_write_ext(self, extent):
+        """
+        Apply a write to FTL state without flash access, time or recording.
+        New mappings go straight to the mappings on flash, so the mapping
+        cache must be empty. Translation pages are not rewritten.
+        """
+        new_mappings = self.get_ppns_to_write(extent)
+        mapping_on_flash = self._mappings.mapping_on_flash
 
-        mapping_dict = dict(itertools.izip_longest(
-            ppns_to_invalidate, (), fillvalue = UNINITIATED))
-        self._mappings.update_batch(mapping_dict)
+        for lpn in extent.lpn_iter():
+            old_ppn = mapping_on_flash.lpn_to_ppn(lpn)
+            new_ppn = new_mappings[lpn]
+            mapping_on_flash.update(lpn, new_ppn)
+            self.oob.relocate_data_page(lpn=lpn, old_ppn=old_ppn,
+                    new_ppn=new_ppn, update_time=True)
 
-        self.oob.invalidate_ppns(ppns_to_invalidate)
+    def warm_up_discard_ext(self, extent):
+        """
+        Same as discard_ext(), which invalidates the data pages only
+        """
+        mapping_on_flash = self._mappings.mapping_on_flash
+        ppns = [mapping_on_flash.lpn_to_ppn(lpn) for lpn in extent.lpn_iter()]
+        self.oob.invalidate_ppns(remove_invalid_ppns(ppns))
 
     def is_cleaning_needed(self):
         return self._cleaner.is_cleaning_needed()
@@ -417,6 +441,16 @@ def split_ext_to_mvpngroups(conf, extent):
 
     return group_extent_list
 
+def group_lpns_by_m_vpn(conf, lpns):
+    """
+    return an OrderedDict {m_vpn: [lpn, ...]}, in the order of first
+    appearance of each m_vpn
+    """
+    groups = OrderedDict()
+    for lpn in lpns:
+        groups.setdefault(conf.lpn_to_m_vpn(lpn), []).append(lpn)
+    return groups
+
 
 class MappingDict(dict):
     """
@@ -536,7 +570,8 @@ class InsertMixin(object):
         self.env.exit(locked_row_ids)
 
     def __evict_entry_for_insert(self, tag=None):
-        victim_row = self._victim_row(avoid_m_vpns=[])
+        # inserting does not lock any translation page, it can wait for one
+        victim_row = self._victim_row(wait_for_locked=True)
         victim_row.state = USED_AND_HOLD
 
         yield self._concurrent_trans_quota.get(1)
@@ -545,7 +580,7 @@ class InsertMixin(object):
         m_vpn = self.conf.lpn_to_m_vpn(lpn = victim_row.lpn)
         tp_req = self._trans_page_locks.get_request(m_vpn)
         yield tp_req
-        self._trans_page_locks.locked_addrs.add(m_vpn)
+        self.trans_page_locked(m_vpn)
 
         if victim_row.dirty == True:
             self.recorder.count_me('translation', 'write-back-dirty-for-insert')
@@ -563,9 +598,10 @@ class InsertMixin(object):
 
         self.recorder.count_me('translation', 'delete-lpn-in-table-for-insert')
         locked_row_id = self._lpn_table.delete_lpn_and_lock(victim_row.lpn)
+        self._forget_prefetched(m_vpn)
 
         self._trans_page_locks.release_request(m_vpn, tp_req)
-        self._trans_page_locks.locked_addrs.remove(m_vpn)
+        self.trans_page_unlocked(m_vpn)
 
         yield self._concurrent_trans_quota.put(1)
 
@@ -573,42 +609,51 @@ class InsertMixin(object):
 
 
 class LoadMixin(object):
-    def _load_missing(self, m_vpn, wanted_lpn, tag=None):
+    def _load_missing(self, m_vpn, wanted_lpns, tag=None,
+            as_least_recent=True, may_evict=True):
         """
-        Return True if we really load flash page
+        Return (loaded, ppns). loaded is True if we really load flash page.
+        ppns are of wanted_lpns, which all belong to m_vpn. A ppn is MISS
+        if its lpn is evicted before the load finishes. If may_evict is
+        False and there are not enough free rows, nothing is loaded.
         """
         yield self._concurrent_trans_quota.get(2)
         tp_req = self._trans_page_locks.get_request(m_vpn)
         yield tp_req
-        self._trans_page_locks.locked_addrs.add(m_vpn)
+        self.trans_page_locked(m_vpn)
 
         # check again before really loading
-        if wanted_lpn is not None and not self._lpn_table.has_lpn(wanted_lpn):
+        if not all(self._lpn_table.has_lpn(lpn) for lpn in wanted_lpns):
             n_needed = self._lpn_table.needed_space_for_m_vpn(m_vpn)
             locked_rows = self._lpn_table.lock_free_rows(n_needed)
             n_more = n_needed - len(locked_rows)
 
-            if n_more > 0:
-                more_locked_rows = yield self.env.process(
-                    self.__add_locked_room_for_load(n_more, loading_m_vpn=m_vpn,
-                        tag=tag))
-                locked_rows += more_locked_rows
+            if n_more > 0 and may_evict is False:
+                self._lpn_table.unlock_free_rows(locked_rows)
+                loaded = False
+            else:
+                if n_more > 0:
+                    more_locked_rows = yield self.env.process(
+                        self.__add_locked_room_for_load(n_more,
+                            loading_m_vpn=m_vpn, tag=tag))
+                    locked_rows += more_locked_rows
 
-            yield self.env.process(
-                self.__load_to_locked_space(m_vpn, locked_rows, tag=tag))
+                yield self.env.process(
+                    self.__load_to_locked_space(m_vpn, locked_rows, tag=tag,
+                        as_least_recent=as_least_recent))
 
-            loaded = True
+                loaded = True
         else:
             loaded = False
 
-        ppn = self._lpn_table.lpn_to_ppn(wanted_lpn)
+        ppns = [self._lpn_table.lpn_to_ppn(lpn) for lpn in wanted_lpns]
 
         self._trans_page_locks.release_request(m_vpn, tp_req)
-        self._trans_page_locks.locked_addrs.remove(m_vpn)
+        self.trans_page_unlocked(m_vpn)
 
         yield self._concurrent_trans_quota.put(2)
 
-        self.env.exit((loaded, ppn))
+        self.env.exit((loaded, ppns))
 
     def __add_locked_room_for_load(self, n_needed, loading_m_vpn, tag=None):
         locked_row_ids = []
@@ -620,15 +665,16 @@ class LoadMixin(object):
         self.env.exit(locked_row_ids)
 
     def __evict_entry_for_load(self, loading_m_vpn, tag=None):
-        victim_row = self._victim_row(
-                [loading_m_vpn] + list(self._trans_page_locks.locked_addrs))
+        # rows of loading_m_vpn and other locked translation pages are not
+        # evictable, waiting for their locks could deadlock
+        victim_row = self._victim_row()
         victim_row.state = USED_AND_HOLD
 
         m_vpn = self.conf.lpn_to_m_vpn(lpn = victim_row.lpn)
 
         tp_req = self._trans_page_locks.get_request(m_vpn)
         yield tp_req
-        self._trans_page_locks.locked_addrs.add(m_vpn)
+        self.trans_page_locked(m_vpn)
 
         if victim_row.dirty == True:
             self.recorder.count_me('translation', 'write-back-dirty-for-load')
@@ -645,13 +691,15 @@ class LoadMixin(object):
         # This is the only place that we delete a lpn
         self.recorder.count_me('translation', 'delete-lpn-in-table-for-load')
         locked_row_id = self._lpn_table.delete_lpn_and_lock(victim_row.lpn)
+        self._forget_prefetched(m_vpn)
 
         self._trans_page_locks.release_request(m_vpn, tp_req)
-        self._trans_page_locks.locked_addrs.remove(m_vpn)
+        self.trans_page_unlocked(m_vpn)
 
         self.env.exit(locked_row_id)
 
-    def __load_to_locked_space(self, m_vpn, locked_rows, tag=None):
+    def __load_to_locked_space(self, m_vpn, locked_rows, tag=None,
+            as_least_recent=True):
         """
         It should not call _write_back() directly or indirectly as it
         will deadlock.
@@ -666,7 +714,7 @@ class LoadMixin(object):
         unused_rows = locked_rows[n_needed:]
 
         self._lpn_table.add_lpns(needed_rows, uncached_mapping, False,
-                as_least_recent = True)
+                as_least_recent = as_least_recent)
         self._lpn_table.unlock_free_rows(unused_rows)
 
     def __get_uncached_mappings(self, mapping_dict):
@@ -676,6 +724,98 @@ class LoadMixin(object):
                 uncached_mapping[lpn] = ppn
         return uncached_mapping
 
+class PrefetchMixin(object):
+    """
+    Sequential prefetch of translation pages. When reads go to m_vpn
+    right after m_vpn - 1, the next prefetch_depth translation pages are
+    loaded in the background.
+
+    Prefetched mappings are cached as the most recent, as they are
+    expected to be used soon. Prefetch only uses free rows, it never
+    evicts (and writes back) cached mappings.
+
+    Counters of "Mapping_Cache_Prefetch":
+        issue: prefetches started
+        load: prefetches that read a translation page
+        skip: prefetches not done for lack of free rows
+        hit: first translations of prefetched m_vpns that need no load
+        waste: prefetched m_vpns that are evicted, or have to be loaded
+            again, before their first translation
+    """
+    def _init_prefetch(self):
+        self._prefetch_depth = self.conf['mapping_cache_prefetch_depth']
+        self._last_read_m_vpn = None
+        # m_vpn: prefetch process
+        self._prefetch_procs = {}
+        # m_vpns loaded by prefetch and not translated yet
+        self._prefetched_m_vpns = set()
+
+    def _detect_sequential(self, m_vpn, tag=None):
+        if self._prefetch_depth == 0 or m_vpn == self._last_read_m_vpn:
+            return
+
+        if self._last_read_m_vpn is not None and \
+                m_vpn == self._last_read_m_vpn + 1:
+            end = min(m_vpn + 1 + self._prefetch_depth,
+                    self.conf.total_translation_pages())
+            for next_m_vpn in range(m_vpn + 1, end):
+                self._start_prefetch(next_m_vpn, tag)
+
+        self._last_read_m_vpn = m_vpn
+
+    def _start_prefetch(self, m_vpn, tag=None):
+        n_needed = self._lpn_table.needed_space_for_m_vpn(m_vpn)
+        if m_vpn in self._prefetch_procs or n_needed == 0:
+            return
+        if n_needed > self._lpn_table.n_free_rows():
+            self.recorder.count_me("Mapping_Cache_Prefetch", "skip")
+            return
+
+        self.recorder.count_me("Mapping_Cache_Prefetch", "issue")
+        self._prefetch_procs[m_vpn] = self.env.process(
+                self._prefetch(m_vpn, tag))
+
+    def _prefetch(self, m_vpn, tag=None):
+        req = self._m_vpn_interface_lock.get_request(m_vpn)
+        yield req
+
+        uncached_lpns = self._lpn_table.get_un_cached_lpn_of_m_vpn(m_vpn)
+        if len(uncached_lpns) > 0:
+            loaded, ppns = yield self.env.process(self._load_missing(m_vpn,
+                wanted_lpns=[min(uncached_lpns)], tag=tag,
+                as_least_recent=False, may_evict=False))
+            if loaded == True:
+                self.recorder.count_me("Mapping_Cache_Prefetch", "load")
+                self._prefetched_m_vpns.add(m_vpn)
+            elif ppns[0] == MISS:
+                # free rows were taken while waiting for the lock
+                self.recorder.count_me("Mapping_Cache_Prefetch", "skip")
+
+        self._m_vpn_interface_lock.release_request(m_vpn, req)
+        del self._prefetch_procs[m_vpn]
+
+    def _use_prefetched(self, m_vpn, loaded):
+        if m_vpn in self._prefetched_m_vpns:
+            self._prefetched_m_vpns.remove(m_vpn)
+            if loaded == True:
+                self.recorder.count_me("Mapping_Cache_Prefetch", "waste")
+            else:
+                self.recorder.count_me("Mapping_Cache_Prefetch", "hit")
+
+    def _forget_prefetched(self, m_vpn):
+        """
+        Called after evicting an entry of m_vpn
+        """
+        if m_vpn in self._prefetched_m_vpns and \
+                self._lpn_table.needed_space_for_m_vpn(m_vpn) == \
+                self.conf.n_mapping_entries_per_page:
+            self._prefetched_m_vpns.remove(m_vpn)
+            self.recorder.count_me("Mapping_Cache_Prefetch", "waste")
+
+    def _wait_for_prefetches(self):
+        yield simpy.events.AllOf(self.env, self._prefetch_procs.values())
+
+
 class FlushMixin(object):
     """
     Write back all dirty entries in translation cache
@@ -684,23 +824,40 @@ class FlushMixin(object):
     calling flush
     """
     def _flush(self, tag=None):
-        for lpn, row in self._lpn_table.least_to_most_lpn_items():
-            if row.dirty is True:
-                # write back this m_vpn
-                m_vpn = self.conf.lpn_to_m_vpn(lpn)
+        """
+        Dirty translation pages are written back by as many processes as
+        channels, so reads and programs of different pages overlap.
+        """
+        m_vpns = deque(self._lpn_table.dirty_m_vpns())
+        n_procs = min(len(m_vpns), self.conf.n_channels_per_dev)
+
+        procs = [self.env.process(self._write_back_m_vpns(m_vpns, tag))
+                for i in range(n_procs)]
+        yield simpy.events.AllOf(self.env, procs)
+
+    def _write_back_m_vpns(self, m_vpns, tag=None):
+        """
+        Write back m_vpns until the shared deque m_vpns is empty
+        """
+        while len(m_vpns) > 0:
+            m_vpn = m_vpns.popleft()
 
-                tp_req = self._trans_page_locks.get_request(m_vpn)
-                yield tp_req
-                self._trans_page_locks.locked_addrs.add(m_vpn)
+            tp_req = self._trans_page_locks.get_request(m_vpn)
+            yield tp_req
+            self.trans_page_locked(m_vpn)
 
-                self.recorder.count_me('translation', 'write-back-dirty-for-flush')
+            # it may have been written back while we waited for the lock
+            if self._lpn_table.has_dirty_rows(m_vpn):
+                self.recorder.count_me('translation',
+                        'write-back-dirty-for-flush')
                 yield self.env.process(self._write_back(m_vpn, tag))
 
-                self._trans_page_locks.release_request(m_vpn, tp_req)
-                self._trans_page_locks.locked_addrs.remove(m_vpn)
+            self._trans_page_locks.release_request(m_vpn, tp_req)
+            self.trans_page_unlocked(m_vpn)
 
 
-class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
+class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, PrefetchMixin,
+        FlushMixin):
     """
     TODO: should separate operations that do/do not change recency
     """
@@ -726,39 +883,104 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
                 capacity=capsize)
         self._m_vpn_interface_lock = LockPool(self.env)
 
+        self._init_prefetch()
+
     def update_batch(self, mapping_dict, tag=None):
-        for lpn, ppn in mapping_dict.items():
-            yield self.env.process(self.update(lpn, ppn, tag))
+        """
+        Mappings of the same m_vpn are updated together, holding the m_vpn
+        lock once. Mappings are updated in the order of mapping_dict.
+        """
+        groups = group_lpns_by_m_vpn(self.conf, mapping_dict.keys())
+        for m_vpn, lpns in groups.items():
+            yield self.env.process(self._update_m_vpn(m_vpn,
+                [(lpn, mapping_dict[lpn]) for lpn in lpns], tag))
 
     def update(self, lpn, ppn, tag=None):
         """
         All translation and update of the same m_vpn are serialized.
         """
         m_vpn = self.conf.lpn_to_m_vpn(lpn)
+        return self._update_m_vpn(m_vpn, [(lpn, ppn)], tag)
+
+    def _update_m_vpn(self, m_vpn, mappings, tag=None):
+        """
+        mappings is a list of (lpn, ppn), all lpns belong to m_vpn
+        """
         req = self._m_vpn_interface_lock.get_request(m_vpn)
         yield req
 
-        if self._lpn_table.has_lpn(lpn):
-            self.recorder.count_me('translation', 'overwrite-in-cache')
-            self._lpn_table.overwrite_lpn(lpn, ppn, dirty=True)
-        else:
-            if self._lpn_table.n_free_rows() > 0:
-                self.recorder.count_me('translation', 'insert-to-free')
-                self._add_to_free(lpn, ppn)
+        for lpn, ppn in mappings:
+            if self._lpn_table.has_lpn(lpn):
+                self.recorder.count_me('translation', 'overwrite-in-cache')
+                self._lpn_table.overwrite_lpn(lpn, ppn, dirty=True)
             else:
-                yield self.env.process(self._insert_new_mapping(lpn, ppn, tag))
+                if self._lpn_table.n_free_rows() > 0:
+                    self.recorder.count_me('translation', 'insert-to-free')
+                    self._add_to_free(lpn, ppn)
+                else:
+                    yield self.env.process(
+                        self._insert_new_mapping(lpn, ppn, tag))
 
         self._m_vpn_interface_lock.release_request(m_vpn, req)
 
-    def lpns_to_ppns(self, lpns, tag=None):
+    def lpns_to_ppns(self, lpns, tag=None, prefetch=False):
+        """
+        Lpns of the same m_vpn are translated together, holding the m_vpn
+        lock once and loading the translation page at most once.
+
+        prefetch is True for reads from the host, which can start
+        prefetching if they are sequential.
         """
-        If lpns are of the same m_vpn, this process will only
-        have one cache miss.
+        lpns = list(lpns)
+        groups = group_lpns_by_m_vpn(self.conf, lpns)
+        ppn_of = {}
+        for m_vpn, lpns_of_m_vpn in groups.items():
+            if prefetch is True:
+                self._detect_sequential(m_vpn, tag)
+            ppns = yield self.env.process(
+                self._lpns_to_ppns_of_m_vpn(m_vpn, lpns_of_m_vpn, tag))
+            ppn_of.update(zip(lpns_of_m_vpn, ppns))
+        self.env.exit([ppn_of[lpn] for lpn in lpns])
+
+    def _lpns_to_ppns_of_m_vpn(self, m_vpn, lpns, tag=None):
         """
-        ppns = []
+        all lpns belong to m_vpn
+        """
+        req = self._m_vpn_interface_lock.get_request(m_vpn)
+        yield req
+
+        # mappings of lpns cannot change while we hold the m_vpn lock, so
+        # a ppn is kept once it is found, even if its entry is evicted later
+        ppn_of = {}
         for lpn in lpns:
-            ppn = yield self.env.process(self.lpn_to_ppn(lpn, tag))
-            ppns.append(ppn)
+            ppn = self._lpn_table.lpn_to_ppn(lpn)
+            if ppn != MISS:
+                ppn_of[lpn] = ppn
+
+        n_loads = 0
+        missing = [lpn for lpn in lpns if not lpn in ppn_of]
+        while len(missing) > 0:
+            # entries loaded can be evicted by others before we get them
+            loaded, ppns = yield self.env.process(
+                self._load_missing(m_vpn, wanted_lpns=missing, tag=tag))
+            if loaded == True:
+                n_loads += 1
+            for lpn, ppn in zip(missing, ppns):
+                if ppn != MISS:
+                    ppn_of[lpn] = ppn
+            missing = [lpn for lpn in missing if not lpn in ppn_of]
+
+        ppns = [ppn_of[lpn] for lpn in lpns]
+        self._use_prefetched(m_vpn, n_loads > 0)
+
+        if n_loads > 0:
+            self.recorder.add_to_general_accumulater("Mapping_Cache", "miss",
+                    n_loads)
+        if len(lpns) > n_loads:
+            self.recorder.add_to_general_accumulater("Mapping_Cache", "hit",
+                    len(lpns) - n_loads)
+
+        self._m_vpn_interface_lock.release_request(m_vpn, req)
         self.env.exit(ppns)
 
     def lpn_to_ppn(self, lpn, tag=None):
@@ -773,8 +995,9 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
 
         ppn = self._lpn_table.lpn_to_ppn(lpn)
         if ppn == MISS:
-            loaded, ppn = yield self.env.process(
-                self._load_missing(m_vpn, wanted_lpn=lpn, tag=tag))
+            loaded, ppns = yield self.env.process(
+                self._load_missing(m_vpn, wanted_lpns=[lpn], tag=tag))
+            ppn = ppns[0]
             assert ppn != MISS
         else:
             loaded = False
@@ -783,11 +1006,13 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
             self.recorder.count_me("Mapping_Cache", "miss")
         else:
             self.recorder.count_me("Mapping_Cache", "hit")
+        self._use_prefetched(m_vpn, loaded)
 
         self._m_vpn_interface_lock.release_request(m_vpn, req)
         self.env.exit(ppn)
 
     def flush(self):
+        yield self.env.process(self._wait_for_prefetches())
         yield self.env.process(self._flush())
 
     def drop(self):
@@ -797,64 +1022,210 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
             self._lpn_table.delete_lpn_and_lock(lpn)
             row.state = FREE
 
-    def _victim_row(self, avoid_m_vpns):
-        for lpn, row in self._lpn_table.least_to_most_lpn_items():
-            if row.state == USED:
-                m_vpn = self.conf.lpn_to_m_vpn(lpn)
-                if not m_vpn in avoid_m_vpns:
-                    return row
+    def trans_page_locked(self, m_vpn):
+        """
+        Called after taking the lock of translation page m_vpn. Rows of
+        m_vpn are not evictable until trans_page_unlocked().
+        """
+        self._trans_page_locks.locked_addrs.add(m_vpn)
+        self._lpn_table.pin_group(m_vpn)
+
+    def trans_page_unlocked(self, m_vpn):
+        """
+        Called after releasing the lock of translation page m_vpn
+        """
+        self._trans_page_locks.locked_addrs.remove(m_vpn)
+        self._lpn_table.unpin_group(m_vpn)
+
+    def _victim_row(self, wait_for_locked=False):
+        """
+        Rows being evicted and rows of locked translation pages are not
+        evictable. If wait_for_locked is True and there is no evictable
+        row, a row of a locked translation page is returned, the caller
+        has to wait for the lock.
+        """
+        row = self._lpn_table.first_evictable_row()
+        if row is not None:
+            return row
+        if wait_for_locked is True:
+            for lpn, row in self._lpn_table.pinned_used_lpn_items():
+                return row
         raise RuntimeError("Cannot find a victim. Current stats: {}"\
-                ", avoid_m_vpns: {}.\n"
-                .format(str(self._lpn_table.stats()), avoid_m_vpns))
+                ", locked m_vpns: {}.\n"
+                .format(str(self._lpn_table.stats()),
+                    self._trans_page_locks.locked_addrs))
 
 
 FREE, FREE_AND_LOCKED, USED, USED_AND_LOCKED, USED_AND_HOLD = \
         'FREE', 'FREE_AND_LOCKED', 'USED', 'USED_AND_LOCKED', 'USED_AND_HOLD'
+ROW_STATES = (FREE, FREE_AND_LOCKED, USED, USED_AND_LOCKED, USED_AND_HOLD)
 
 class LpnTable(object):
-    def __init__(self, n_rows):
+    def __init__(self, n_rows, policy = 'LruCache', lpn_to_group = None):
+        """
+        policy is the replacement policy of the rows, see
+        create_replacement_policy(). lpn_to_group is used by
+        GroupLruCache.
+        """
         self._n_rows = n_rows
 
+        # number of rows in each state, kept up to date by the rows
+        self._state_counts = dict.fromkeys(ROW_STATES, 0)
+        # ids of FREE rows, the top is the next row to lock. A row that
+        # leaves FREE stays in the stack until it is popped and skipped.
+        self._free_row_ids = []
+
         self._rows = self._fresh_rows()
 
         # lpns to Row instances, it is a dict
         # {lpn1: row1, lpn2: row2, ...}
-        # self._lpn_to_row = SegmentedLruCache(n_rows, 0.5)
-        # self._lpn_to_row = LruDict()
-        self._lpn_to_row = LruCache()
+        # It also decides which row to evict. It only has USED rows.
+        self._lpn_to_row = create_replacement_policy(policy, n_rows,
+                lpn_to_group)
+        # lpns to cached rows that are locked or held. They are out of
+        # the replacement policy until they are USED again, so looking
+        # for a victim does not walk over them.
+        self._pinned_rows = {}
+
+        # groups (by lpn_to_group) whose USED rows are not evictable, see
+        # pin_group(). Their rows are moved to _pinned_rows when a victim
+        # walk meets them, group -> rows moved.
+        self._lpn_to_group = lpn_to_group
+        self._pinned_groups = {}
+        # USED rows moved out for their group that are hit while pinned,
+        # they go back as the last to evict
+        self._recent_pinned_lpns = set()
 
     def _fresh_rows(self):
-         return [
-            Row(lpn = None, ppn = None, dirty = False, state = FREE, rowid = i)
+        self._state_counts[FREE] = self._n_rows
+        # lower row ids are locked first
+        self._free_row_ids = range(self._n_rows - 1, -1, -1)
+        return [
+            Row(lpn = None, ppn = None, dirty = False, state = FREE, rowid = i,
+                table = self)
             for i in range(self._n_rows) ]
 
     def rows(self):
         return self._rows
 
-    def _count_states(self):
+    def _row_state_changed(self, row, old_state, new_state):
+        self._state_counts[old_state] -= 1
+        self._state_counts[new_state] += 1
+        if new_state == FREE:
+            self._free_row_ids.append(row.rowid)
+        elif old_state == USED and new_state in (USED_AND_LOCKED,
+                USED_AND_HOLD):
+            if row.lpn in self._pinned_rows:
+                # moved out for its pinned group already
+                self._recent_pinned_lpns.discard(row.lpn)
+            else:
+                del self._lpn_to_row[row.lpn]
+                self._pinned_rows[row.lpn] = row
+        elif old_state == USED_AND_LOCKED and new_state == USED:
+            # locked to be used
+            del self._pinned_rows[row.lpn]
+            self._lpn_to_row[row.lpn] = row
+        elif old_state == USED_AND_HOLD and new_state == USED:
+            # held to be evicted
+            del self._pinned_rows[row.lpn]
+            self._lpn_to_row.add_as_least_used(row.lpn, row)
+
+    def pin_group(self, group):
         """
-        slower but reduces duplication
+        USED rows of group are not evictable until unpin_group(). It
+        takes O(1), rows are moved out of the replacement policy by
+        first_evictable_row() when it meets them.
         """
-        counter = Counter()
-        for row in self._rows:
-            counter[row.state] += 1
-        return counter
+        assert not group in self._pinned_groups
+        self._pinned_groups[group] = []
+
+    def unpin_group(self, group):
+        """
+        Rows moved out for group go back to where they were in the
+        replacement policy, unless they were hit while pinned, then they
+        go back as the last to evict.
+        """
+        moved_rows = self._pinned_groups.pop(group)
+        recent_rows = []
+        for row in reversed(moved_rows):
+            if self._pinned_rows.get(row.lpn) is not row or \
+                    row.state != USED:
+                # evicted, locked or held since it was moved
+                continue
+            del self._pinned_rows[row.lpn]
+            if row.lpn in self._recent_pinned_lpns:
+                self._recent_pinned_lpns.remove(row.lpn)
+                recent_rows.append(row)
+            else:
+                self._lpn_to_row.add_as_least_used(row.lpn, row)
+
+        for row in reversed(recent_rows):
+            self._lpn_to_row[row.lpn] = row
+
+    def first_evictable_row(self):
+        """
+        The first USED row to evict that is not of a pinned group, or
+        None. Rows of pinned groups before it are moved out of the
+        replacement policy, so later walks do not go over them again.
+        """
+        victim = None
+        moved = []
+        for lpn, row in self._lpn_to_row.least_to_most_items():
+            if len(self._pinned_groups) > 0:
+                group = self._lpn_to_group(lpn)
+                if group in self._pinned_groups:
+                    moved.append((group, row))
+                    continue
+            victim = row
+            break
+
+        for group, row in moved:
+            del self._lpn_to_row[row.lpn]
+            self._pinned_rows[row.lpn] = row
+            self._pinned_groups[group].append(row)
+
+        return victim
+
+    def _peek_row(self, lpn):
+        """
+        Raise KeyError if lpn is not cached. It does not change recency.
+        """
+        row = self._pinned_rows.get(lpn)
+        if row is None:
+            row = self._lpn_to_row.peek(lpn)
+        return row
+
+    def _get_row(self, lpn):
+        """
+        Like _peek_row(), but it is a hit to the replacement policy
+        """
+        row = self._pinned_rows.get(lpn)
+        if row is None:
+            row = self._lpn_to_row[lpn]
+        elif row.state == USED:
+            # a hit to a row moved out for its pinned group
+            self._recent_pinned_lpns.add(lpn)
+        return row
+
+    def _count_states(self):
+        return Counter(self._state_counts)
 
     def n_free_rows(self):
-        return self._count_states()[FREE]
+        return self._state_counts[FREE]
 
     def n_locked_free_rows(self):
-        return self._count_states()[FREE_AND_LOCKED]
+        return self._state_counts[FREE_AND_LOCKED]
 
     def n_used_rows(self):
-        return self._count_states()[USED]
+        return self._state_counts[USED]
 
     def n_locked_used_rows(self):
-        return self._count_states()[USED_AND_LOCKED]
+        return self._state_counts[USED_AND_LOCKED]
 
     def lock_free_row(self):
         """FREE TO FREE_AND_LOCKED"""
-        for row in self._rows:
+        while len(self._free_row_ids) > 0:
+            row = self._rows[self._free_row_ids.pop()]
             if row.state == FREE:
                 row.state = FREE_AND_LOCKED
                 return row.rowid
@@ -878,15 +1249,11 @@ class LpnTable(object):
 
     def lock_free_rows(self, n):
         row_ids = []
-        got = 0
-        for row in self._rows:
-            if row.state == FREE:
-                row.state = FREE_AND_LOCKED
-                row_ids.append(row.rowid)
-                got += 1
-
-                if got == n:
-                    break
+        while len(row_ids) < n:
+            rowid = self.lock_free_row()
+            if rowid is None:
+                break
+            row_ids.append(rowid)
         return row_ids
 
     def unlock_free_row(self, rowid):
@@ -899,11 +1266,11 @@ class LpnTable(object):
             self.unlock_free_row(row_id)
 
     def lock_lpn(self, lpn):
-        row = self._lpn_to_row.peek(lpn)
+        row = self._peek_row(lpn)
         row.state = USED_AND_LOCKED
 
     def unlock_lpn(self, lpn):
-        row = self._lpn_to_row.peek(lpn)
+        row = self._peek_row(lpn)
         assert row.state == USED_AND_LOCKED
         row.state = USED
 
@@ -946,7 +1313,7 @@ class LpnTable(object):
 
     def lpn_to_ppn(self, lpn):
         try:
-            row = self._lpn_to_row[lpn]
+            row = self._get_row(lpn)
         except KeyError:
             return MISS
         else:
@@ -957,18 +1324,18 @@ class LpnTable(object):
             self.mark_clean(lpn)
 
     def mark_clean(self, lpn):
-        row = self._lpn_to_row.peek(lpn)
+        row = self._peek_row(lpn)
         assert row.state in (USED, USED_AND_HOLD)
         row.dirty = False
 
     def overwrite_lpn(self, lpn, ppn, dirty):
-        row = self._lpn_to_row[lpn]
+        row = self._get_row(lpn)
         row.lpn = lpn
         row.ppn = ppn
         row.dirty = dirty
 
     def is_dirty(self, lpn):
-        row = self._lpn_to_row.peek(lpn)
+        row = self._peek_row(lpn)
         return row.dirty
 
     def row_state(self, rowid):
@@ -976,9 +1343,13 @@ class LpnTable(object):
 
     def delete_lpn_and_lock(self, lpn):
         assert self.has_lpn(lpn)
-        row = self._lpn_to_row.peek(lpn)
+        row = self._peek_row(lpn)
         assert row.state == USED
-        del self._lpn_to_row[lpn]
+        if lpn in self._pinned_rows:
+            del self._pinned_rows[lpn]
+            self._recent_pinned_lpns.discard(lpn)
+        else:
+            del self._lpn_to_row[lpn]
         row.clear_data()
         row.state = FREE_AND_LOCKED
 
@@ -986,30 +1357,90 @@ class LpnTable(object):
 
     def has_lpn(self, lpn):
         try:
-            row = self._lpn_to_row.peek(lpn)
+            row = self._peek_row(lpn)
         except KeyError:
             return False
         else:
             return True
 
+    def evictable_lpn_items(self):
+        """
+        (lpn, row) of USED rows, from the first to evict. Rows of pinned
+        groups not met by first_evictable_row() yet are included.
+        """
+        return self._lpn_to_row.least_to_most_items()
+
+    def pinned_used_lpn_items(self):
+        """
+        (lpn, row) of USED rows moved out for their pinned groups
+        """
+        return [(lpn, row) for lpn, row in self._pinned_rows.items()
+                if row.state == USED]
+
     def stats(self):
         return self._count_states()
 
 
+def create_replacement_policy(policy, n_rows, lpn_to_group = None):
+    """
+    All policies map lpn to row and provide peek(), add_as_least_used()
+    and least_to_most_items(), which lists entries from the first to
+    the last to evict. Getting or setting an entry is a hit.
+    """
+    if policy == 'LruCache':
+        return LruCache()
+    elif policy == 'ArrayLruCache':
+        return ArrayLruCache(n_rows, slot_of = lambda row: row.rowid)
+    elif policy == 'ClockCache':
+        return ClockCache()
+    elif policy == 'SegmentedLruCache':
+        return SegmentedLruCache(n_rows, 0.5)
+    elif policy == 'TwoQueueCache':
+        return TwoQueueCache(n_rows)
+    elif policy == 'GroupLruCache':
+        return GroupLruCache(lpn_to_group)
+    else:
+        raise ValueError("{} is not a valid replacement policy".format(policy))
+
+
 class LpnTableMvpn(LpnTable):
     """
     With addition supports related to m_vpn
     """
     def __init__(self, conf):
-        super(LpnTableMvpn, self).__init__(conf.n_cache_entries)
+        super(LpnTableMvpn, self).__init__(conf.n_lpn_table_rows,
+                conf['mapping_cache_policy'], conf.lpn_to_m_vpn)
         self.conf = conf
 
+        # m_vpn to the set of rows caching its lpns
+        # {m_vpn1: set([row1, row2]), ...}
+        self._m_vpn_to_rows = {}
+
+    def add_lpn(self, rowid, lpn, ppn, dirty, as_least_recent = False):
+        super(LpnTableMvpn, self).add_lpn(rowid, lpn, ppn, dirty,
+                as_least_recent)
+        m_vpn = self.conf.lpn_to_m_vpn(lpn)
+        self._m_vpn_to_rows.setdefault(m_vpn, set()).add(self._rows[rowid])
+
+    def delete_lpn_and_lock(self, lpn):
+        m_vpn = self.conf.lpn_to_m_vpn(lpn)
+        rows = self._m_vpn_to_rows[m_vpn]
+        rows.remove(self._peek_row(lpn))
+        if len(rows) == 0:
+            del self._m_vpn_to_rows[m_vpn]
+
+        return super(LpnTableMvpn, self).delete_lpn_and_lock(lpn)
+
     def least_to_most_lpn_items(self):
-        return self._lpn_to_row.least_to_most_items()
+        """
+        all cached (lpn, row), locked and held ones first
+        """
+        return itertools.chain(self._pinned_rows.items(),
+                self.evictable_lpn_items())
 
     def needed_space_for_m_vpn(self, m_vpn):
-        cached_mappings = self.get_m_vpn_mappings(m_vpn)
-        return self.conf.n_mapping_entries_per_page - len(cached_mappings)
+        n_cached = len(self._m_vpn_to_rows.get(m_vpn, ()))
+        return self.conf.n_mapping_entries_per_page - n_cached
 
     def get_m_vpn_mappings(self, m_vpn):
         """ return all the mappings of m_vpn that are in cache
@@ -1031,22 +1462,27 @@ class LpnTableMvpn(LpnTable):
         return row_ids
 
     def _rows_of_m_vpn(self, m_vpn):
-        lpns = self.conf.m_vpn_to_lpns(m_vpn)
-        rows = []
-        for lpn in lpns:
-            try:
-                row = self._lpn_to_row.peek(lpn)
-            except KeyError:
-                pass
-            else:
-                rows.append(row)
+        """
+        rows of m_vpn in cache, in the order of lpn
+        """
+        rows = self._m_vpn_to_rows.get(m_vpn, ())
+        return sorted(rows, key = lambda row: row.lpn)
 
-        return rows
+    def dirty_m_vpns(self):
+        """
+        m_vpns that have dirty entries in cache, in increasing order
+        """
+        return sorted(m_vpn for m_vpn in self._m_vpn_to_rows.keys()
+                if self.has_dirty_rows(m_vpn))
+
+    def has_dirty_rows(self, m_vpn):
+        return any(row.dirty is True
+                for row in self._m_vpn_to_rows.get(m_vpn, ()))
 
     def get_un_cached_lpn_of_m_vpn(self, m_vpn):
         lpns = self.conf.m_vpn_to_lpns(m_vpn)
-        cached_dict = self.get_m_vpn_mappings(m_vpn)
-        uncached_lpns = set(lpns) - set(cached_dict.keys())
+        cached_lpns = [row.lpn for row in self._m_vpn_to_rows.get(m_vpn, ())]
+        uncached_lpns = set(lpns).difference(cached_lpns)
         return uncached_lpns
 
 
@@ -1065,12 +1501,14 @@ class _Row(object):
 
 
 class Row(object):
-    def __init__(self, lpn, ppn, dirty, state, rowid):
+    def __init__(self, lpn, ppn, dirty, state, rowid, table=None):
         self._lpn = lpn
         self._ppn = ppn
         self._dirty = dirty
         self._state = state
         self._rowid = rowid
+        # the LpnTable counting the states of its rows
+        self._table = table
 
     def _assert_modification_allowed(self):
          assert self._state in (FREE_AND_LOCKED, USED, USED_AND_HOLD), \
@@ -1135,7 +1573,10 @@ class Row(object):
                     "current state {}".format(self._state)
         else:
             raise RuntimeError("{} is not a valid state".format(state_value))
+        old_state = self._state
         self._state = state_value
+        if self._table is not None:
+            self._table._row_state_changed(self, old_state, state_value)
 
     @property
     def rowid(self):
@@ -1179,9 +1620,15 @@ class MappingOnFlash(object):
 
         self.n_entries_per_page = self.conf.n_mapping_entries_per_page
 
-        # do the easy thing first, if necessary, we can later use list or
-        # other data structure
-        self.entries = {}
+        # ppn of each lpn, UNINITIATED_PN if lpn is not mapped. It grows
+        # by translation pages if an lpn is beyond it.
+        self.entries = array.array('l', [UNINITIATED_PN]) * \
+                self.conf.n_lpns_on_flash
+
+    def _grow(self, lpn):
+        m_vpn = self.conf.lpn_to_m_vpn(lpn)
+        n = (m_vpn + 1) * self.n_entries_per_page - len(self.entries)
+        self.entries.extend(array.array('l', [UNINITIATED_PN]) * n)
 
     def lpn_to_ppn(self, lpn):
         """
@@ -1189,9 +1636,20 @@ class MappingOnFlash(object):
         None because at the beginning there is no mapping. No valid data block
         on device.
         """
-        return self.entries.get(lpn, UNINITIATED)
+        if lpn >= len(self.entries):
+            return UNINITIATED
+
+        ppn = self.entries[lpn]
+        if ppn == UNINITIATED_PN:
+            return UNINITIATED
+        return ppn
 
     def update(self, lpn, ppn):
+        if lpn >= len(self.entries):
+            self._grow(lpn)
+
+        if ppn == UNINITIATED:
+            ppn = UNINITIATED_PN
         self.entries[lpn] = ppn
 
     def batch_update(self, mapping_dict):
@@ -1206,7 +1664,9 @@ class MappingOnFlash(object):
         return d
 
     def __repr__(self):
-        return "global mapping table: {}".format(repr(self.entries))
+        mapping = dict((lpn, ppn) for lpn, ppn in enumerate(self.entries)
+                if ppn != UNINITIATED_PN)
+        return "global mapping table: {}".format(repr(mapping))
 
 
 class GlobalTranslationDirectory(object):
@@ -1228,8 +1688,9 @@ class GlobalTranslationDirectory(object):
 
         # M_VPN -> M_PPN
         # Virtual translation page number --> Physical translation page number
-        # Dftl should initialize
-        self.mapping = {}
+        # Dftl should initialize. UNINITIATED_PN if m_vpn has no mapping.
+        self.mapping = array.array('l', [UNINITIATED_PN]) * \
+                self.conf.total_translation_pages()
 
         self._initialize()
 
@@ -1243,13 +1704,14 @@ class GlobalTranslationDirectory(object):
         """
         total_pages = self.conf.total_translation_pages()
 
-        # use some free blocks to be translation blocks
-        tmp_blk_mapping = {}
-        for m_vpn in range(total_pages):
-            m_ppn = self.block_pool.next_translation_page_to_program()
-            # Note that we don't actually read or write flash
-            self.add_mapping(m_vpn=m_vpn, m_ppn=m_ppn)
-            # update oob of the translation page
+        # use some free blocks to be translation blocks, the pages are
+        # the same as getting them one by one
+        m_ppns = self.block_pool.next_n_translation_pages_to_program(
+                total_pages)
+        # Note that we don't actually read or write flash
+        self.add_mappings(m_ppns)
+        # update oob of the translation pages
+        for m_vpn, m_ppn in enumerate(m_ppns):
             self.oob.relocate_trans_page(m_vpn=m_vpn, old_ppn=UNINITIATED,
                 new_ppn=m_ppn, update_time=True)
 
@@ -1257,19 +1719,32 @@ class GlobalTranslationDirectory(object):
         """
         m_vpn virtual translation page number. It should always be successfull.
         """
-        return self.mapping[m_vpn]
+        m_ppn = self.mapping[m_vpn]
+        if m_ppn == UNINITIATED_PN:
+            raise KeyError(m_vpn)
+        return m_ppn
 
     def add_mapping(self, m_vpn, m_ppn):
-        if self.mapping.has_key(m_vpn):
+        if self.mapping[m_vpn] != UNINITIATED_PN:
             raise RuntimeError("self.mapping already has m_vpn:{}"\
                 .format(m_vpn))
         self.mapping[m_vpn] = m_ppn
 
+    def add_mappings(self, m_ppns):
+        """
+        m_ppns[i] is the m_ppn of m_vpn i. No m_vpn can have a mapping.
+        """
+        if self.mapping.count(UNINITIATED_PN) != len(self.mapping):
+            raise RuntimeError("self.mapping already has mappings")
+        self.mapping[:len(m_ppns)] = array.array('l', m_ppns)
+
     def update_mapping(self, m_vpn, m_ppn):
         self.mapping[m_vpn] = m_ppn
 
     def remove_mapping(self, m_vpn):
-        del self.mapping[m_vpn]
+        if self.mapping[m_vpn] == UNINITIATED_PN:
+            raise KeyError(m_vpn)
+        self.mapping[m_vpn] = UNINITIATED_PN
 
     def lpn_to_m_ppn(self, lpn):
         m_vpn = self.conf.lpn_to_m_vpn(lpn)
@@ -1277,7 +1752,9 @@ class GlobalTranslationDirectory(object):
         return m_ppn
 
     def __repr__(self):
-        return repr(self.mapping)
+        mapping = dict((m_vpn, m_ppn) for m_vpn, m_ppn in
+                enumerate(self.mapping) if m_ppn != UNINITIATED_PN)
+        return repr(mapping)
 
 class WearLevelingVictimBlocks(object):
     TYPE_DATA = 'TYPE_DATA'
@@ -1596,10 +2073,16 @@ class DataBlockCleaner(object):
 
         self.log(blocknum)
 
-        ppn_start, ppn_end = self.conf.block_to_page_range(blocknum)
-        for ppn in range(ppn_start, ppn_end):
-            if self.oob.states.is_page_valid(ppn):
-                yield self.env.process(self._clean_page(ppn, purpose))
+        # valid pages of the same m_vpn are moved together, so their
+        # mappings are updated in one batch
+        lpn_to_ppn = OrderedDict()
+        for ppn in self.oob.states.valid_pages_of_block(blocknum):
+            lpn_to_ppn[self.oob.ppn_to_lpn_or_mvpn(ppn)] = ppn
+
+        groups = group_lpns_by_m_vpn(self.conf, lpn_to_ppn.keys())
+        for lpns in groups.values():
+            yield self.env.process(self._clean_pages(
+                [(lpn, lpn_to_ppn[lpn]) for lpn in lpns], purpose))
 
         yield self.env.process(
             self.flash.erase_pbn_extent(blocknum, 1,
@@ -1609,9 +2092,53 @@ class DataBlockCleaner(object):
         self.oob.erase_block(blocknum)
         self.block_pool.move_used_data_block_to_free(blocknum)
 
-    def _clean_page(self, ppn, purpose):
+    def _clean_pages(self, pages, purpose):
         """
-        read ppn, write to new ppn, update metadata
+        pages is a list of (lpn, ppn) of the same m_vpn.
+        read each ppn, write it to a new ppn, then update metadata of
+        all the pages
+        """
+        moved = []
+        for lpn, ppn in pages:
+            if not self.oob.states.is_page_valid(ppn):
+                # overwritten while we were moving other pages
+                continue
+            new_ppn = yield self.env.process(self._move_page(ppn, purpose))
+            moved.append((lpn, ppn, new_ppn))
+
+        # pages overwritten while they were moved are not valid anymore,
+        # their new copies are stale and must be invalidated, or they would
+        # stay ERASED in OOB although they are programmed.
+        for lpn, ppn, new_ppn in moved:
+            if not self.oob.states.is_page_valid(ppn):
+                self.oob.invalidate_ppn(new_ppn)
+        moved = [(lpn, ppn, new_ppn) for lpn, ppn, new_ppn in moved
+                if self.oob.states.is_page_valid(ppn)]
+
+        # mappings in cache
+        yield self.env.process(self.mappings.update_batch(
+            OrderedDict((lpn, new_ppn) for lpn, _, new_ppn in moved)))
+
+        # mappings on flash
+        # handled by self.mappings
+
+        # translation directory
+        # handled by self.mappings
+
+        # oob state
+        for lpn, ppn, new_ppn in moved:
+            self.oob.relocate_data_page(lpn=lpn, old_ppn=ppn, new_ppn=new_ppn,
+                    update_time=False)
+
+        # oob ppn->lpn/vpn
+        # handled above
+
+        # blockpool
+        # handled by next_gc_data_page_to_program
+
+    def _move_page(self, ppn, purpose):
+        """
+        read ppn and write it to a new ppn, return the new ppn
         """
         assert self.oob.states.is_page_valid(ppn) is True
 
@@ -1634,27 +2161,7 @@ class DataBlockCleaner(object):
             self.flash.rw_ppn_extent(new_ppn, 1, 'write',
                 tag=self.recorder.get_tag('write.data.gc', None)))
 
-        lpn = self.oob.ppn_to_lpn_or_mvpn(ppn)
-
-        # mappings in cache
-        yield self.env.process(
-            self.mappings.update(lpn=lpn, ppn=new_ppn, tag=None))
-
-        # mappings on flash
-        # handled by self.mappings
-
-        # translation directory
-        # handled by self.mappings
-
-        # oob state
-        self.oob.relocate_data_page(lpn=lpn, old_ppn=ppn, new_ppn=new_ppn,
-                update_time=False)
-
-        # oob ppn->lpn/vpn
-        # handled above
-
-        # blockpool
-        # handled by next_gc_data_page_to_program
+        self.env.exit(new_ppn)
 
 
 class TransBlockCleaner(object):
@@ -1679,8 +2186,8 @@ class TransBlockCleaner(object):
         assert blocknum in self.block_pool.used_blocks
         # assert blocknum not in self.block_pool.current_blocks()
 
-        ppn_start, ppn_end = self.conf.block_to_page_range(blocknum)
-        for ppn in range(ppn_start, ppn_end):
+        for ppn in self.oob.states.valid_pages_of_block(blocknum):
+            # the page may be overwritten while earlier pages are moved
             if self.oob.states.is_page_valid(ppn):
                 yield self.env.process(self._clean_page(ppn, purpose))
 
@@ -1704,7 +2211,7 @@ class TransBlockCleaner(object):
 
         tp_req = self._trans_page_locks.get_request(m_vpn)
         yield tp_req
-        self._trans_page_locks.locked_addrs.add(m_vpn)
+        self.mappings.trans_page_locked(m_vpn)
 
         yield self.env.process(
             self.flash.rw_ppn_extent(ppn, 1, 'read',
@@ -1741,30 +2248,21 @@ class TransBlockCleaner(object):
         # handled by next_gc_trans_page_to_program
 
         self._trans_page_locks.release_request(m_vpn, tp_req)
-        self._trans_page_locks.locked_addrs.remove(m_vpn)
+        self.mappings.trans_page_unlocked(m_vpn)
 
 
-class OutOfBandAreas(object):
+class OutOfBandAreas(OutOfBandAreasBase):
     """
     It is used to hold page state and logical page number of a page.
     It is not necessary to implement it as list. But the interface should
     appear to be so.  It consists of page state (bitmap) and logical page
-    number (dict).  Let's proivde more intuitive interfaces: OOB should accept
+    number (array).  Let's proivde more intuitive interfaces: OOB should accept
     events, and react accordingly to this event. The action may involve state
     and lpn_of_phy_page.
     """
-    def __init__(self, confobj):
-        self.conf = confobj
-
-        self.flash_num_blocks = confobj.n_blocks_per_dev
-        self.flash_npage_per_block = confobj.n_pages_per_block
-        self.total_pages = self.flash_num_blocks * self.flash_npage_per_block
+    def __init__(self, confobj, env=None):
+        super(OutOfBandAreas, self).__init__(confobj)
 
-        # Key data structures
-        self.states = FlashBitmap2(confobj)
-        # ppn->lpn mapping stored in OOB, Note that for translation pages, this
-        # mapping is ppn -> m_vpn
-        self.ppn_to_lpn_mvpn = {}
         # Timestamp table PPN -> timestamp
         # Here are the rules:
         # 1. only programming a PPN updates the timestamp of PPN
@@ -1775,12 +2273,14 @@ class OutOfBandAreas(object):
         # 2. discarding, and reading a ppn does not change it.
         # 3. erasing a block will remove all the timestamps of the block
         # 4. so cur_timestamp can only be advanced by LBA operations
-        self.timestamp_table = {}
+        self.timestamp_table = PageArray(self.total_pages)
         self.cur_timestamp = 0
 
-        # flash block -> last invalidation time
-        # int -> timedate.timedate
+        # flash block -> last invalidation time, read from inv_clock()
         self.last_inv_time_of_block = {}
+        self.inv_clock = block_invalidation_clock(
+                confobj['block_invalidation_clock'],
+                lambda: self.cur_timestamp, env)
 
     ############# Time stamp related ############
     def _incr_timestamp(self):
@@ -1801,17 +2301,10 @@ class OutOfBandAreas(object):
         return self.ppn_to_lpn_mvpn[ppn]
 
     def erase_block(self, flash_block):
-        self.states.erase_block(flash_block)
+        super(OutOfBandAreas, self).erase_block(flash_block)
 
         start, end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(start, end):
-            try:
-                del self.ppn_to_lpn_mvpn[ppn]
-                # if you try to erase translation block here, it may fail,
-                # but it is expected.
-                del self.timestamp_table[ppn]
-            except KeyError:
-                pass
+        self.timestamp_table.clear_range(start, end)
 
         try:
             del self.last_inv_time_of_block[flash_block]
@@ -1849,8 +2342,8 @@ class OutOfBandAreas(object):
 
     def invalidate_ppn(self, ppn):
         self.states.invalidate_page(ppn)
-        block, _ = self.conf.page_to_block_off(ppn)
-        self.last_inv_time_of_block[block] = datetime.datetime.now()
+        block = ppn / self.flash_npage_per_block
+        self.last_inv_time_of_block[block] = self.inv_clock()
 
     def validate_ppns(self, ppns):
         for ppn in ppns:
@@ -1865,14 +2358,6 @@ class OutOfBandAreas(object):
         self.copy_timestamp(src_ppn = old_ppn, dst_ppn = new_ppn)
         self.relocate_data_page(lpn, old_ppn, new_ppn, update_time=False)
 
-    def lpns_of_block(self, flash_block):
-        s, e = self.conf.block_to_page_range(flash_block)
-        lpns = []
-        for ppn in range(s, e):
-            lpns.append(self.ppn_to_lpn_mvpn.get(ppn, 'NA'))
-
-        return lpns
-
 
 class Config(config.ConfigNCQFTL):
     def __init__(self, confdic = None):
@@ -1888,6 +2373,18 @@ class Config(config.ConfigNCQFTL):
             "mapping_cache_bytes": None, # cmt: cached mapping table
             "do_not_check_gc_setting": False,
             "write_gc_log": True,
+            # replacement policy of the mapping cache:
+            # 'LruCache', 'ArrayLruCache' (LRU kept in arrays indexed by
+            # row id, much less memory for large caches), 'ClockCache',
+            # 'SegmentedLruCache', 'TwoQueueCache' (2Q), or
+            # 'GroupLruCache' (LRU of translation pages)
+            "mapping_cache_policy": 'LruCache',
+            # number of translation pages prefetched ahead of sequential
+            # reads, 0 to disable prefetching
+            "mapping_cache_prefetch_depth": 0,
+            # time of the last invalidation in a block: 'logical' (number
+            # of LBA writes), 'simulated' (env.now) or 'wallclock'
+            "block_invalidation_clock": 'logical',
             }
         self.update(local_itmes)
         self['segment_bytes'] = 1*TB
@@ -1930,6 +2427,29 @@ class Config(config.ConfigNCQFTL):
     def n_cache_entries(self, value):
         self.mapping_cache_bytes = value * self['cache_entry_bytes']
 
+    def sizing_profile(self):
+        """
+        trace_profile if data structures are sized by it, see
+        size_by_trace_profile, otherwise None
+        """
+        if self.get('size_by_trace_profile', False) is not True:
+            return None
+        return self.get('trace_profile', None)
+
+    @property
+    def n_lpn_table_rows(self):
+        """
+        The cache never holds more entries than the translation pages
+        touched by the trace have. If it is sized by the trace profile
+        (see traceprofile), only that many rows are allocated.
+        """
+        profile = self.sizing_profile()
+        if profile is None or profile.get('n_unique_m_vpns', None) is None:
+            return self.n_cache_entries
+
+        return min(self.n_cache_entries,
+                profile['n_unique_m_vpns'] * self.n_mapping_entries_per_page)
+
     @property
     def cache_mapped_data_bytes(self):
         return self.n_cache_entries * self.page_size
@@ -1974,12 +2494,10 @@ class Config(config.ConfigNCQFTL):
         The sector extent has to be aligned with page
         return page_start, page_count
         """
-        page = sector / self.n_secs_per_page
-        page_end = (sector + count) / self.n_secs_per_page
-        page_count = page_end - page
-        if (sector + count) % self.n_secs_per_page != 0:
-            page_count += 1
-        return page, page_count
+        n_secs_per_page = self.n_secs_per_page
+        page = sector / n_secs_per_page
+        page_end = (sector + count + n_secs_per_page - 1) / n_secs_per_page
+        return page, page_end - page
 
     def lpn_to_m_vpn(self, lpn):
         return lpn / self.n_mapping_entries_per_page
@@ -1988,6 +2506,20 @@ class Config(config.ConfigNCQFTL):
         start_lpn = m_vpn * self.n_mapping_entries_per_page
         return range(start_lpn, start_lpn + self.n_mapping_entries_per_page)
 
+    @property
+    def n_lpns_on_flash(self):
+        """
+        Number of lpns the mappings on flash have room for at start: the
+        lpns of all translation pages, or, if it is sized by the trace
+        profile, of the translation pages up to its max lpn.
+        """
+        n_m_vpns = self.total_translation_pages()
+        profile = self.sizing_profile()
+        if profile is not None and profile.get('max_lpn', None) is not None:
+            n_m_vpns = min(n_m_vpns,
+                    self.lpn_to_m_vpn(profile['max_lpn']) + 1)
+        return n_m_vpns * self.n_mapping_entries_per_page
+
     def total_translation_pages(self):
         """
         total number of translation pages needed. It is:
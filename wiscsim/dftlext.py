@@ -16,7 +16,8 @@ import lrulist
 import recorder
 from utilities import utils
 from .blkpool import BlockPool
-from .bitmap import FlashBitmap2
+from .oobareas import (OutOfBandAreasBase, PageArray,
+        block_invalidation_clock)
 
 """
 This refactors Dftl
@@ -207,7 +208,11 @@ class Config(config.ConfigNCQFTL):
             "GC_threshold_ratio": 0.95,
             "GC_low_threshold_ratio": 0.9,
             "over_provisioning": 1.28,
-            "mapping_cache_bytes": None # cmt: cached mapping table
+            "mapping_cache_bytes": None, # cmt: cached mapping table
+            # time of the last invalidation in a block, the age in
+            # cost-benefit GC: 'logical' (number of LBA writes) or
+            # 'wallclock'
+            "block_invalidation_clock": 'logical',
             }
         self.update(local_itmes)
 
@@ -358,27 +363,18 @@ def channel_page_to_page(conf, channel, page_off):
     """
     return channel * conf.n_pages_per_channel + page_off
 
-class OutOfBandAreas(object):
+class OutOfBandAreas(OutOfBandAreasBase):
     """
     It is used to hold page state and logical page number of a page.
     It is not necessary to implement it as list. But the interface should
     appear to be so.  It consists of page state (bitmap) and logical page
-    number (dict).  Let's proivde more intuitive interfaces: OOB should accept
+    number (array).  Let's proivde more intuitive interfaces: OOB should accept
     events, and react accordingly to this event. The action may involve state
     and lpn_of_phy_page.
     """
-    def __init__(self, confobj):
-        self.conf = confobj
+    def __init__(self, confobj, env=None):
+        super(OutOfBandAreas, self).__init__(confobj)
 
-        self.flash_num_blocks = confobj.n_blocks_per_dev
-        self.flash_npage_per_block = confobj.n_pages_per_block
-        self.total_pages = self.flash_num_blocks * self.flash_npage_per_block
-
-        # Key data structures
-        self.states = FlashBitmap2(confobj)
-        # ppn->lpn mapping stored in OOB, Note that for translation pages, this
-        # mapping is ppn -> m_vpn
-        self.ppn_to_lpn_mvpn = {}
         # Timestamp table PPN -> timestamp
         # Here are the rules:
         # 1. only programming a PPN updates the timestamp of PPN
@@ -389,12 +385,14 @@ class OutOfBandAreas(object):
         # 2. discarding, and reading a ppn does not change it.
         # 3. erasing a block will remove all the timestamps of the block
         # 4. so cur_timestamp can only be advanced by LBA operations
-        self.timestamp_table = {}
+        self.timestamp_table = PageArray(self.total_pages)
         self.cur_timestamp = 0
 
-        # flash block -> last invalidation time
-        # int -> timedate.timedate
+        # flash block -> last invalidation time, read from inv_clock()
         self.last_inv_time_of_block = {}
+        self.inv_clock = block_invalidation_clock(
+                confobj['block_invalidation_clock'],
+                lambda: self.cur_timestamp, env)
 
     ############# Time stamp related ############
     def timestamp(self):
@@ -416,8 +414,8 @@ class OutOfBandAreas(object):
 
     def wipe_ppn(self, ppn):
         self.states.invalidate_page(ppn)
-        block, _ = self.conf.page_to_block_off(ppn)
-        self.last_inv_time_of_block[block] = datetime.datetime.now()
+        block = ppn / self.flash_npage_per_block
+        self.last_inv_time_of_block[block] = self.inv_clock()
 
         # It is OK to delay it until we erase the block
         # try:
@@ -428,17 +426,10 @@ class OutOfBandAreas(object):
             # pass
 
     def erase_block(self, flash_block):
-        self.states.erase_block(flash_block)
+        super(OutOfBandAreas, self).erase_block(flash_block)
 
         start, end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(start, end):
-            try:
-                del self.ppn_to_lpn_mvpn[ppn]
-                # if you try to erase translation block here, it may fail,
-                # but it is expected.
-                del self.timestamp_table[ppn]
-            except KeyError:
-                pass
+        self.timestamp_table.clear_range(start, end)
 
         del self.last_inv_time_of_block[flash_block]
 
@@ -468,14 +459,6 @@ class OutOfBandAreas(object):
         self.timestamp_copy(src_ppn = old_ppn, dst_ppn = new_ppn)
         self.new_write(lpn, old_ppn, new_ppn)
 
-    def lpns_of_block(self, flash_block):
-        s, e = self.conf.block_to_page_range(flash_block)
-        lpns = []
-        for ppn in range(s, e):
-            lpns.append(self.ppn_to_lpn_mvpn.get(ppn, 'NA'))
-
-        return lpns
-
 class CacheEntryData(object):
     """
     This is a helper class that store entry data for a LPN
@@ -1131,13 +1114,10 @@ class GarbageCollector(object):
             # raise RuntimeError("intentional exit")
 
     def clean_data_block(self, flash_block):
-        start, end = self.conf.block_to_page_range(flash_block)
-
         changes = []
-        for ppn in range(start, end):
-            if self.oob.states.is_page_valid(ppn):
-                change = self.move_data_page_to_new_location(ppn)
-                changes.append(change)
+        for ppn in self.oob.states.valid_pages_of_block(flash_block):
+            change = self.move_data_page_to_new_location(ppn)
+            changes.append(change)
 
         # change the mappings
         self.update_mapping_in_batch(changes)
@@ -1156,11 +1136,8 @@ class GarbageCollector(object):
         self.erase_block(flash_block, TRANS_CLEAN)
 
     def move_valid_pages(self, flash_block, mover_func):
-        start, end = self.conf.block_to_page_range(flash_block)
-
-        for ppn in range(start, end):
-            if self.oob.states.is_page_valid(ppn):
-                mover_func(ppn)
+        for ppn in self.oob.states.valid_pages_of_block(flash_block):
+            mover_func(ppn)
 
     def move_valid_data_pages(self, flash_block, mover_func):
         """
@@ -1168,11 +1145,8 @@ class GarbageCollector(object):
         1. Move all valid pages to new location.
         2. Aggregate mappings in the same translation page and update together
         """
-        start, end = self.conf.block_to_page_range(flash_block)
-
-        for ppn in range(start, end):
-            if self.oob.states.is_page_valid(ppn):
-                mover_func(ppn)
+        for ppn in self.oob.states.valid_pages_of_block(flash_block):
+            mover_func(ppn)
 
     def move_data_page_to_new_location(self, ppn):
         """
@@ -1357,7 +1331,12 @@ class GarbageCollector(object):
                 .format(blocknum, valid_ratio))
 
         age = current_time - self.oob.last_inv_time_of_block[blocknum]
-        age = age.total_seconds()
+        if isinstance(age, datetime.timedelta):
+            age = age.total_seconds()
+        else:
+            # a block invalidated at current_time is one tick old, so its
+            # benefit is not 0 as that of a block without invalid pages
+            age += 1
         bene_cost = age * ( 1 - valid_ratio ) / ( 2 * valid_ratio )
 
         return bene_cost, valid_ratio
@@ -1367,7 +1346,7 @@ class GarbageCollector(object):
         Calculate benefit/cost and put it to a priority queue
         """
         current_blocks = self.block_pool.current_blocks()
-        current_time = datetime.datetime.now()
+        current_time = self.oob.inv_clock()
         priority_q = Queue.PriorityQueue()
 
         for usedblocks, block_type in (
@@ -91,12 +91,10 @@ class Config(config.ConfigNCQFTL):
         The sector extent has to be aligned with page
         return page_start, page_count
         """
-        page = sector / self.n_secs_per_page
-        page_end = (sector + count) / self.n_secs_per_page
-        page_count = page_end - page
-        if (sector + count) % self.n_secs_per_page != 0:
-            page_count += 1
-        return page, page_count
+        n_secs_per_page = self.n_secs_per_page
+        page = sector / n_secs_per_page
+        page_end = (sector + count + n_secs_per_page - 1) / n_secs_per_page
+        return page, page_end - page
 
 
 class Ftl(ftlbuilder.FtlBuilder):
@@ -278,8 +276,8 @@ class Ftl(ftlbuilder.FtlBuilder):
         else:
             event_file_path = self.conf.get_ftlsim_events_output_path()
 
-        workload_line_iter = hostevent.FileLineIterator(event_file_path)
-        event_workload_iter = hostevent.EventIterator(self.conf, workload_line_iter)
+        event_workload_iter = hostevent.event_iter_from_file(self.conf,
+                event_file_path)
 
         parser = EventNCQParser(event_workload_iter)
         table = parser.parse()
@@ -1,3 +1,4 @@
+from collections import deque
 import simpy
 import random
 
@@ -118,20 +119,53 @@ def split_ext_by_segment(n_pages_per_segment, extent):
     return exts
 
 
+class GrantedRequest(simpy.events.Event):
+    """
+    A lock request that is granted at once. It is already processed, so
+    yielding it resumes the process right away, not through the event
+    queue.
+    """
+    def __init__(self, env):
+        self.env = env
+        self.callbacks = None
+        self._ok = True
+        self._value = None
+
+
 class LockPool(object):
+    """
+    A lock for each address. The lock of an address only exists while it
+    is held or waited for.
+    """
     def __init__(self, simpy_env):
-        self.resources = {} # addr: lock
+        # addr: [holding request, deque of waiting requests]
+        self.locks = {}
         self.env = simpy_env
         self.locked_addrs = set()
 
     def get_request(self, addr):
-        res = self.resources.setdefault(addr,
-                                    simpy.Resource(self.env, capacity = 1))
-        return res.request()
+        """
+        Yield the returned request to wait for the lock
+        """
+        lock = self.locks.get(addr, None)
+        if lock is None:
+            request = GrantedRequest(self.env)
+            self.locks[addr] = [request, deque()]
+        else:
+            request = self.env.event()
+            lock[1].append(request)
+        return request
 
     def release_request(self, addr, request):
-        res = self.resources[addr]
-        res.release(request)
+        lock = self.locks[addr]
+        assert lock[0] is request, "{} is not holding the lock".format(request)
+
+        if len(lock[1]) == 0:
+            del self.locks[addr]
+        else:
+            # hand over the lock in the order of requests
+            lock[0] = lock[1].popleft()
+            lock[0].succeed()
 
 
 random.seed(1)
@@ -7,7 +7,15 @@ class Host(object):
     def __init__(self, conf, simpy_env, event_iter):
         self.conf = conf
         self.env = simpy_env
-        self.event_iter = event_iter
+
+        if self.conf.get('coalesce_max_bytes', None) is not None:
+            self.coalescer = hostevent.EventCoalescer(event_iter,
+                    max_bytes = self.conf['coalesce_max_bytes'],
+                    max_gap = self.conf.get('coalesce_max_gap', None))
+            self.event_iter = self.coalescer
+        else:
+            self.coalescer = None
+            self.event_iter = event_iter
 
         self._ncq = NCQSingleQueue(
                 ncq_depth = self.conf['SSDFramework']['ncq_depth'],
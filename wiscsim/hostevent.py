@@ -1,15 +1,38 @@
+import array
+import itertools
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
 from ftlsim_commons import Extent
 from commons import *
+from utilities import utils
+from pyreuse.general.compressedfile import open_lines
+import tracecache
 
 class HostEventBase(object):
+    __slots__ = ()
+
     def get_operation(self):
         raise NotImplementedError
 
     def get_type(self):
         raise NotImplementedError
 
+    def release(self):
+        """
+        Called by the consumer when it is done with the event
+        """
+        pass
+
 
 class ControlEvent(HostEventBase):
+    # token and token_req are set by SimulatorDESSync.host_proc()
+    __slots__ = ('operation', 'arg1', 'arg2', 'arg3', 'action',
+            'token', 'token_req')
+
     def __init__(self, operation, arg1=None, arg2=None, arg3=None):
         self.operation = operation
         self.arg1 = arg1
@@ -29,6 +52,13 @@ class ControlEvent(HostEventBase):
 
 
 class Event(HostEventBase):
+    # Events are created for every request in a trace, slots save the
+    # memory and allocation of a __dict__ per event.
+    # token and token_req are set by SimulatorDESSync.host_proc()
+    __slots__ = ('pid', 'operation', 'offset', 'size', 'sync', 'timestamp',
+            'pre_wait_time', 'action', 'sector_size', 'lpn_extent', 'pool',
+            'token', 'token_req')
+
     def __init__(self, sector_size, pid, operation, offset, size,
             timestamp = None, pre_wait_time = None, sync = True, action = 'D'):
         self.pid = int(pid)
@@ -44,13 +74,23 @@ class Event(HostEventBase):
         assert self.offset % sector_size == 0,\
             "offset {} is not aligned with sector size {}.".format(
             self.offset, sector_size)
-        self.sector = self.offset / sector_size
-
         assert self.size % sector_size == 0, \
             "size {} is not multiple of sector size {}".format(
             self.size, sector_size)
+        self.sector_size = sector_size
+
+        # set by event iterators, see attach_lpn_extents()
+        self.lpn_extent = None
+        # set by EventPool.new_event()
+        self.pool = None
 
-        self.sector_count = self.size / sector_size
+    @property
+    def sector(self):
+        return self.offset / self.sector_size
+
+    @property
+    def sector_count(self):
+        return self.size / self.sector_size
 
     def get_operation(self):
         return self.operation
@@ -58,7 +98,14 @@ class Event(HostEventBase):
     def get_type(self):
         return 'Event'
 
+    def release(self):
+        if self.pool is not None:
+            self.pool.release(self)
+
     def get_lpn_extent(self, conf):
+        if self.lpn_extent is not None:
+            return self.lpn_extent
+
         lpn_start, lpn_count = conf.off_size_to_page_range(
                 self.offset, self.size, force_alignment=False)
         return Extent(lpn_start = lpn_start, lpn_count = lpn_count)
@@ -74,25 +121,103 @@ class Event(HostEventBase):
                         action = self.action)
 
 
+class EventPool(object):
+    """
+    Free list of Event objects. Events released by the consumer are
+    re-initialized by new_event() instead of allocating new ones. At most
+    max_free released events are kept.
+
+    Only consumers that do not keep references to events after
+    processing them (e.g. SimulatorNonDES) may release them.
+    """
+    def __init__(self, max_free=4096):
+        self.max_free = max_free
+        self._free = []
+
+    def new_event(self, **kwargs):
+        if len(self._free) > 0:
+            event = self._free.pop()
+            Event.__init__(event, **kwargs)
+        else:
+            event = Event(**kwargs)
+        event.pool = self
+        return event
+
+    def release(self, event):
+        if len(self._free) < self.max_free:
+            self._free.append(event)
+
+
+def new_event_func(event_pool):
+    if event_pool is None:
+        return Event
+    else:
+        return event_pool.new_event
+
+
 class FileLineIterator(object):
+    """
+    Iterate stripped lines of file_path. .gz, .bz2 and .xz files are
+    decompressed in a background thread.
+    """
     def __init__(self, file_path):
         self.file_path = file_path
 
     def __iter__(self):
-        with open(self.file_path, 'r') as f:
+        with open_lines(self.file_path) as f:
             for line in f:
                 line = line.strip()
                 yield line
 
 
+def lpn_extent_columns(page_size, offsets, sizes):
+    """
+    Convert columns of byte offsets and sizes to columns of lpn_start and
+    lpn_count in one pass. The result is the same as calling
+    conf.off_size_to_page_range(off, size, force_alignment=False) for
+    each request.
+    """
+    lpn_starts = array.array('l', [off // page_size for off in offsets])
+    lpn_counts = array.array('l',
+            [(size + page_size - 1) // page_size for size in sizes])
+    return lpn_starts, lpn_counts
+
+
+def attach_lpn_extents(events, page_size):
+    """
+    Precompute the LPN extents of a batch of events, so get_lpn_extent()
+    does not need to convert each request in the simulation loop.
+    """
+    lpn_starts, lpn_counts = lpn_extent_columns(page_size,
+            [event.offset for event in events],
+            [event.size for event in events])
+    for event, lpn_start, lpn_count in \
+            itertools.izip(events, lpn_starts, lpn_counts):
+        if lpn_count > 0:
+            event.lpn_extent = Extent(lpn_start=lpn_start, lpn_count=lpn_count)
+
+
+def chunks_of(iterable, n):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, n))
+        if len(chunk) == 0:
+            break
+        yield chunk
+
+
 class EventIterator(object):
     """
     Convert string line to event, and iter
     """
-    def __init__(self, conf, filelineiter):
+    def __init__(self, conf, filelineiter, chunk_events=4096,
+            event_pool=None):
         self.conf = conf
         self.sector_size = self.conf['sector_size']
+        self.page_size = self.conf.page_size
+        self.chunk_events = chunk_events
         self.filelineiter = filelineiter
+        self._new_event = new_event_func(event_pool)
         self.event_file_column_names = self.conf['event_file_column_names']
 
         self._translation = {'read': OP_READ, 'write': OP_WRITE,
@@ -113,10 +238,511 @@ class EventIterator(object):
 
         dic['operation'] = self._convert(dic['operation'])
 
-        return Event(**dic)
+        return self._new_event(**dic)
+
+    def __iter__(self):
+        for lines in chunks_of(self.filelineiter, self.chunk_events):
+            events = [self.str_to_event(line) for line in lines]
+            attach_lpn_extents(events, self.page_size)
+            for event in events:
+                yield event
+
+
+
+
+class EventCoalescer(object):
+    """
+    Merge runs of contiguous data events of the same operation and pid
+    into one event, as long as the merged event is at most max_bytes and
+    each event is issued at most max_gap seconds after the previous one
+    (max_gap None: no limit). Completion events (action 'C') are passed
+    through without ending the current run, so they may come out before
+    the merged event of their requests. Other events are passed through
+    unchanged and end the current run.
+
+    n_removed is the number of events merged into earlier ones.
+    """
+    MERGEABLE_OPS = (OP_READ, OP_WRITE, OP_DISCARD)
+
+    def __init__(self, event_iter, max_bytes, max_gap=None):
+        self.event_iter = event_iter
+        self.max_bytes = max_bytes
+        self.max_gap = max_gap
+        self.n_removed = 0
+
+    def _is_mergeable(self, event):
+        return isinstance(event, Event) and event.action == 'D' and \
+                event.operation in self.MERGEABLE_OPS and event.offset >= 0
+
+    def _can_append(self, run, last, event):
+        if event.operation != run.operation or event.pid != run.pid or \
+                event.offset != run.offset + run.size or \
+                run.size + event.size > self.max_bytes:
+            return False
+
+        if self.max_gap is None:
+            return True
+        elif last.timestamp in (None, NA) or event.timestamp in (None, NA):
+            return False
+        else:
+            return float(event.timestamp) - float(last.timestamp) \
+                    <= self.max_gap
 
     def __iter__(self):
-        for line in self.filelineiter:
-            yield self.str_to_event(line)
+        # run is the merged event being built, last is its last member
+        run = None
+        last = None
+        for event in self.event_iter:
+            if run is not None and self._is_mergeable(event) and \
+                    self._can_append(run, last, event):
+                run.size += event.size
+                run.lpn_extent = None
+                last = event
+                self.n_removed += 1
+                continue
+
+            if isinstance(event, Event) and event.action == 'C':
+                yield event
+                continue
+
+            if run is not None:
+                yield run
+                run = None
+
+            if self._is_mergeable(event):
+                run = event
+                last = event
+            else:
+                yield event
+
+        if run is not None:
+            yield run
+
+
+############### Binary columnar trace format ###############
+#
+# Layout of a binary trace file:
+#
+#   | header | pid column | action column | operation column | ... |
+#
+# The header is BINTRACE_HEADER (magic, version, n_events). Each column
+# follows the previous one and holds n_events fixed-width items, in the
+# order of BINTRACE_COLUMNS. Keeping columns apart lets readers pull one
+# column (e.g. offset) without touching the rest of the file.
+
+BINTRACE_MAGIC = 'WSCTRACE'
+BINTRACE_VERSION = 1
+BINTRACE_HEADER = struct.Struct('<8sIQ')
+BINTRACE_SUFFIX = '.bin'
+
+# (column name, struct format of one item)
+BINTRACE_COLUMNS = (
+        ('pid',           'i'),
+        ('action',        'c'),
+        ('operation',     'B'),
+        ('offset',        'q'),
+        ('size',          'q'),
+        ('timestamp',     'd'),
+        ('pre_wait_time', 'd'),
+        ('sync',          '?'),
+        )
+
+# operation code in binary file <-> operation in event file/Event
+BINTRACE_OP_NAMES = ('read', 'write', 'discard')
+BINTRACE_OPS = (OP_READ, OP_WRITE, OP_DISCARD)
+_BINTRACE_OP_CODES = {'read': 0, 'write': 1, 'discard': 2,
+        OP_READ: 0, OP_WRITE: 1, OP_DISCARD: 2}
+
+NA = 'NA'
 
 
+def binary_trace_path(text_path):
+    """
+    blkparse-events-for-ftlsim.txt -> blkparse-events-for-ftlsim.bin
+    """
+    return os.path.splitext(text_path)[0] + BINTRACE_SUFFIX
+
+
+def is_binary_trace(path):
+    with open(path, 'rb') as f:
+        magic = f.read(len(BINTRACE_MAGIC))
+    return magic == BINTRACE_MAGIC
+
+
+def _text_to_float(value):
+    if value == NA or value is None:
+        return float('nan')
+    return float(value)
+
+
+def _float_or_na(value):
+    if value != value:
+        # nan
+        return NA
+    return value
+
+
+def _float_to_text(value):
+    "repr() of a float reads back as the same float"
+    value = _float_or_na(value)
+    if value == NA:
+        return NA
+    return repr(value)
+
+
+def _text_to_sync(value):
+    return not str(value) in ('False', '0', NA, '')
+
+
+def _sync_to_text(value):
+    return 'True' if value else 'False'
+
+
+class BinaryTraceWriter(object):
+    """
+    Write events to a binary trace file. Columns are spooled to temporary
+    files while writing, so memory usage does not depend on trace length.
+    The file only appears at path after close(). If the writing fails,
+    abort() drops the spools and no file is created.
+    """
+    def __init__(self, path, buffer_events=65536):
+        self.path = path
+        self.buffer_events = buffer_events
+        self.n_events = 0
+
+        self._spools = [tempfile.TemporaryFile() for _ in BINTRACE_COLUMNS]
+        self._buffers = [[] for _ in BINTRACE_COLUMNS]
+
+    def write(self, pid, action, operation, offset, size,
+            timestamp=NA, pre_wait_time=NA, sync=True):
+        values = (int(pid), str(action)[0], _BINTRACE_OP_CODES[operation],
+                int(offset), int(size), _text_to_float(timestamp),
+                _text_to_float(pre_wait_time), _text_to_sync(sync))
+        for buf, value in zip(self._buffers, values):
+            buf.append(value)
+        self.n_events += 1
+
+        if len(self._buffers[0]) >= self.buffer_events:
+            self._flush_buffers()
+
+    def write_row(self, row):
+        """
+        row is a dict of column name -> value, such as the dicts used to
+        create lines of event files. Missing columns are 'NA'.
+        """
+        self.write(pid=row['pid'], action=row.get('action', 'D'),
+                operation=row['operation'], offset=row['offset'],
+                size=row['size'], timestamp=row.get('timestamp', NA),
+                pre_wait_time=row.get('pre_wait_time', NA),
+                sync=row.get('sync', True))
+
+    def write_event(self, event):
+        self.write(pid=event.pid, action=event.action,
+                operation=event.operation, offset=event.offset,
+                size=event.size, timestamp=event.timestamp,
+                pre_wait_time=event.pre_wait_time, sync=event.sync)
+
+    def _flush_buffers(self):
+        for (_, fmt), spool, buf in zip(BINTRACE_COLUMNS, self._spools,
+                self._buffers):
+            spool.write(struct.pack('<{}{}'.format(len(buf), fmt), *buf))
+            del buf[:]
+
+    def close(self):
+        self._flush_buffers()
+        utils.prepare_dir_for_path(self.path)
+
+        # a failed copy leaves only the tmp file, readers never see a
+        # partial trace at path
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(BINTRACE_HEADER.pack(BINTRACE_MAGIC, BINTRACE_VERSION,
+                self.n_events))
+            for spool in self._spools:
+                spool.seek(0)
+                shutil.copyfileobj(spool, f)
+                spool.close()
+        os.rename(tmp_path, self.path)
+
+    def abort(self):
+        for spool in self._spools:
+            spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class BinaryTrace(object):
+    """
+    Memory-mapped, read-only view of a binary trace file.
+    """
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            header = f.read(BINTRACE_HEADER.size)
+        if len(header) < BINTRACE_HEADER.size:
+            raise RuntimeError("{} is not a binary trace".format(path))
+        magic, version, self.n_events = BINTRACE_HEADER.unpack(header)
+        if magic != BINTRACE_MAGIC:
+            raise RuntimeError("{} is not a binary trace".format(path))
+        if version != BINTRACE_VERSION:
+            raise RuntimeError("Binary trace version {} is not supported"\
+                .format(version))
+
+        # column name -> (byte offset of column, struct format of item)
+        self._layout = {}
+        col_start = BINTRACE_HEADER.size
+        for name, fmt in BINTRACE_COLUMNS:
+            self._layout[name] = (col_start, fmt)
+            col_start += struct.calcsize(fmt) * self.n_events
+
+        if os.path.getsize(path) != col_start:
+            raise RuntimeError("{} should have {} bytes for {} events, "\
+                "it has {}".format(path, col_start, self.n_events,
+                    os.path.getsize(path)))
+
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.n_events
+
+    def column(self, name, start=0, count=None):
+        """
+        Return a tuple of items [start, start+count) of column name
+        """
+        if count is None:
+            count = self.n_events - start
+        count = max(0, min(count, self.n_events - start))
+
+        col_start, fmt = self._layout[name]
+        item_size = struct.calcsize(fmt)
+        return struct.unpack_from('<{}{}'.format(count, fmt), self._mm,
+                col_start + start * item_size)
+
+    def operations(self, start=0, count=None):
+        return [BINTRACE_OPS[code]
+                for code in self.column('operation', start, count)]
+
+    def lpn_extents(self, page_size, start=0, count=None):
+        """
+        Return (lpn_starts, lpn_counts) of events [start, start+count)
+        """
+        return lpn_extent_columns(page_size,
+                self.column('offset', start, count),
+                self.column('size', start, count))
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+# An lpn extents file holds (lpn_start, lpn_count) of each event of a
+# binary trace for one page size, after LPNEXT_HEADER (magic, version,
+# n_events, page_size). The trace cache keeps them next to the traces, so
+# sweeps do not convert offsets and sizes again.
+
+LPNEXT_MAGIC = 'WSCLPNEX'
+LPNEXT_VERSION = 1
+LPNEXT_HEADER = struct.Struct('<8sIQQ')
+LPNEXT_SUFFIX = '.lpnext'
+
+
+def write_lpn_extents(bin_path, page_size, ext_path, chunk_events=65536):
+    """
+    Write the lpn extents of binary trace bin_path for page_size to
+    ext_path
+    """
+    trace = BinaryTrace(bin_path)
+    try:
+        utils.prepare_dir_for_path(ext_path)
+        with open(ext_path, 'wb') as f:
+            f.write(LPNEXT_HEADER.pack(LPNEXT_MAGIC, LPNEXT_VERSION,
+                len(trace), page_size))
+            for start in xrange(0, len(trace), chunk_events):
+                lpn_starts, lpn_counts = trace.lpn_extents(page_size, start,
+                        chunk_events)
+                pairs = array.array('l', [0]) * (2 * len(lpn_starts))
+                pairs[0::2] = lpn_starts
+                pairs[1::2] = lpn_counts
+                f.write(struct.pack('<{}q'.format(len(pairs)), *pairs))
+    finally:
+        trace.close()
+
+
+class LpnExtents(object):
+    """
+    Memory-mapped, read-only view of an lpn extents file
+    """
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            header = f.read(LPNEXT_HEADER.size)
+        if len(header) < LPNEXT_HEADER.size:
+            raise RuntimeError("{} is not an lpn extents file".format(path))
+        magic, version, self.n_events, self.page_size = \
+                LPNEXT_HEADER.unpack(header)
+        if magic != LPNEXT_MAGIC or version != LPNEXT_VERSION:
+            raise RuntimeError("{} is not an lpn extents file of version {}"\
+                .format(path, LPNEXT_VERSION))
+
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.n_events
+
+    def columns(self, start=0, count=None):
+        """
+        Return (lpn_starts, lpn_counts) of events [start, start+count)
+        """
+        if count is None:
+            count = self.n_events - start
+        count = max(0, min(count, self.n_events - start))
+
+        pairs = struct.unpack_from('<{}q'.format(2 * count), self._mm,
+                LPNEXT_HEADER.size + 16 * start)
+        return pairs[0::2], pairs[1::2]
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+class BinaryEventIterator(object):
+    """
+    Iterate events in a binary trace file. It produces the same events
+    as EventIterator does for the corresponding text event file: timestamp
+    and sync are text, pre_wait_time is a float or NA. A timestamp reads
+    back as the same float, but not always as the same text, e.g.
+    '0.000000000' becomes '0.0'.
+
+    lpn extents are read from lpn_extents_path if it is given, see
+    write_lpn_extents(), otherwise they are computed.
+    """
+    def __init__(self, conf, file_path, chunk_events=4096, event_pool=None,
+            lpn_extents_path=None):
+        self.conf = conf
+        self.sector_size = self.conf['sector_size']
+        self.page_size = self.conf.page_size
+        self.file_path = file_path
+        self.chunk_events = chunk_events
+        self._new_event = new_event_func(event_pool)
+        self.lpn_extents_path = lpn_extents_path
+
+    def _open_lpn_extents(self, trace):
+        if self.lpn_extents_path is None:
+            return None
+
+        extents = LpnExtents(self.lpn_extents_path)
+        if extents.page_size != self.page_size or \
+                len(extents) != len(trace):
+            extents.close()
+            raise RuntimeError("{} does not match {} with page size {}"\
+                .format(self.lpn_extents_path, self.file_path,
+                    self.page_size))
+        return extents
+
+    def __iter__(self):
+        trace = BinaryTrace(self.file_path)
+        extents = self._open_lpn_extents(trace)
+        try:
+            for start in xrange(0, len(trace), self.chunk_events):
+                columns = [trace.column(name, start, self.chunk_events)
+                        for name, _ in BINTRACE_COLUMNS]
+                columns[2] = [BINTRACE_OPS[code] for code in columns[2]]
+                if extents is None:
+                    lpn_starts, lpn_counts = lpn_extent_columns(
+                            self.page_size, columns[3], columns[4])
+                else:
+                    lpn_starts, lpn_counts = extents.columns(start,
+                            self.chunk_events)
+
+                for pid, action, operation, offset, size, timestamp, \
+                        pre_wait_time, sync, lpn_start, lpn_count in \
+                        itertools.izip(*(columns + [lpn_starts, lpn_counts])):
+                    event = self._new_event(sector_size=self.sector_size,
+                            pid=pid,
+                            operation=operation, offset=offset, size=size,
+                            timestamp=_float_to_text(timestamp),
+                            pre_wait_time=_float_or_na(pre_wait_time),
+                            sync=_sync_to_text(sync), action=action)
+                    if lpn_count > 0:
+                        event.lpn_extent = Extent(lpn_start=lpn_start,
+                                lpn_count=lpn_count)
+                    yield event
+        finally:
+            trace.close()
+            if extents is not None:
+                extents.close()
+
+
+def convert_event_file_to_binary(conf, text_path, bin_path=None):
+    """
+    One-time conversion of a text event file to a binary trace file.
+    Return the path of the binary trace.
+    """
+    if bin_path is None:
+        bin_path = binary_trace_path(text_path)
+
+    column_names = conf['event_file_column_names']
+    with BinaryTraceWriter(bin_path) as writer:
+        for line in FileLineIterator(text_path):
+            items = line.split()
+            if len(column_names) != len(items):
+                raise RuntimeError("Lengths not equal: {} {}".format(
+                    column_names, items))
+            writer.write_row(dict(zip(column_names, items)))
+
+    return bin_path
+
+
+def ensure_binary_trace(conf, text_path):
+    """
+    Convert text_path to binary only if there is no up-to-date binary
+    trace next to it.
+    """
+    bin_path = binary_trace_path(text_path)
+    if not os.path.exists(bin_path) or \
+            os.path.getmtime(bin_path) < os.path.getmtime(text_path):
+        convert_event_file_to_binary(conf, text_path, bin_path)
+    return bin_path
+
+
+def event_iter_from_file(conf, file_path):
+    """
+    Return an event iterator of file_path, which can be a text event file
+    or a binary trace. If conf['trace_cache_dir'] is set, text event files
+    are parsed, and their lpn extents computed, through the trace cache.
+    Otherwise, if
+    conf['event_file_format'] is 'binary', they are converted to binary
+    traces next to the text files.
+
+    If conf['event_pool_size'] > 0, events are taken from an EventPool
+    and recycled when the consumer releases them.
+    """
+    pool_size = conf.get('event_pool_size', 0)
+    event_pool = EventPool(pool_size) if pool_size > 0 else None
+
+    if is_binary_trace(file_path):
+        return BinaryEventIterator(conf, file_path, event_pool=event_pool)
+    elif conf.get('trace_cache_dir', None) is not None:
+        cache = tracecache.TraceCache(conf['trace_cache_dir'])
+        bin_path, lpn_extents_path = cache.binary_trace_and_lpn_extents(conf,
+                file_path)
+        return BinaryEventIterator(conf, bin_path, event_pool=event_pool,
+                lpn_extents_path=lpn_extents_path)
+    elif conf.get('event_file_format', 'text') == 'binary':
+        return BinaryEventIterator(conf, ensure_binary_trace(conf, file_path),
+                event_pool=event_pool)
+    else:
+        return EventIterator(conf, FileLineIterator(file_path),
+                event_pool=event_pool)
@@ -1,3 +1,4 @@
+import array
 import collections
 
 class Node(object):
@@ -87,6 +88,9 @@ class LinkedList(object):
         self.add_before(node, old_head)
 
     def add_to_tail(self, node):
+        if self.size == 0:
+            # the new node is also the head
+            self._head = node
         self.add_before(node, self._end_guard)
 
     def move_toward_head_by_one(self, node):
@@ -275,6 +279,146 @@ class LruCache(collections.MutableMapping):
         return str(t)
 
 
+class ArrayLruCache(collections.MutableMapping):
+    """
+    The same interface as LruCache, for at most max_entries integer keys.
+    Instead of a Node per entry, each entry takes a slot and the links,
+    keys and values are kept in arrays preallocated and indexed by slot.
+
+    If slot_of is given, slot_of(value) decides the slot of a new entry,
+    for example the row id of a row in LpnTable. Otherwise slots are
+    taken from a free list.
+    """
+    def __init__(self, max_entries, slot_of = None):
+        self.max_entries = max_entries
+        self._slot_of = slot_of
+
+        # slot max_entries is the list guard,
+        # its next is the head (most recent), its prev is the tail
+        self._guard = max_entries
+        self._next = array.array('l', [self._guard]) * (max_entries + 1)
+        self._prev = array.array('l', [self._guard]) * (max_entries + 1)
+        self._keys = array.array('l', [0]) * max_entries
+        self._values = [None] * max_entries
+
+        self.table = {}
+        if slot_of is None:
+            self._free_slots = range(max_entries - 1, -1, -1)
+
+    def _unlink(self, slot):
+        prev_slot = self._prev[slot]
+        next_slot = self._next[slot]
+        self._next[prev_slot] = next_slot
+        self._prev[next_slot] = prev_slot
+
+    def _link_after(self, slot, prev_slot):
+        next_slot = self._next[prev_slot]
+        self._prev[slot] = prev_slot
+        self._next[slot] = next_slot
+        self._next[prev_slot] = slot
+        self._prev[next_slot] = slot
+
+    def _new_slot(self, key, value):
+        assert not self.table.has_key(key)
+        if self._slot_of is None:
+            slot = self._free_slots.pop()
+        else:
+            slot = self._slot_of(value)
+            assert self._values[slot] is None, \
+                    "slot {} is taken".format(slot)
+        self._keys[slot] = key
+        self._values[slot] = value
+        self.table[key] = slot
+        return slot
+
+    def has_key(self, key):
+        return self.table.has_key(key)
+
+    def keys(self):
+        return self.table.keys()
+
+    def get(self, key, default = None):
+        if self.table.has_key(key):
+            # will affect list order
+            return self.__getitem__(key)
+        else:
+            # will not affect list order
+            return default
+
+    def __getitem__(self, key):
+        slot = self.table[key]
+        self._unlink(slot)
+        self._link_after(slot, self._guard)
+        return self._values[slot]
+
+    def __delitem__(self, key):
+        slot = self.table.pop(key)
+        # the links of slot are kept, so iterations can go on
+        # after deleting the current item
+        self._unlink(slot)
+        self._values[slot] = None
+        if self._slot_of is None:
+            self._free_slots.append(slot)
+
+    def __setitem__(self, key, value):
+        if self.table.has_key(key):
+            # update
+            slot = self.table[key]
+            self._values[slot] = value
+            self._unlink(slot)
+        else:
+            # create new
+            slot = self._new_slot(key, value)
+        self._link_after(slot, self._guard)
+
+    def add_as_least_used(self, key, value):
+        slot = self._new_slot(key, value)
+        self._link_after(slot, self._prev[self._guard])
+
+    def __iter__(self):
+        # most recent -> least recent
+        slot = self._next[self._guard]
+        while slot != self._guard:
+            yield self._keys[slot]
+            slot = self._next[slot]
+
+    def __reversed__(self):
+        slot = self._prev[self._guard]
+        while slot != self._guard:
+            yield self._keys[slot]
+            slot = self._prev[slot]
+
+    def items(self):
+        return self.least_to_most_items()
+
+    def __len__(self):
+        return len(self.table)
+
+    def peek(self, key):
+        return self._values[self.table[key]]
+
+    def orderless_update(self, key, value):
+        self._values[self.table[key]] = value
+
+    def least_to_most_items(self):
+        slot = self._prev[self._guard]
+        while slot != self._guard:
+            yield self._keys[slot], self._values[slot]
+            slot = self._prev[slot]
+
+    def least_recently_used_key(self):
+        return self._keys[self._prev[self._guard]]
+
+    def most_recently_used_key(self):
+        return self._keys[self._next[self._guard]]
+
+    def victim_key(self):
+        return self.least_recently_used_key()
+
+    def __repr__(self):
+        return str([(key, self.peek(key)) for key in self])
+
+
 
 """
 Segmented LRU (SLRU)
@@ -420,6 +564,21 @@ class SegmentedLruCache(object):
             self.table[key] = node
             self._add_new_node(node)
 
+    def add_as_least_used(self, key, value):
+        assert not self.table.has_key(key)
+        node = Node(key = key, value = value)
+        self.table[key] = node
+        node.owner_list = self.probationary_list
+        self.probationary_list.add_to_tail(node)
+
+    def least_to_most_items(self):
+        """
+        in the order of eviction: probationary, then protected
+        """
+        for l in (self.probationary_list, self.protected_list):
+            for node in reversed(l):
+                yield node.key, node.value
+
     def victim_key(self):
         """
         Higher level class will handle the eviction.
@@ -441,7 +600,7 @@ class SegmentedLruCache(object):
         self._remove_item(key)
 
     def __iter__(self):
-        return self.table.keys()
+        return iter(self.table)
 
     def __len__(self):
         return len(self.table)
@@ -451,6 +610,266 @@ class SegmentedLruCache(object):
             'Probationary List:' + repr(self.probationary_list)
 
 
+class ClockCache(collections.MutableMapping):
+    """
+    CLOCK replacement, kept as the equivalent second-chance FIFO list.
+
+    A hit only sets the referenced bit of an entry. Entries are in the
+    order of insertion and the hand is at the oldest one. When a victim
+    is deleted, the referenced entries the hand has passed get their
+    second chance: their bits are cleared and they become the newest.
+    """
+    def __init__(self):
+        self.table = {}
+        # head is the newest
+        self.linked_list = LinkedList()
+
+    def has_key(self, key):
+        return self.table.has_key(key)
+
+    def keys(self):
+        return self.table.keys()
+
+    def __getitem__(self, key):
+        node = self.table[key]
+        node.referenced = True
+        return node.value
+
+    def __setitem__(self, key, value):
+        if self.table.has_key(key):
+            node = self.table[key]
+            node.value = value
+            node.referenced = True
+        else:
+            node = Node(key = key, value = value)
+            node.referenced = False
+            self.linked_list.add_to_head(node)
+            self.table[key] = node
+
+    def add_as_least_used(self, key, value):
+        assert not self.table.has_key(key)
+        node = Node(key = key, value = value)
+        node.referenced = False
+        self.linked_list.add_to_tail(node)
+        self.table[key] = node
+
+    def __delitem__(self, key):
+        node = self.table.pop(key)
+
+        # sweep the hand to node
+        passed = self.linked_list.tail()
+        while passed is not node:
+            newer = passed.prev
+            if passed.referenced is True:
+                passed.referenced = False
+                self.linked_list.move_to_head(passed)
+            passed = newer
+
+        self.linked_list.delete(node)
+
+    def peek(self, key):
+        return self.table[key].value
+
+    def least_to_most_items(self):
+        """
+        in the order that the hand would evict them
+        """
+        for referenced in (False, True):
+            for node in reversed(self.linked_list):
+                if node.referenced is referenced:
+                    yield node.key, node.value
+
+    def items(self):
+        return self.least_to_most_items()
+
+    def victim_key(self):
+        for key, _ in self.least_to_most_items():
+            return key
+        return None
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self):
+        return len(self.table)
+
+
+class TwoQueueCache(collections.MutableMapping):
+    """
+    2Q replacement (Johnson and Shasha, VLDB'94).
+
+    New entries go to A1in, a FIFO queue. A1out remembers the keys
+    recently evicted from A1in; an entry inserted again while its key is
+    in A1out goes to Am, an LRU queue. Hits in A1in do not change the
+    order. Victims are taken from A1in while it has more than
+    kin_ratio * max_entries entries, otherwise from Am.
+
+    Entries added by add_as_least_used() (e.g. prefetched) are admitted
+    to A1in at their first hit.
+    """
+    def __init__(self, max_entries, kin_ratio = 0.25, kout_ratio = 0.5):
+        self.max_a1in = max(int(max_entries * kin_ratio), 1)
+        self.max_a1out = max(int(max_entries * kout_ratio), 1)
+
+        self.a1in = LinkedList()
+        self.am = LinkedList()
+        # ghost keys, oldest first
+        self.a1out = collections.OrderedDict()
+
+        self.table = {}
+
+    def has_key(self, key):
+        return self.table.has_key(key)
+
+    def keys(self):
+        return self.table.keys()
+
+    def _hit(self, node):
+        if node.owner_list is self.am:
+            self.am.move_to_head(node)
+        elif node.referenced is False:
+            node.referenced = True
+            self.a1in.move_to_head(node)
+
+    def __getitem__(self, key):
+        node = self.table[key]
+        self._hit(node)
+        return node.value
+
+    def __setitem__(self, key, value):
+        if self.table.has_key(key):
+            node = self.table[key]
+            node.value = value
+            self._hit(node)
+            return
+
+        node = Node(key = key, value = value)
+        node.referenced = True
+        if key in self.a1out:
+            del self.a1out[key]
+            node.owner_list = self.am
+        else:
+            node.owner_list = self.a1in
+        node.owner_list.add_to_head(node)
+        self.table[key] = node
+
+    def add_as_least_used(self, key, value):
+        assert not self.table.has_key(key)
+        node = Node(key = key, value = value)
+        node.referenced = False
+        node.owner_list = self.a1in
+        self.a1in.add_to_tail(node)
+        self.table[key] = node
+
+    def __delitem__(self, key):
+        node = self.table.pop(key)
+        node.owner_list.delete(node)
+
+        if node.owner_list is self.a1in and node.referenced is True:
+            self.a1out[key] = True
+            if len(self.a1out) > self.max_a1out:
+                self.a1out.popitem(last = False)
+
+    def peek(self, key):
+        return self.table[key].value
+
+    def least_to_most_items(self):
+        if len(self.a1in) > self.max_a1in:
+            lists = (self.a1in, self.am)
+        else:
+            lists = (self.am, self.a1in)
+        for l in lists:
+            for node in reversed(l):
+                yield node.key, node.value
+
+    def items(self):
+        return self.least_to_most_items()
+
+    def victim_key(self):
+        for key, _ in self.least_to_most_items():
+            return key
+        return None
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self):
+        return len(self.table)
+
+
+class GroupLruCache(collections.MutableMapping):
+    """
+    LRU over groups of keys, group_of(key) is the group of key (e.g. the
+    translation page of a lpn). A hit makes the whole group the most
+    recently used. Victims come from the least recently used group.
+    """
+    def __init__(self, group_of):
+        self.group_of = group_of
+        self.table = {}
+        # group -> {key: True}
+        self.groups = LruCache()
+
+    def has_key(self, key):
+        return self.table.has_key(key)
+
+    def keys(self):
+        return self.table.keys()
+
+    def __getitem__(self, key):
+        value = self.table[key]
+        # move the group to the most recent end
+        self.groups[self.group_of(key)]
+        return value
+
+    def __setitem__(self, key, value):
+        group = self.group_of(key)
+        self.table[key] = value
+        if self.groups.has_key(group):
+            self.groups[group][key] = True
+        else:
+            self.groups[group] = {key: True}
+
+    def add_as_least_used(self, key, value):
+        assert not self.table.has_key(key)
+        group = self.group_of(key)
+        self.table[key] = value
+        if self.groups.has_key(group):
+            self.groups.peek(group)[key] = True
+        else:
+            self.groups.add_as_least_used(group, {key: True})
+
+    def __delitem__(self, key):
+        del self.table[key]
+        group = self.group_of(key)
+        members = self.groups.peek(group)
+        del members[key]
+        if len(members) == 0:
+            del self.groups[group]
+
+    def peek(self, key):
+        return self.table[key]
+
+    def least_to_most_items(self):
+        for group, members in self.groups.least_to_most_items():
+            for key in members.keys():
+                if self.table.has_key(key):
+                    yield key, self.table[key]
+
+    def items(self):
+        return self.least_to_most_items()
+
+    def victim_key(self):
+        for key, _ in self.least_to_most_items():
+            return key
+        return None
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self):
+        return len(self.table)
+
+
 class LruDict(collections.MutableMapping):
     # __getitem__, __setitem__, __delitem__, __iter__, __len__
     """
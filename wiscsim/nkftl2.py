@@ -10,7 +10,7 @@ import config
 import ftlbuilder
 import recorder
 from utilities import utils
-from .bitmap import FlashBitmap2
+from .oobareas import OutOfBandAreasBase
 from wiscsim.devblockpool import *
 from ftlsim_commons import *
 from commons import *
@@ -143,17 +143,12 @@ class GlobalHelper(object):
         self.cur_lba_op_timestamp += 1
 
 
-class OutOfBandAreas(object):
+class OutOfBandAreas(OutOfBandAreasBase):
     def __init__(self, confobj):
-        self.conf = confobj
-
-        self.flash_num_blocks = confobj.n_blocks_per_dev
-        self.flash_npage_per_block = confobj.n_pages_per_block
-        self.total_pages = self.flash_num_blocks * self.flash_npage_per_block
+        super(OutOfBandAreas, self).__init__(confobj)
 
-        # Key data structures
-        self.states = FlashBitmap2(confobj)
-        self.ppn_to_lpn = {}
+        # there are no translation pages in nkftl, all pages map to lpns
+        self.ppn_to_lpn = self.ppn_to_lpn_mvpn
 
     def display_bitmap_by_block(self):
         npages_per_block = self.conf.n_pages_per_block
@@ -177,22 +172,6 @@ class OutOfBandAreas(object):
 
         # It is OK to delay deleting ppn_to_lpn[ppn] until we erase the block
 
-    def erase_block(self, flash_block):
-        """
-        Note that it does not call flash.block_erase(), because that's not
-        something OOB
-        """
-        self.states.erase_block(flash_block)
-
-        start, end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(start, end):
-            try:
-                del self.ppn_to_lpn[ppn]
-                # if you try to erase translation block here, it may fail,
-                # but it is expected.
-            except KeyError:
-                pass
-
     def remap(self, lpn, old_ppn, new_ppn):
         """
         It remaps lpn from old_ppn to new_ppn
@@ -208,34 +187,16 @@ class OutOfBandAreas(object):
             self.states.invalidate_page(old_ppn)
 
 
-    def lpns_of_block(self, flash_block):
-        s, e = self.conf.block_to_page_range(flash_block)
-        lpns = []
-        for ppn in range(s, e):
-            lpns.append(self.ppn_to_lpn.get(ppn, 'NA'))
-
-        return lpns
-
     def is_any_page_valid(self, flash_block):
-        ppn_start, ppn_end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(ppn_start, ppn_end):
-            if self.states.is_page_valid(ppn):
-                return True
-        return False
+        return self.states.block_valid_count(flash_block) > 0
 
     def are_all_pages_invalid(self, flash_block):
-        ppn_start, ppn_end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(ppn_start, ppn_end):
-            if not self.states.is_page_invalid(ppn):
-                return False
-        return True
+        return self.states.block_invalid_count(flash_block) == \
+                self.flash_npage_per_block
 
     def are_all_pages_erased(self, flash_block):
-        ppn_start, ppn_end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(ppn_start, ppn_end):
-            if not self.states.is_page_erased(ppn):
-                return False
-        return True
+        return self.states.block_valid_count(flash_block) == 0 and \
+                self.states.block_invalid_count(flash_block) == 0
 
 
 
@@ -1029,15 +990,11 @@ class GarbageCollector(object):
         self.recorder.count_me("garbage_collection", 'full_merge')
 
         # Find all the logical blocks
-        ppn_start, ppn_end = self.conf.block_to_page_range(log_pbn)
         logical_blocks = set()
-        for ppn in range(ppn_start, ppn_end):
-            is_valid = self.oob.states.is_page_valid(ppn)
-            # print 'ppn {} is valid: {}'.format(ppn, is_valid)
-            if is_valid == True:
-                lpn = self.oob.ppn_to_lpn[ppn]
-                logical_block, _ = self.conf.page_to_block_off(lpn)
-                logical_blocks.add(logical_block)
+        for ppn in self.oob.states.valid_pages_of_block(log_pbn):
+            lpn = self.oob.ppn_to_lpn[ppn]
+            logical_block, _ = self.conf.page_to_block_off(lpn)
+            logical_blocks.add(logical_block)
 
         # Move all the pages of a logical block to new block
         for logical_block in logical_blocks:
@@ -0,0 +1,103 @@
+import array
+import datetime
+
+from .bitmap import create_page_states
+
+
+def block_invalidation_clock(kind, logical_clock, env=None):
+    """
+    Return a function that tells the time of a page invalidation.
+    kind is 'logical' (logical_clock()), 'simulated' (env.now) or
+    'wallclock' (datetime.datetime.now(), which makes GC decisions depend
+    on the speed of the host).
+    """
+    if kind == 'logical':
+        return logical_clock
+    elif kind == 'simulated':
+        if env is None:
+            raise ValueError("simulated clock needs a simpy env")
+        return lambda: env.now
+    elif kind == 'wallclock':
+        return datetime.datetime.now
+    else:
+        raise ValueError("{} is not a valid block invalidation clock".format(
+            kind))
+
+
+class PageArray(object):
+    """
+    A dict of ppn -> non-negative int, kept as one typed array entry per
+    page. A missing ppn holds EMPTY. It supports the dict operations the
+    FTLs use, plus clearing a range of ppns at once.
+    """
+    EMPTY = -1
+
+    def __init__(self, n_pages):
+        self._values = array.array('l', [self.EMPTY]) * n_pages
+
+    def __getitem__(self, ppn):
+        value = self._values[ppn]
+        if value == self.EMPTY:
+            raise KeyError(ppn)
+        return value
+
+    def __setitem__(self, ppn, value):
+        self._values[ppn] = value
+
+    def __delitem__(self, ppn):
+        if self._values[ppn] == self.EMPTY:
+            raise KeyError(ppn)
+        self._values[ppn] = self.EMPTY
+
+    def __contains__(self, ppn):
+        return self._values[ppn] != self.EMPTY
+
+    def __len__(self):
+        "It counts all pages, O(n_pages) in C"
+        return len(self._values) - self._values.count(self.EMPTY)
+
+    def get(self, ppn, default=None):
+        value = self._values[ppn]
+        if value == self.EMPTY:
+            return default
+        return value
+
+    def clear_range(self, start, end):
+        self._values[start:end] = array.array('l', [self.EMPTY]) * (end - start)
+
+    def values_of_range(self, start, end, default=None):
+        return [default if value == self.EMPTY else value
+                for value in self._values[start:end]]
+
+
+class OutOfBandAreasBase(object):
+    """
+    Page states and the ppn -> lpn (or m_vpn for translation pages) of
+    every page, which the OOB of each FTL builds on.
+    """
+    def __init__(self, confobj):
+        self.conf = confobj
+
+        self.flash_num_blocks = confobj.n_blocks_per_dev
+        self.flash_npage_per_block = confobj.n_pages_per_block
+        self.total_pages = self.flash_num_blocks * self.flash_npage_per_block
+
+        # Key data structures
+        self.states = create_page_states(confobj)
+        # ppn->lpn mapping stored in OOB, Note that for translation pages, this
+        # mapping is ppn -> m_vpn
+        self.ppn_to_lpn_mvpn = PageArray(self.total_pages)
+
+    def erase_block(self, flash_block):
+        """
+        Note that it does not call flash.block_erase(), because that's not
+        something OOB
+        """
+        self.states.erase_block(flash_block)
+
+        start, end = self.conf.block_to_page_range(flash_block)
+        self.ppn_to_lpn_mvpn.clear_range(start, end)
+
+    def lpns_of_block(self, flash_block):
+        s, e = self.conf.block_to_page_range(flash_block)
+        return self.ppn_to_lpn_mvpn.values_of_range(s, e, 'NA')
@@ -16,6 +16,7 @@ import nkftl2
 import recorder
 import hostevent
 import dftldes
+import tracewindow
 import ftlcounter
 
 from commons import *
@@ -62,12 +63,23 @@ class SimulatorDESNew(Simulator):
     def __init__(self, conf, event_iter):
         super(SimulatorDESNew, self).__init__(conf, event_iter)
 
+        if self.conf['warm_up_events'] is not None or \
+                self.conf['warm_up_bytes'] is not None or \
+                self.conf['measure_events'] is not None:
+            self.window = tracewindow.TraceWindow(self.conf, event_iter)
+            event_iter = self.window
+        else:
+            self.window = None
+
         self.env = simpy.Environment()
         self.host = Host(self.conf, self.env, event_iter)
         self.ssd = ssdframework.Ssd(self.conf, self.env,
                 self.host.get_ncq(), self.recorder)
 
     def run(self):
+        if self.window is not None:
+            self.window.warm_up(self.ssd.ftl, self.env, self.recorder)
+
         self.env.process(self.host.run())
         self.env.process(self.ssd.run())
 
@@ -79,8 +91,16 @@ class SimulatorDESNew(Simulator):
         return "SimulatorDESNew"
 
     def record_post_run_stats(self):
+        # time spent cleaning during warm-up is not measured
+        if self.window is not None:
+            start_time = self.window.end_time
+        else:
+            start_time = 0
         self.recorder.set_result_by_one_key(
-                'simulation_duration', self.env.now)
+                'simulation_duration', self.env.now - start_time)
+        if self.host.coalescer is not None:
+            self.recorder.set_result_by_one_key(
+                    'n_coalesced_events', self.host.coalescer.n_removed)
         pprint.pprint(self.recorder.get_result_summary())
 
         self.recorder.close()
@@ -132,6 +152,8 @@ class SimulatorNonDES(Simulator):
         cnt = 0
         for event in self.event_iter:
             self.process_event(event)
+            # the event is not used after processing, it can be recycled
+            event.release()
             cnt += 1
             if cnt % 5000 == 0:
                 print '|',
@@ -1,4 +1,5 @@
 from collections import Counter
+import heapq
 
 TFREE = 'TAGFREE'
 
@@ -8,8 +9,14 @@ MOST_ERASED = 'most'
 
 class TagBlockPool(object):
     def __init__(self, n, tags):
+        # Blocks of each tag in the order they got the tag. change_tag()
+        # leaves a None hole where the block was, holes are removed by
+        # get_blocks_of_tag() or when a list gets too many of them.
         self._tag_subpool = {tag:[] for tag in tags}
         self._tag_subpool[TFREE] = range(n)
+        self._n_holes = {tag:0 for tag in self._tag_subpool}
+        # position of each block in the list of its tag
+        self._position = range(n)
 
         # {blocknum: count}
         self._erasure_cnt = Counter()
@@ -19,18 +26,76 @@ class TagBlockPool(object):
         for block in range(n):
             self._erasure_cnt[block] = 0
 
+        # Each tag has a heap of its blocks ordered from the least erased
+        # block and one ordered from the most erased block, with ties
+        # broken as Counter.most_common() does. An entry is
+        # (key, key, version of the block); changing the tag of a block
+        # bumps its version, which makes its old entries stale. Stale
+        # entries are dropped when they get to the top or when a heap is
+        # rebuilt.
+        self._version = [0] * n
+        self._least_heaps = {}
+        self._most_heaps = {}
+        for tag in self._tag_subpool:
+            self._rebuild_heaps(tag)
+
+    def _least_entry(self, blocknum):
+        return (self._erasure_cnt[blocknum], -blocknum,
+                self._version[blocknum])
+
+    def _most_entry(self, blocknum):
+        return (-self._erasure_cnt[blocknum], blocknum,
+                self._version[blocknum])
+
+    def _rebuild_heaps(self, tag):
+        blocks = self.get_blocks_of_tag(tag)
+        self._least_heaps[tag] = [self._least_entry(b) for b in blocks]
+        self._most_heaps[tag] = [self._most_entry(b) for b in blocks]
+        heapq.heapify(self._least_heaps[tag])
+        heapq.heapify(self._most_heaps[tag])
+
+    def _add_to_heaps(self, tag, blocknum):
+        if len(self._least_heaps[tag]) > 2 * self.count_blocks(tag) + 64:
+            # too many stale entries
+            self._rebuild_heaps(tag)
+        else:
+            heapq.heappush(self._least_heaps[tag], self._least_entry(blocknum))
+            heapq.heappush(self._most_heaps[tag], self._most_entry(blocknum))
+
+    def _remove_holes(self, tag):
+        blocks = [b for b in self._tag_subpool[tag] if b is not None]
+        for i, blocknum in enumerate(blocks):
+            self._position[blocknum] = i
+        self._tag_subpool[tag] = blocks
+        self._n_holes[tag] = 0
+
     def get_blocks_of_tag(self, tag):
+        if self._n_holes[tag] > 0:
+            self._remove_holes(tag)
         return self._tag_subpool[tag]
 
     def change_tag(self, blocknum, src, dst):
-        self._tag_subpool[src].remove(blocknum)
-        self._tag_subpool[dst].append(blocknum)
+        src_blocks = self._tag_subpool[src]
+        pos = self._position[blocknum]
+        if pos >= len(src_blocks) or src_blocks[pos] != blocknum:
+            raise ValueError("block {} is not tagged {}".format(blocknum, src))
+        src_blocks[pos] = None
+        self._n_holes[src] += 1
+        if self._n_holes[src] > len(src_blocks) / 2:
+            self._remove_holes(src)
+
+        dst_blocks = self._tag_subpool[dst]
+        self._position[blocknum] = len(dst_blocks)
+        dst_blocks.append(blocknum)
 
         if dst == TFREE:
             self._erasure_cnt[blocknum] += 1
 
+        self._version[blocknum] += 1
+        self._add_to_heaps(dst, blocknum)
+
     def count_blocks(self, tag):
-        return len(self._tag_subpool[tag])
+        return len(self._tag_subpool[tag]) - self._n_holes[tag]
 
     def pick(self, tag, choice=LEAST_ERASED):
         return self.get_least_or_most_erased_block(tag, choice)
@@ -61,21 +126,28 @@ class TagBlockPool(object):
 
     def get_least_or_most_erased_blocks(self, tag, choice, nblocks):
         if choice == LEAST_ERASED:
-            blocks_by_cnt = reversed(self._erasure_cnt.most_common())
+            heap = self._least_heaps[tag]
+            sign = -1
         elif choice == MOST_ERASED:
-            blocks_by_cnt = self._erasure_cnt.most_common()
+            heap = self._most_heaps[tag]
+            sign = 1
         else:
             raise NotImplementedError
 
-        tag_blocks = self.get_blocks_of_tag(tag)
-
-        # iterate from least used to most used
+        # pop the first nblocks live entries, then put them back
         blocks = []
-        for blocknum, count in blocks_by_cnt:
-            if blocknum in tag_blocks:
-                blocks.append(blocknum)
-                if len(blocks) == nblocks:
-                    break
+        entries = []
+        while len(heap) > 0 and len(blocks) < nblocks:
+            entry = heapq.heappop(heap)
+            blocknum = sign * entry[1]
+            if entry[2] != self._version[blocknum]:
+                # stale
+                continue
+            blocks.append(blocknum)
+            entries.append(entry)
+
+        for entry in entries:
+            heapq.heappush(heap, entry)
 
         return blocks
 
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+
+import hostevent
+from utilities import utils
+
+
+class TraceCache(object):
+    """
+    Content-addressed cache of parsed event files.
+
+    A text event file is parsed to a binary trace only once. The binary
+    trace is stored under a key made of the hash of the text file's
+    content and the parsing parameters (event_file_column_names and
+    sector_size). Later runs on the same trace, even from other
+    sub-experiments or other copies of the file, load the binary trace
+    directly.
+
+    Digests of text files are remembered by (path, size, mtime), so a file
+    is not hashed again until it changes.
+
+    The lpn extents of a binary trace depend on the page size, they are
+    cached in one file per page size next to the trace.
+    """
+    HASH_CHUNK_BYTES = 4 * 2**20
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        utils.prepare_dir(self.cache_dir)
+
+    def binary_trace(self, conf, text_path):
+        """
+        Return path of the cached binary trace of text_path. The trace is
+        parsed and added to the cache if it is not there.
+        """
+        return self._binary_trace(self.key(conf, text_path), conf, text_path)
+
+    def binary_trace_and_lpn_extents(self, conf, text_path):
+        """
+        Return paths of the cached binary trace of text_path and of its
+        lpn extents for conf.page_size. They are added to the cache if
+        they are not there.
+        """
+        key = self.key(conf, text_path)
+        bin_path = self._binary_trace(key, conf, text_path)
+
+        ext_path = self._entry_path(
+                '{}-page{}'.format(key, conf.page_size),
+                hostevent.LPNEXT_SUFFIX)
+        if not os.path.exists(ext_path):
+            tmp_path = self._tmp_path(ext_path)
+            hostevent.write_lpn_extents(bin_path, conf.page_size, tmp_path)
+            os.rename(tmp_path, ext_path)
+
+        return bin_path, ext_path
+
+    def _binary_trace(self, key, conf, text_path):
+        bin_path = self._entry_path(key, hostevent.BINTRACE_SUFFIX)
+
+        if os.path.exists(bin_path):
+            print 'Trace cache hit', text_path
+        else:
+            print 'Trace cache miss', text_path
+            tmp_path = self._tmp_path(bin_path)
+            hostevent.convert_event_file_to_binary(conf, text_path, tmp_path)
+            # other sub-experiments may be filling the same entry,
+            # renaming is atomic so readers never see partial files.
+            os.rename(tmp_path, bin_path)
+
+        return bin_path
+
+    def key(self, conf, text_path):
+        params = {
+            'content_digest': self.file_digest(text_path),
+            'event_file_column_names': conf['event_file_column_names'],
+            'sector_size': conf['sector_size'],
+            'bintrace_version': hostevent.BINTRACE_VERSION,
+            }
+        return hashlib.sha1(json.dumps(params, sort_keys=True)).hexdigest()
+
+    def file_digest(self, path):
+        stat_path = self._stat_path(path)
+        if os.path.exists(stat_path):
+            with open(stat_path, 'r') as f:
+                return f.read().strip()
+
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(self.HASH_CHUNK_BYTES)
+                if not chunk:
+                    break
+                sha.update(chunk)
+        digest = sha.hexdigest()
+
+        tmp_path = self._tmp_path(stat_path)
+        with open(tmp_path, 'w') as f:
+            f.write(digest)
+        os.rename(tmp_path, stat_path)
+
+        return digest
+
+    def _stat_path(self, path):
+        st = os.stat(path)
+        stat_key = "{} {} {}".format(os.path.abspath(path), st.st_size,
+                st.st_mtime)
+        return os.path.join(self.cache_dir,
+                'stat-' + hashlib.sha1(stat_key).hexdigest())
+
+    def _entry_path(self, key, suffix):
+        return os.path.join(self.cache_dir, 'trace-' + key + suffix)
+
+    def _tmp_path(self, path):
+        return "{}.tmp.{}".format(path, os.getpid())
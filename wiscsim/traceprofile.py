@@ -0,0 +1,147 @@
+import itertools
+
+import bitarray
+
+import hostevent
+from commons import *
+
+
+class TraceProfile(object):
+    """
+    Statistics of a trace gathered in one pass, before simulation:
+    number of requests and bytes of each operation, the max LPN, and the
+    set of touched LPNs (kept as a bitmap indexed by LPN).
+    """
+    OPS = (OP_READ, OP_WRITE, OP_DISCARD)
+    OP_NAMES = {OP_READ: 'read', OP_WRITE: 'write', OP_DISCARD: 'discard'}
+
+    def __init__(self, page_size):
+        self.page_size = page_size
+        # number of data requests
+        self.n_events = 0
+        self.counts = dict((op, 0) for op in self.OPS)
+        self.bytes = dict((op, 0) for op in self.OPS)
+        self.max_lpn = None
+        self._touched = bitarray.bitarray()
+
+    def add_requests(self, operations, sizes, lpn_starts, lpn_counts):
+        """
+        Add a chunk of requests, given as columns
+        """
+        for op, size, lpn_start, lpn_count in itertools.izip(
+                operations, sizes, lpn_starts, lpn_counts):
+            self.n_events += 1
+            if not op in self.counts or lpn_count <= 0 or lpn_start < 0:
+                continue
+
+            self.counts[op] += 1
+            self.bytes[op] += size
+
+            end_lpn = lpn_start + lpn_count
+            self._grow(end_lpn)
+            self._touched[lpn_start:end_lpn] = True
+            if self.max_lpn is None or end_lpn - 1 > self.max_lpn:
+                self.max_lpn = end_lpn - 1
+
+    def _grow(self, n_bits):
+        if n_bits > len(self._touched):
+            more = bitarray.bitarray(max(n_bits, 2 * len(self._touched))
+                    - len(self._touched))
+            more.setall(False)
+            self._touched.extend(more)
+
+    @property
+    def n_unique_lpns(self):
+        return self._touched.count()
+
+    @property
+    def footprint_bytes(self):
+        return self.n_unique_lpns * self.page_size
+
+    def n_unique_m_vpns(self, n_entries_per_page):
+        """
+        Number of translation pages that have touched LPNs
+        """
+        n = 0
+        for start in xrange(0, len(self._touched), n_entries_per_page):
+            if self._touched[start:start + n_entries_per_page].any():
+                n += 1
+        return n
+
+    def to_dict(self, n_entries_per_page=None):
+        """
+        The statistics, without the LPN bitmap. n_unique_m_vpns is included
+        if n_entries_per_page is given.
+        """
+        d = {
+            'n_events': self.n_events,
+            'max_lpn': self.max_lpn,
+            'n_unique_lpns': self.n_unique_lpns,
+            'footprint_bytes': self.footprint_bytes,
+            }
+        for op in self.OPS:
+            name = self.OP_NAMES[op]
+            d['n_' + name] = self.counts[op]
+            d[name + '_bytes'] = self.bytes[op]
+        if n_entries_per_page is not None:
+            d['n_unique_m_vpns'] = self.n_unique_m_vpns(n_entries_per_page)
+        return d
+
+
+def profile_event_iter(conf, event_iter, profile=None, chunk_events=4096):
+    if profile is None:
+        profile = TraceProfile(conf.page_size)
+
+    for events in hostevent.chunks_of(event_iter, chunk_events):
+        events = [event for event in events
+                if isinstance(event, hostevent.Event) and event.action == 'D']
+        sizes = [event.size for event in events]
+        lpn_starts, lpn_counts = hostevent.lpn_extent_columns(conf.page_size,
+                [event.offset for event in events], sizes)
+        profile.add_requests([event.operation for event in events], sizes,
+                lpn_starts, lpn_counts)
+
+    return profile
+
+
+def profile_binary_trace(conf, bin_path, profile=None, chunk_events=65536):
+    """
+    Profile a binary trace by its columns, without creating events
+    """
+    if profile is None:
+        profile = TraceProfile(conf.page_size)
+
+    trace = hostevent.BinaryTrace(bin_path)
+    try:
+        for start in xrange(0, len(trace), chunk_events):
+            actions = trace.column('action', start, chunk_events)
+            data_rows = [i for i, action in enumerate(actions) if action == 'D']
+            operations = trace.operations(start, chunk_events)
+            offsets = trace.column('offset', start, chunk_events)
+            sizes = trace.column('size', start, chunk_events)
+
+            sizes = [sizes[i] for i in data_rows]
+            lpn_starts, lpn_counts = hostevent.lpn_extent_columns(
+                    conf.page_size, [offsets[i] for i in data_rows], sizes)
+            profile.add_requests([operations[i] for i in data_rows], sizes,
+                    lpn_starts, lpn_counts)
+    finally:
+        trace.close()
+
+    return profile
+
+
+def profile_event_files(conf, paths):
+    """
+    Profile all event files in paths as one trace. Binary traces, and
+    text files that event_iter_from_file() reads as binary traces, are
+    profiled by columns.
+    """
+    profile = TraceProfile(conf.page_size)
+    for path in paths:
+        event_iter = hostevent.event_iter_from_file(conf, path)
+        if isinstance(event_iter, hostevent.BinaryEventIterator):
+            profile_binary_trace(conf, event_iter.file_path, profile)
+        else:
+            profile_event_iter(conf, event_iter, profile)
+    return profile
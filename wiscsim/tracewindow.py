@@ -0,0 +1,112 @@
+import hostevent
+from commons import *
+
+
+class TraceWindow(object):
+    """
+    Simulate a window of a long trace.
+
+    warm_up() applies the first warm_up_events data events, or the data
+    events in the first warm_up_bytes bytes, to FTL state through the
+    FTL's fast non-DES path: no flash timing, no mapping cache and no
+    recording. Iterating the window then yields the next measure_events
+    data events (None: the rest of the trace) for the DES.
+
+    Control events during warm-up are dropped, except that recorder
+    enable/disable and timestamps take effect when warm-up ends. Control
+    events after the window are still passed on.
+
+    Cleaning during warm-up goes through the DES and advances env.now,
+    end_time is env.now when warm-up ends, where the measurement starts.
+    """
+    def __init__(self, conf, event_iter):
+        self.conf = conf
+        self.warm_up_events = conf['warm_up_events']
+        self.warm_up_bytes = conf['warm_up_bytes']
+        self.measure_events = conf['measure_events']
+
+        self._event_iter = iter(event_iter)
+        self.n_warm_up_events = 0
+        self.n_warm_up_bytes = 0
+        self.end_time = 0
+
+    def _is_data_event(self, event):
+        return isinstance(event, hostevent.Event) and event.action == 'D' \
+                and event.offset >= 0 and \
+                event.operation in (OP_READ, OP_WRITE, OP_DISCARD)
+
+    def _warm_up_done(self):
+        if self.warm_up_events is not None and \
+                self.n_warm_up_events >= self.warm_up_events:
+            return True
+        if self.warm_up_bytes is not None and \
+                self.n_warm_up_bytes >= self.warm_up_bytes:
+            return True
+        return self.warm_up_events is None and self.warm_up_bytes is None
+
+    def warm_up(self, ftl, env, recorder):
+        """
+        ftl has to provide warm_up_write_ext() and warm_up_discard_ext().
+        It runs before any other process is in env.
+        """
+        if not self._warm_up_done() and \
+                not hasattr(ftl, 'warm_up_write_ext'):
+            raise NotImplementedError("{} does not support warm-up".format(
+                type(ftl).__name__))
+
+        recorder_enabled = recorder.enabled
+        recorder.disable()
+        timestamp_keys = []
+
+        while not self._warm_up_done():
+            try:
+                event = self._event_iter.next()
+            except StopIteration:
+                break
+
+            if not self._is_data_event(event):
+                if event.operation == OP_ENABLE_RECORDER:
+                    recorder_enabled = True
+                elif event.operation == OP_DISABLE_RECORDER:
+                    recorder_enabled = False
+                elif event.operation == OP_REC_TIMESTAMP:
+                    timestamp_keys.append(event.arg1)
+                continue
+
+            extent = event.get_lpn_extent(self.conf)
+            if event.operation == OP_WRITE:
+                ftl.warm_up_write_ext(extent)
+            elif event.operation == OP_DISCARD:
+                ftl.warm_up_discard_ext(extent)
+
+            self.n_warm_up_events += 1
+            self.n_warm_up_bytes += event.size
+
+            if ftl.is_cleaning_needed():
+                # cleaning moves data through the mapping cache, write the
+                # cache back so warm-up can keep updating mappings on flash
+                env.run(until=env.process(ftl.clean()))
+                env.run(until=env.process(ftl.purge_trans_cache()))
+
+        self.end_time = env.now
+        print 'Warmed up with {} events, {} MB'.format(self.n_warm_up_events,
+                self.n_warm_up_bytes / MB)
+
+        if recorder_enabled is True:
+            recorder.enable()
+        for key in timestamp_keys:
+            recorder.set_result_by_one_key(key, env.now)
+        recorder.set_result_by_one_key('warm_up_events', self.n_warm_up_events)
+        recorder.set_result_by_one_key('warm_up_bytes', self.n_warm_up_bytes)
+        recorder.set_result_by_one_key('warm_up_duration', self.end_time)
+
+    def __iter__(self):
+        n_measured = 0
+        for event in self._event_iter:
+            if self._is_data_event(event):
+                if self.measure_events is not None and \
+                        n_measured >= self.measure_events:
+                    # past the window, only control events are passed on
+                    continue
+                n_measured += 1
+            yield event
@@ -4,6 +4,7 @@ import random
 import config
 import workload
 from wiscsim import hostevent
+from wiscsim import traceprofile
 from commons import *
 
 from pyreuse.general.zipf import ZipfGenerator
@@ -427,6 +428,22 @@ class BlktraceEvents(LBAWorkloadGenerator):
         if str(self.stop_on_bytes).lower() in ('inf', 'infinity', 'infinit'):
             self.stop_on_bytes = float('inf')
 
+        if self.conf['profile_trace'] is True:
+            self.profile_trace()
+
+    def profile_trace(self):
+        """
+        Profile the events before simulation and save the result to
+        conf['trace_profile']. Simulators size data structures by it only
+        with conf['size_by_trace_profile'].
+        """
+        profile = traceprofile.profile_event_files(self.conf,
+                [self.mkfs_event_path, self.ftlsim_event_path])
+        n_entries_per_page = getattr(self.conf, 'n_mapping_entries_per_page',
+                None)
+        self.conf['trace_profile'] = profile.to_dict(n_entries_per_page)
+        print 'Trace profile', self.conf['trace_profile']
+
     def __iter__(self):
         barriergen = BarrierGen(self.conf.ssd_ncq_depth())
 
@@ -449,8 +466,8 @@ class BlktraceEvents(LBAWorkloadGenerator):
         yield hostevent.ControlEvent(operation=OP_REC_BW)
 
     def prepfs_events(self):
-        prepfs_line_iter = hostevent.FileLineIterator(self.mkfs_event_path)
-        event_prepfs_iter = hostevent.EventIterator(self.conf, prepfs_line_iter)
+        event_prepfs_iter = hostevent.event_iter_from_file(self.conf,
+                self.mkfs_event_path)
 
         for event in event_prepfs_iter:
             yield event
@@ -464,8 +481,8 @@ class BlktraceEvents(LBAWorkloadGenerator):
         yield hostevent.ControlEvent(operation=OP_REC_TIMESTAMP,
                 arg1='interest_workload_start')
 
-        workload_line_iter = hostevent.FileLineIterator(self.ftlsim_event_path)
-        event_workload_iter = hostevent.EventIterator(self.conf, workload_line_iter)
+        event_workload_iter = hostevent.event_iter_from_file(self.conf,
+                self.ftlsim_event_path)
 
         total_rw_bytes = 0
         for event in event_workload_iter:
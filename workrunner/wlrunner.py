@@ -47,7 +47,10 @@ class WorkloadRunner(object):
             to_ftlsim_path = self.conf.get_ftlsim_events_output_path_mkfs(),
             sector_size = self.conf['sector_size'],
             padding_bytes = self.conf['dev_padding'],
-            do_sort = self.conf['sort_block_trace']
+            do_sort = self.conf['sort_block_trace'],
+            sort_run_rows = self.conf['blkparse_sort_run_rows'],
+            sort_tmp_dir = self.conf['blkparse_sort_tmp_dir'],
+            n_workers = self.conf['blkparse_n_workers']
             )
 
         # blktracer for running workload
@@ -58,7 +61,10 @@ class WorkloadRunner(object):
             to_ftlsim_path = self.conf.get_ftlsim_events_output_path(),
             sector_size = self.conf['sector_size'],
             padding_bytes = self.conf['dev_padding'],
-            do_sort = self.conf['sort_block_trace']
+            do_sort = self.conf['sort_block_trace'],
+            sort_run_rows = self.conf['blkparse_sort_run_rows'],
+            sort_tmp_dir = self.conf['blkparse_sort_tmp_dir'],
+            n_workers = self.conf['blkparse_n_workers']
             )
 
         self.aging_workload = eval("workload.{wlclass}(confobj = self.conf, " \
@@ -345,9 +351,8 @@ class WorkloadRunner(object):
         yield hostevent.ControlEvent(operation=OP_REC_BW)
 
     def prepfs_events(self):
-        prepfs_line_iter = hostevent.FileLineIterator(
+        event_prepfs_iter = hostevent.event_iter_from_file(self.conf,
             self.conf.get_ftlsim_events_output_path_mkfs())
-        event_prepfs_iter = hostevent.EventIterator(self.conf, prepfs_line_iter)
 
         for event in event_prepfs_iter:
             yield event
@@ -361,9 +366,8 @@ class WorkloadRunner(object):
         yield hostevent.ControlEvent(operation=OP_REC_TIMESTAMP,
                 arg1='interest_workload_start')
 
-        workload_line_iter = hostevent.FileLineIterator(
+        event_workload_iter = hostevent.event_iter_from_file(self.conf,
             self.conf.get_ftlsim_events_output_path())
-        event_workload_iter = hostevent.EventIterator(self.conf, workload_line_iter)
 
         for event in event_workload_iter:
             yield event